@@ -0,0 +1,306 @@
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from generator import BasicGenerator, WEIGHT_PRESETS
+from puzzle import Puzzle
+from run import read_input
+from solver_brute import BruteForceSolver
+from solver_counting import EliminationCounter
+from solver_logic import LogicBasedSolver
+from stats import GeneratorStats, SolverStats, summarize
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+STAGES = ["brute", "logic", "count", "generate", "startup", "regress"]
+# runs of the "regress" stage are stopped after this many seconds (the reproducers are meant to be slow)
+REGRESS_TIME_LIMIT = 30.0
+# modules whose cold import time is tracked by the "startup" stage
+STARTUP_MODULES = ["rule", "solver_logic", "generator", "run", "solve_batch"]
+# run in a fresh interpreter, prints the time to import a module
+IMPORT_CODE = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+# run in a fresh interpreter, prints the time to import the solver and solve the given puzzle by logic
+FIRST_SOLVE_CODE = """
+import json
+import sys
+import time
+start = time.perf_counter()
+from puzzle import Puzzle
+from solver_logic import LogicBasedSolver
+puzzle_raw = json.loads(sys.argv[1])
+puzzle = Puzzle(puzzle_raw["n"])
+puzzle.add_rules(rules_str=puzzle_raw["rules"])
+LogicBasedSolver(puzzle).solve(max_steps={logic_steps})
+print(time.perf_counter() - start)
+"""
+
+
+def time_call(f, repeat):
+    """
+    best wall-clock time of `repeat` calls of `f`
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_fresh_process(code, args=()):
+    """
+    time reported by `code` run in a fresh interpreter (so nothing is imported or cached in memory yet)
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", code] + list(args),
+        cwd=os.path.dirname(os.path.abspath(__file__)), check=True, capture_output=True, text=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def load_puzzles(path, max_puzzles=None):
+    puzzles = []
+    for puzzle_raw in read_input(path)[:max_puzzles]:
+        puzzle = Puzzle(puzzle_raw["n"])
+        puzzle.add_rules(rules_str=puzzle_raw["rules"])
+        puzzles.append(puzzle)
+    return puzzles
+
+
+def run_benchmarks(paths, stages, max_puzzles=None, logic_steps=4, generate_sizes=(5, 6), generate_seeds=(2018, 2019, 2020),
+                   generate_presets=("easy",), repeat=1, startup_runs=5, regressions_path=None, verbose=False):
+    """
+    time solvers on every puzzle from `paths` and the generator for fixed seeds,
+    the cold start (imports, first solve of each file) over `startup_runs` fresh interpreters,
+    and each reproducer of the regression corpus at `regressions_path` (default: the bundled one, see `latency_hunt.py`)
+    with its own target
+    returns {"<stage>/<file or n=..>": [timings]}, {"<preset>/n=..": GeneratorStats} and {"n=..": SolverStats}
+    """
+    timings = defaultdict(list)
+    generator_stats = defaultdict(GeneratorStats)
+    solver_stats = defaultdict(SolverStats)
+    for path in paths:
+        name = os.path.basename(path)
+        puzzles = load_puzzles(path, max_puzzles)
+        if "startup" in stages and puzzles:
+            puzzle_raw = json.dumps(read_input(path)[0])
+            for _ in range(startup_runs):
+                t = time_fresh_process(FIRST_SOLVE_CODE.format(logic_steps=logic_steps), [puzzle_raw])
+                timings["first_solve/" + name].append(t)
+        for puzzle in puzzles:
+            if "brute" in stages:
+                t = time_call(lambda: BruteForceSolver(puzzle).solve(), repeat)
+                timings["brute/" + name].append(t)
+                timings["brute/n={n}".format(n=puzzle.n)].append(t)
+            if "logic" in stages:
+                solvers = []
+
+                def solve_logic():
+                    solvers.append(LogicBasedSolver(puzzle))
+                    solvers[-1].solve(max_steps=logic_steps)
+
+                t = time_call(solve_logic, repeat)
+                timings["logic/" + name].append(t)
+                timings["logic/n={n}".format(n=puzzle.n)].append(t)
+                solver_stats["n={n}".format(n=puzzle.n)].merge(solvers[-1].stats)
+            if "count" in stages:
+                # exact count of the puzzle without its last rule (typically many solutions)
+                partial = Puzzle.with_rules(puzzle.n, puzzle.rules[:-1])
+                t = time_call(lambda: EliminationCounter(partial).count(), repeat)
+                timings["count/" + name].append(t)
+                timings["count/n={n}".format(n=puzzle.n)].append(t)
+        if verbose:
+            print("benchmarked", name, "({cnt} puzzles)".format(cnt=len(puzzles)), file=sys.stderr)
+    if "generate" in stages:
+        for preset in generate_presets:
+            for n in generate_sizes:
+                key = "{preset}/n={n}".format(preset=preset, n=n)
+                for seed in generate_seeds:
+                    bg = BasicGenerator(n, seed=seed, custom_weights=WEIGHT_PRESETS[preset])
+                    t = time_call(lambda: bg.generate(), 1)
+                    timings["generate/" + key].append(t)
+                    generator_stats[key].merge(bg.stats)
+                if verbose:
+                    print("benchmarked generator,", key, file=sys.stderr)
+    if "startup" in stages:
+        for module in STARTUP_MODULES:
+            for _ in range(startup_runs):
+                timings["import/" + module].append(time_fresh_process(IMPORT_CODE.format(module=module)))
+        if verbose:
+            print("benchmarked startup", file=sys.stderr)
+    if "regress" in stages:
+        # imported here, since it brings in all solver engines
+        from latency_hunt import load_regressions, measure
+        regressions = load_regressions() if regressions_path is None else load_regressions(regressions_path)
+        for entry in regressions:
+            puzzle = Puzzle(entry["n"])
+            puzzle.add_rules(rules_str=entry["rules"])
+            t = min(measure(puzzle, entry["target"], time_limit=REGRESS_TIME_LIMIT)["time"] for _ in range(repeat))
+            timings["regress/" + entry["target"]].append(t)
+        if verbose:
+            print("benchmarked regression corpus", file=sys.stderr)
+    return timings, generator_stats, solver_stats
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    compare medians against the baseline
+    returns [(key, baseline median, current median, ratio)] for those slower by more than `threshold` times
+    """
+    regressions = []
+    for key, summary in results.items():
+        if key not in baseline:
+            continue
+        baseline_median, median = baseline[key]["median"], summary["median"]
+        ratio = median / baseline_median if baseline_median > 0 else math.inf
+        if ratio > threshold:
+            regressions.append((key, baseline_median, median, ratio))
+    return regressions
+
+
+def print_results(results):
+    print("{key:<32} {count:>6} {median:>10} {p90:>10} {p99:>10} {total:>10}".format(
+        key="benchmark", count="count", median="median ms", p90="p90 ms", p99="p99 ms", total="total s",
+    ))
+    for key in sorted(results.keys()):
+        summary = results[key]
+        print("{key:<32} {count:>6} {median:>10.2f} {p90:>10.2f} {p99:>10.2f} {total:>10.2f}".format(
+            key=key,
+            count=summary["count"],
+            median=summary["median"] * 1000,
+            p90=summary["p90"] * 1000,
+            p99=summary["p99"] * 1000,
+            total=summary["total"],
+        ))
+
+
+def print_generator_stats(generator_stats):
+    print("{key:<16} {candidates:>10} {sampling:>10} {count:>10} {drop:>10} {logic:>10} {dominant:>16}".format(
+        key="generator", candidates="candidates", sampling="sample s", count="count s", drop="drop s", logic="logic s",
+        dominant="dominant stage",
+    ))
+    for key in sorted(generator_stats.keys()):
+        stats = generator_stats[key]
+        stage_times = stats.stage_times()
+        print("{key:<16} {candidates:>10} {sampling:>10.2f} {count:>10.2f} {drop:>10.2f} {logic:>10.2f} {dominant:>16}".format(
+            key=key,
+            candidates=stats.candidates,
+            sampling=stage_times["sampling"],
+            count=stage_times["solution_count"],
+            drop=stage_times["drop_redundant"],
+            logic=stage_times["logic_check"],
+            dominant=max(stage_times, key=stage_times.get),
+        ))
+
+
+def print_solver_stats(solver_stats):
+    print("{key:<16} {considered:>10} {derived:>10} {duplicate:>10} {subsumed:>10} {trivial:>10} {rate:>10} {evicted:>10} "
+          "{pruned:>10}".format(
+              key="logic rules", considered="considered", derived="derived", duplicate="duplicate", subsumed="subsumed",
+              trivial="trivial", rate="dedup rate", evicted="evicted", pruned="ev. pruned",
+          ))
+    for key in sorted(solver_stats.keys()):
+        stats = solver_stats[key]
+        print("{key:<16} {considered:>10} {derived:>10} {duplicate:>10} {subsumed:>10} {trivial:>10} {rate:>10.1%} "
+              "{evicted:>10} {pruned:>10}".format(
+                  key=key,
+                  considered=stats.rules_considered,
+                  derived=stats.strategies["apply_variable_expressions"].rules_derived,
+                  duplicate=stats.rules_dropped["duplicate"],
+                  subsumed=stats.rules_dropped["subsumed"],
+                  trivial=stats.rules_dropped["trivial"],
+                  rate=stats.dedup_rate(),
+                  evicted=stats.evicted["rules"] + stats.evicted["expressions"],
+                  pruned=stats.evicted_usefulness["rules"],
+              ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark solvers and generator on the bundled puzzles")
+    parser.add_argument("files", nargs="*", help="puzzle files (default: data/input*x*.txt)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--max-puzzles", type=int, default=None, help="max number of puzzles per file")
+    parser.add_argument("--logic-steps", type=int, default=4, help="max steps of the logical solver")
+    parser.add_argument("--generate-sizes", type=int, nargs="+", default=[5, 6])
+    parser.add_argument("--generate-seeds", type=int, nargs="+", default=[2018, 2019, 2020])
+    parser.add_argument("--generate-presets", nargs="+", choices=sorted(WEIGHT_PRESETS.keys()), default=["easy"])
+    parser.add_argument("--repeat", type=int, default=1, help="time each solver call this many times, keep the best")
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters to time imports and first solves in")
+    parser.add_argument("--regressions", default=None,
+                        help="regression corpus of slow puzzles (default: data/regressions.jsonl, see latency_hunt.py)")
+    parser.add_argument("--save", help="write results as JSON baseline to this path")
+    parser.add_argument("--baseline", help="compare against JSON baseline from this path")
+    parser.add_argument("--threshold", type=float, default=1.25, help="median slowdown ratio flagged as regression")
+    args = parser.parse_args(argv)
+
+    paths = args.files or sorted(glob.glob(os.path.join(DATA_DIR, "input*x*.txt")))
+    timings, generator_stats, solver_stats = run_benchmarks(
+        paths, args.stages,
+        max_puzzles=args.max_puzzles,
+        logic_steps=args.logic_steps,
+        generate_sizes=args.generate_sizes,
+        generate_seeds=args.generate_seeds,
+        generate_presets=args.generate_presets,
+        repeat=args.repeat,
+        startup_runs=args.startup_runs,
+        regressions_path=args.regressions,
+        verbose=True,
+    )
+    results = {key: summarize(values) for key, values in timings.items()}
+    print_results(results)
+    if solver_stats:
+        print()
+        print_solver_stats(solver_stats)
+    if generator_stats:
+        print()
+        print_generator_stats(generator_stats)
+
+    if args.save:
+        with open(args.save, "w") as fout:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "args": vars(args),
+                },
+                "results": results,
+                "generator_stats": {key: stats.as_dict() for key, stats in generator_stats.items()},
+                "solver_stats": {
+                    key: {
+                        "rules_considered": stats.rules_considered,
+                        "rules_dropped": stats.rules_dropped,
+                        "evicted": stats.evicted,
+                        "evicted_usefulness": stats.evicted_usefulness,
+                    }
+                    for key, stats in solver_stats.items()
+                },
+            }, fout, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, "r") as fin:
+            baseline = json.load(fin)["results"]
+        regressions = find_regressions(results, baseline, args.threshold)
+        for key, baseline_median, median, ratio in regressions:
+            print("REGRESSION {key}: median {baseline:.2f} ms -> {current:.2f} ms ({ratio:.2f}x)".format(
+                key=key, baseline=baseline_median * 1000, current=median * 1000, ratio=ratio,
+            ))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
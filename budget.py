@@ -0,0 +1,71 @@
+import time
+
+
+# reason codes for why a solver run stopped
+SOLVED = "solved"
+MAX_STEPS = "max_steps"
+DEADLINE = "deadline"
+MAX_EVALUATIONS = "max_evaluations"
+MAX_DERIVED_RULES = "max_derived_rules"
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Budget:
+    """
+    wall-clock and work limits for solver runs
+    `time_limit` is in seconds from creation, `deadline` is an absolute `time.monotonic()` timestamp
+    `max_evaluations` limits the number of rule evaluations, `max_derived_rules` the number of derived rules
+    all limits are optional - without them the budget only counts the work done
+    the same budget can be shared by several solver runs, they then draw from the common limits
+    """
+    # reading the clock is much more expensive than counting, so only do it every so many evaluations
+    CLOCK_CHECK_INTERVAL = 256
+
+    def __init__(self, time_limit=None, deadline=None, max_evaluations=None, max_derived_rules=None):
+        if time_limit is not None:
+            time_limit_deadline = time.monotonic() + time_limit
+            deadline = time_limit_deadline if deadline is None else min(deadline, time_limit_deadline)
+        self.deadline = deadline
+        self.max_evaluations = max_evaluations
+        self.max_derived_rules = max_derived_rules
+        self.evaluations = 0
+        self.derived_rules = 0
+
+    def __str__(self):
+        return "<Budget: evaluations={evaluations}/{max_evaluations}, derived rules={derived_rules}/{max_derived_rules}>".format(
+            evaluations=self.evaluations,
+            max_evaluations=self.max_evaluations,
+            derived_rules=self.derived_rules,
+            max_derived_rules=self.max_derived_rules,
+        )
+
+    def check_deadline(self):
+        """
+        raise if the deadline has passed
+        """
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise BudgetExceeded(DEADLINE)
+
+    def charge_evaluations(self, count=1):
+        """
+        account for `count` rule evaluations
+        """
+        self.evaluations += count
+        if self.max_evaluations is not None and self.evaluations > self.max_evaluations:
+            raise BudgetExceeded(MAX_EVALUATIONS)
+        if self.deadline is not None and self.evaluations % self.CLOCK_CHECK_INTERVAL < count:
+            self.check_deadline()
+
+    def charge_derived_rules(self, count=1):
+        """
+        account for `count` newly derived rules
+        """
+        self.derived_rules += count
+        if self.max_derived_rules is not None and self.derived_rules > self.max_derived_rules:
+            raise BudgetExceeded(MAX_DERIVED_RULES)
+        self.check_deadline()
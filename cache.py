@@ -0,0 +1,172 @@
+import json
+import os
+import sqlite3
+import time
+
+
+class ResultCache:
+    """
+    on-disk (SQLite) store of solver results keyed by `Puzzle.fingerprint()`
+    holds the solution count, a solution and logic solvability of each puzzle
+    size-bounded: once there are more than `max_entries` entries, the least recently used ones are evicted
+    safe to use from multiple processes at once, as long as every process opens its own `ResultCache`
+    """
+    # evict down to this fraction of `max_entries`, so that eviction doesn't run on every insert
+    EVICT_TO = 0.9
+    # check the size every so many inserts
+    EVICT_CHECK_INTERVAL = 64
+
+    def __init__(self, path, max_entries=1000000, timeout=30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.inserts = 0
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        # write-ahead log lets readers and a writer from different processes work concurrently
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                fingerprint TEXT PRIMARY KEY,
+                n INTEGER NOT NULL,
+                count INTEGER,
+                count_exact INTEGER,
+                solution TEXT,
+                logic_solvable INTEGER,
+                logic_steps INTEGER,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, fingerprint):
+        """
+        cached entry as dict or None
+        """
+        row = self.connection.execute(
+            "SELECT n, count, count_exact, solution, logic_solvable, logic_steps FROM results WHERE fingerprint = ?",
+            (fingerprint, ),
+        ).fetchone()
+        if row is None:
+            return None
+        self.connection.execute("UPDATE results SET last_access = ? WHERE fingerprint = ?", (time.time(), fingerprint))
+        n, count, count_exact, solution, logic_solvable, logic_steps = row
+        return {
+            "n": n,
+            "count": count,
+            "count_exact": None if count_exact is None else bool(count_exact),
+            "solution": None if solution is None else json.loads(solution),
+            "logic_solvable": None if logic_solvable is None else bool(logic_solvable),
+            "logic_steps": logic_steps,
+        }
+
+    def get_count(self, fingerprint, limit=None):
+        """
+        cached (count, solution) valid for counting up to `limit` (None for exact count), or None
+        """
+        entry = self.get(fingerprint)
+        if entry is None or entry["count"] is None:
+            return None
+        # exact count is valid for any limit, capped count only for limits not above the cap
+        if entry["count_exact"]:
+            count = entry["count"] if limit is None else min(entry["count"], limit)
+            return count, entry["solution"]
+        if limit is not None and entry["count"] >= limit:
+            return limit, entry["solution"]
+        return None
+
+    def get_logic_solvable(self, fingerprint, logic_steps):
+        """
+        cached logic solvability within `logic_steps` steps, or None
+        """
+        entry = self.get(fingerprint)
+        if entry is None or entry["logic_solvable"] is None:
+            return None
+        # solvable in fewer steps is solvable in more steps, and the other way around for unsolvable
+        if entry["logic_solvable"] and entry["logic_steps"] <= logic_steps:
+            return True
+        if not entry["logic_solvable"] and entry["logic_steps"] >= logic_steps:
+            return False
+        return None
+
+    def put_count(self, fingerprint, n, count, solution, limit=None):
+        """
+        store solution count (counted up to `limit`) and a solution
+        """
+        count_exact = limit is None or count < limit
+        fields = {
+            "count": count,
+            "count_exact": int(count_exact),
+            "solution": None if solution is None else json.dumps(solution),
+        }
+        # a capped count doesn't replace an exact one (which is valid for any limit)
+        self.upsert(fingerprint, n, fields, update_if="excluded.count_exact = 1 OR results.count_exact IS NOT 1")
+
+    def put_logic_solvable(self, fingerprint, n, logic_solvable, logic_steps):
+        """
+        store logic solvability within `logic_steps` steps
+        """
+        self.upsert(fingerprint, n, {
+            "logic_solvable": int(logic_solvable),
+            "logic_steps": logic_steps,
+        })
+
+    def upsert(self, fingerprint, n, fields, update_if=None):
+        """
+        insert or update the entry, an existing entry's `fields` are only replaced if the SQL condition `update_if`
+        holds (`results.` refers to the stored entry, `excluded.` to the new values)
+        """
+        columns = sorted(fields.keys())
+        if update_if is None:
+            update = "excluded.{column}"
+        else:
+            update = "CASE WHEN {update_if} THEN excluded.{{column}} ELSE results.{{column}} END".format(update_if=update_if)
+        self.connection.execute(
+            """
+            INSERT INTO results (fingerprint, n, last_access, {columns}) VALUES (?, ?, ?, {placeholders})
+            ON CONFLICT (fingerprint) DO UPDATE SET last_access = excluded.last_access, {updates}
+            """.format(
+                columns=", ".join(columns),
+                placeholders=", ".join("?" for _ in columns),
+                updates=", ".join(
+                    "{column} = {update}".format(column=column, update=update.format(column=column)) for column in columns
+                ),
+            ),
+            [fingerprint, n, time.time()] + [fields[column] for column in columns],
+        )
+        self.inserts += 1
+        if self.inserts % self.EVICT_CHECK_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        if over capacity, drop the least recently used entries
+        """
+        size = len(self)
+        if size <= self.max_entries:
+            return 0
+        to_drop = size - int(self.max_entries * self.EVICT_TO)
+        self.connection.execute(
+            "DELETE FROM results WHERE fingerprint IN (SELECT fingerprint FROM results ORDER BY last_access LIMIT ?)",
+            (to_drop, ),
+        )
+        return to_drop
+
+
+# one cache connection per (worker) process and path
+_open_caches = {}
+
+
+def open_cache(path, max_entries=1000000):
+    """
+    cache for `path`, opened once per process (SQLite connections must not be shared across processes)
+    """
+    key = (os.getpid(), path)
+    if key not in _open_caches:
+        _open_caches[key] = ResultCache(path, max_entries=max_entries)
+    return _open_caches[key]
@@ -0,0 +1,194 @@
+import hashlib
+
+from puzzle import Puzzle
+from rule import Rule
+
+
+# operations whose operands can be reordered
+COMMUTATIVE_OPS = ["+", "*"]
+# relations whose sides can be swapped
+SYMMETRIC_OPS = ["=", "!=", "<=>"]
+
+
+def canonical_expression_str(expression, names):
+    """
+    string of an expression (or rule) that doesn't depend on the order of commutative operands
+    variables are replaced by `names[variable]`
+    e.g., with names {"A": "x", "B": "y"}: "B+2*A=3" and "3=A*2+B" both give "(2*x+y)=3"
+    """
+    if "value" in expression:
+        if isinstance(expression["value"], int):
+            return str(expression["value"])
+        return names[expression["value"]]
+    op = expression["op"]
+    if op in COMMUTATIVE_OPS:
+        # flatten chains of the same operation ("A+B+C" is parsed as "(A+B)+C")
+        operands, stack = [], [expression]
+        while stack:
+            e = stack.pop()
+            if "value" not in e and e["op"] == op:
+                stack.append(e["lhs"])
+                stack.append(e["rhs"])
+            else:
+                operands.append(canonical_expression_str(e, names))
+        return "(" + op.join(sorted(operands)) + ")"
+    lhs = canonical_expression_str(expression["lhs"], names)
+    rhs = canonical_expression_str(expression["rhs"], names)
+    if op in SYMMETRIC_OPS and rhs < lhs:
+        lhs, rhs = rhs, lhs
+    return "{lhs}{op}{rhs}".format(lhs=lhs, op=op, rhs=rhs)
+
+
+def refine_colors(puzzle: Puzzle, colors):
+    """
+    color refinement over the rule/variable incidence structure
+    a variable's new color is determined by its old color and the (canonical) rules it appears in,
+    seen from the variable's point of view (itself marked, others replaced by their colors)
+    repeats until the partition into color classes stops getting finer
+    colors are numbered by sorted signatures, so they don't depend on variable names
+    """
+    num_classes = len(set(colors.values()))
+    while True:
+        signatures = {}
+        for var in colors:
+            names = {v: "c{color}".format(color=c) for v, c in colors.items()}
+            names[var] = "@"
+            signatures[var] = (colors[var], tuple(sorted(
+                canonical_expression_str(rule.rule, names) for rule in puzzle.rules if var in rule.variables
+            )))
+        signature_to_color = {signature: i for i, signature in enumerate(sorted(set(signatures.values())))}
+        colors = {var: signature_to_color[signatures[var]] for var in colors}
+        new_num_classes = len(signature_to_color)
+        if new_num_classes == num_classes:
+            return colors
+        num_classes = new_num_classes
+
+
+def partition_invariant(colors):
+    """
+    label-independent summary of a coloring, used to prune the search over individualizations
+    """
+    sizes = {}
+    for color in colors.values():
+        sizes[color] = sizes.get(color, 0) + 1
+    return tuple(sorted(sizes.items()))
+
+
+def canonical_labeling(puzzle: Puzzle):
+    """
+    {variable: canonical variable} mapping such that puzzles that differ only by a renaming of variables
+    get the same rules after relabeling
+    graph canonization style: refine colors, then individualize variables of the first non-singleton class
+    (only exploring branches with the smallest invariant) and keep the labeling with the smallest rule set
+    variables that don't appear in any rule are interchangeable and get the last labels
+    """
+    used = [var for var in puzzle.variables if any(var in rule.variables for rule in puzzle.rules)]
+    unused = [var for var in puzzle.variables if var not in used]
+    best = None
+
+    def rec(colors):
+        nonlocal best
+        colors = refine_colors(puzzle, colors)
+        classes = {}
+        for var, color in colors.items():
+            classes.setdefault(color, []).append(var)
+        cell = next((classes[color] for color in sorted(classes.keys()) if len(classes[color]) > 1), None)
+        # discrete coloring - a candidate labeling
+        if cell is None:
+            ordered = sorted(colors.keys(), key=lambda var: colors[var])
+            mapping = {var: puzzle.variables[i] for i, var in enumerate(ordered + unused)}
+            key = canonical_rules(puzzle, mapping)
+            if best is None or key < best[0]:
+                best = (key, mapping)
+            return
+        # individualize each variable of the cell, continue with those of the smallest invariant
+        branches = []
+        for var in cell:
+            individualized = {v: 2 * c for v, c in colors.items()}
+            individualized[var] = 2 * colors[var] - 1
+            individualized = refine_colors(puzzle, individualized)
+            branches.append((partition_invariant(individualized), individualized))
+        smallest = min(invariant for invariant, _ in branches)
+        for invariant, individualized in branches:
+            if invariant == smallest:
+                rec(individualized)
+
+    rec({var: 0 for var in used})
+    if best is None:
+        return {var: puzzle.variables[i] for i, var in enumerate(unused)}
+    return best[1]
+
+
+def canonical_rules(puzzle: Puzzle, mapping):
+    """
+    sorted canonical rule strings of the puzzle with variables renamed by `mapping`
+    """
+    return tuple(sorted(canonical_expression_str(rule.rule, mapping) for rule in puzzle.rules))
+
+
+def canonical_key(puzzle: Puzzle):
+    """
+    stable key of the puzzle that is the same for all puzzles differing only by a renaming of variables
+    (and by order or formatting of rules)
+    """
+    rules = canonical_rules(puzzle, canonical_labeling(puzzle))
+    key = "{n}:{rules}".format(n=puzzle.n, rules="\n".join(rules))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def relabel_puzzle(puzzle: Puzzle, mapping):
+    """
+    new puzzle with variables renamed by `mapping`
+    """
+    def rec(expression):
+        if "value" in expression:
+            if isinstance(expression["value"], int):
+                return {"value": expression["value"]}
+            return {"value": mapping[expression["value"]]}
+        return {
+            "op": expression["op"],
+            "lhs": rec(expression["lhs"]),
+            "rhs": rec(expression["rhs"]),
+        }
+
+    relabeled = Puzzle(puzzle.n)
+    relabeled.rules = [Rule(rule_structured=rec(rule.rule)) for rule in puzzle.rules]
+    return relabeled
+
+
+def canonical_puzzle(puzzle: Puzzle):
+    """
+    the puzzle relabeled to its canonical variable names
+    """
+    return relabel_puzzle(puzzle, canonical_labeling(puzzle))
+
+
+def dedupe(puzzles):
+    """
+    yield only the first puzzle of each class of puzzles that differ only by a renaming of variables
+    """
+    seen = set()
+    for puzzle in puzzles:
+        key = canonical_key(puzzle)
+        if key not in seen:
+            seen.add(key)
+            yield puzzle
+
+
+if __name__ == "__main__":
+    puzzle = Puzzle(5)
+    puzzle.add_rules([
+        "B+A=6",
+        "E+B=C",
+        "E+C+B=8",
+    ])
+    # same puzzle with variables renamed (A->D, B->A, C->E, D->B, E->C)
+    puzzle_renamed = Puzzle(5)
+    puzzle_renamed.add_rules([
+        "A+D=6",
+        "C+A=E",
+        "C+E+A=8",
+    ])
+    print(canonical_key(puzzle) == canonical_key(puzzle_renamed))
+    print(canonical_puzzle(puzzle))
+    print(canonical_puzzle(puzzle_renamed))
@@ -0,0 +1,306 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from puzzle import Puzzle
+from rule import Rule
+from run import iter_input
+
+
+# binary corpus layout (all integers little-endian):
+#   header: magic, version, flags (reserved), number of puzzles, offset of the index
+#   records: one per puzzle, see `encode_puzzle`
+#   index: offset of each record as unsigned 64-bit integer, so puzzle i is found without reading the others
+MAGIC = b"LOGICORP"
+VERSION = 1
+HEADER = struct.Struct("<8sHHQQ")
+INDEX_ITEM = struct.Struct("<Q")
+
+# rule AST nodes are stored in prefix order, each starting with a tag byte:
+# an operation (followed by its two operands), a variable (followed by its index) or a number
+OPS = ["=", "!=", ">", "<", ">=", "<=", "=>", "<=>", "+", "-", "*", "/"]
+OP_TAGS = {op: tag for tag, op in enumerate(OPS)}
+TAG_VARIABLE = len(OPS)
+TAG_NUMBER = len(OPS) + 1
+
+# record flags
+HAS_COUNT = 1
+HAS_SOLUTION = 2
+
+
+def write_varint(out, value):
+    """
+    append a non-negative integer as LEB128 (7 bits per byte, low bits first)
+    """
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(buf, pos):
+    """
+    read a LEB128 integer at `pos`, returns the value and the position after it
+    """
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_expression(out, expression, var_index):
+    if "value" in expression:
+        if isinstance(expression["value"], int):
+            out.append(TAG_NUMBER)
+            # zigzag, so that small negative numbers stay short
+            value = expression["value"]
+            write_varint(out, 2 * value if value >= 0 else -2 * value - 1)
+        else:
+            out.append(TAG_VARIABLE)
+            write_varint(out, var_index[expression["value"]])
+        return
+    out.append(OP_TAGS[expression["op"]])
+    encode_expression(out, expression["lhs"], var_index)
+    encode_expression(out, expression["rhs"], var_index)
+
+
+def decode_expression(buf, pos, variables):
+    """
+    read an expression (or rule) at `pos`, returns it and the position after it
+    """
+    tag = buf[pos]
+    pos += 1
+    if tag == TAG_NUMBER:
+        value, pos = read_varint(buf, pos)
+        return {"value": value // 2 if value % 2 == 0 else -(value + 1) // 2}, pos
+    if tag == TAG_VARIABLE:
+        ind, pos = read_varint(buf, pos)
+        return {"value": variables[ind]}, pos
+    lhs, pos = decode_expression(buf, pos, variables)
+    rhs, pos = decode_expression(buf, pos, variables)
+    return {"op": OPS[tag], "lhs": lhs, "rhs": rhs}, pos
+
+
+def encode_puzzle(puzzle: Puzzle, count=None, solution=None):
+    """
+    record of a puzzle: n, number of rules, the (simplified) rules, flags, then optionally
+    the solution count and a solution (values in the order of `puzzle.variables`)
+    """
+    out = bytearray()
+    var_index = {var: i for i, var in enumerate(puzzle.variables)}
+    write_varint(out, puzzle.n)
+    write_varint(out, len(puzzle.rules))
+    for rule in puzzle.rules:
+        encode_expression(out, rule.rule, var_index)
+    out.append((HAS_COUNT if count is not None else 0) | (HAS_SOLUTION if solution is not None else 0))
+    if count is not None:
+        write_varint(out, count)
+    if solution is not None:
+        for var in puzzle.variables:
+            write_varint(out, solution[var])
+    return bytes(out)
+
+
+def decode_puzzle(buf, pos):
+    """
+    read a record at `pos`, returns (puzzle, solution count or None, solution dict or None)
+    """
+    n, pos = read_varint(buf, pos)
+    num_rules, pos = read_varint(buf, pos)
+    puzzle = Puzzle(n)
+    for _ in range(num_rules):
+        rule_structured, pos = decode_expression(buf, pos, puzzle.variables)
+        puzzle.rules.append(Rule.from_simplified(rule_structured))
+    flags = buf[pos]
+    pos += 1
+    count, solution = None, None
+    if flags & HAS_COUNT:
+        count, pos = read_varint(buf, pos)
+    if flags & HAS_SOLUTION:
+        solution = {}
+        for var in puzzle.variables:
+            solution[var], pos = read_varint(buf, pos)
+    return puzzle, count, solution
+
+
+class CorpusWriter:
+    """
+    streams puzzles into a binary corpus file, the index is written on `close`
+    (the index is kept in memory until then, 8 bytes per puzzle)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fout = open(path, "wb")
+        self.offsets = array("Q")
+        self.fout.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, puzzle: Puzzle, count=None, solution=None):
+        self.offsets.append(self.fout.tell())
+        self.fout.write(encode_puzzle(puzzle, count=count, solution=solution))
+
+    def close(self):
+        if self.fout.closed:
+            return
+        index_offset = self.fout.tell()
+        if sys.byteorder != "little":
+            self.offsets.byteswap()
+        self.fout.write(self.offsets.tobytes())
+        self.fout.seek(0)
+        self.fout.write(HEADER.pack(MAGIC, VERSION, 0, len(self.offsets), index_offset))
+        self.fout.close()
+
+
+class Corpus:
+    """
+    read-only, memory-mapped binary corpus
+    opening it reads just the header, `corpus[i]` decodes only puzzle i (rules are stored simplified,
+    so they are not parsed or simplified again), so huge corpora open instantly and can be shared by workers
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.count, self.index_offset = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("not a version {version} puzzle corpus: {path}".format(version=VERSION, path=path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, ind):
+        return self.entry(ind)[0]
+
+    def __iter__(self):
+        for ind in range(self.count):
+            yield self[ind]
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+    def entry(self, ind):
+        """
+        (puzzle, solution count or None, solution dict or None) of the puzzle at `ind`
+        """
+        if not 0 <= ind < self.count:
+            raise IndexError(ind)
+        offset, = INDEX_ITEM.unpack_from(self.buf, self.index_offset + ind * INDEX_ITEM.size)
+        return decode_puzzle(self.buf, offset)
+
+
+def is_corpus(path):
+    """
+    whether the file at `path` is a binary corpus (as opposed to the text format)
+    """
+    if path == "-" or not os.path.isfile(path):
+        return False
+    with open(path, "rb") as fin:
+        return fin.read(len(MAGIC)) == MAGIC
+
+
+# one mapping per (worker) process and path
+_open_corpora = {}
+
+
+def open_corpus(path):
+    """
+    corpus at `path`, opened once per process
+    """
+    key = (os.getpid(), path)
+    if key not in _open_corpora:
+        _open_corpora[key] = Corpus(path)
+    return _open_corpora[key]
+
+
+def text_to_corpus(text_paths, corpus_path, solve=False):
+    """
+    convert puzzle files in the text format into a corpus
+    with `solve`, the (exact) solution count and a solution of every puzzle are stored as well
+    returns the number of puzzles written
+    """
+    if solve:
+        from solutions import count_solutions, iter_solutions, solution_to_dict
+    with CorpusWriter(corpus_path) as writer:
+        for path in text_paths:
+            fin = sys.stdin if path == "-" else open(path, "r")
+            try:
+                for puzzle_raw in iter_input(fin):
+                    puzzle = Puzzle(puzzle_raw["n"])
+                    puzzle.add_rules(rules_str=puzzle_raw["rules"])
+                    count, solution = None, None
+                    if solve:
+                        count = count_solutions(puzzle)
+                        solution = next(iter_solutions(puzzle), None)
+                        solution = solution_to_dict(puzzle, solution) if solution is not None else None
+                    writer.add(puzzle, count=count, solution=solution)
+            finally:
+                if fin is not sys.stdin:
+                    fin.close()
+        return len(writer.offsets)
+
+
+def corpus_to_text(corpus_path, fout):
+    """
+    write the puzzles of a corpus in the text format ("n k", then k rule lines, blank line between puzzles)
+    """
+    with Corpus(corpus_path) as corpus:
+        for ind, puzzle in enumerate(corpus):
+            if ind:
+                fout.write("\n")
+            fout.write("{n} {k}\n".format(n=puzzle.n, k=len(puzzle.rules)))
+            for rule in puzzle.rules:
+                fout.write(rule.get_simplified_str() + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="convert between the text puzzle format and the binary corpus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack", help="text files (- for stdin) to a corpus")
+    pack_parser.add_argument("files", nargs="+")
+    pack_parser.add_argument("--output", "-o", required=True, help="corpus path")
+    pack_parser.add_argument("--solve", action="store_true", help="store solution counts and solutions as well")
+    unpack_parser = subparsers.add_parser("unpack", help="corpus to text")
+    unpack_parser.add_argument("corpus")
+    unpack_parser.add_argument("--output", "-o", default="-", help="output file (default: stdout)")
+    info_parser = subparsers.add_parser("info", help="number of puzzles in a corpus")
+    info_parser.add_argument("corpus")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        cnt = text_to_corpus(args.files, args.output, solve=args.solve)
+        print("packed {cnt} puzzles into {path}".format(cnt=cnt, path=args.output), file=sys.stderr)
+    elif args.command == "unpack":
+        fout = sys.stdout if args.output == "-" else open(args.output, "w")
+        try:
+            corpus_to_text(args.corpus, fout)
+        finally:
+            if fout is not sys.stdout:
+                fout.close()
+    else:
+        with Corpus(args.corpus) as corpus:
+            print("{path}: {cnt} puzzles".format(path=args.corpus, cnt=len(corpus)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
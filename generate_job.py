@@ -0,0 +1,223 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+from generator import WEIGHT_PRESETS, derive_seed, generate_one
+from parallel import ordered_map
+from stats import GeneratorStats
+
+
+# job state, rewritten atomically at every checkpoint
+CHECKPOINT = "checkpoint.json"
+# output formats and the extensions of their shards
+FORMATS = {"text": ".txt", "jsonl": ".jsonl"}
+# write buffer of a shard (flushed at checkpoints and when the shard is full)
+WRITE_BUFFER_SIZE = 1 << 16
+
+
+def shard_path(out_dir, shard, fmt):
+    return os.path.join(out_dir, "shard-{shard:05d}{ext}".format(shard=shard, ext=FORMATS[fmt]))
+
+
+def format_puzzle(index, puzzle, fmt):
+    """
+    a puzzle as written to a shard: in the `data/` text format ("n k" and k rule lines, then a blank line),
+    or as a JSON line with its index within the job
+    """
+    rules = [rule.get_simplified_str() for rule in puzzle.rules]
+    if fmt == "jsonl":
+        return json.dumps({"index": index, "n": puzzle.n, "rules": rules}) + "\n"
+    return "{n} {k}\n{rules}\n\n".format(n=puzzle.n, k=len(rules), rules="\n".join(rules))
+
+
+def load_checkpoint(out_dir):
+    with open(os.path.join(out_dir, CHECKPOINT), "r") as fin:
+        return json.load(fin)
+
+
+def save_checkpoint(out_dir, state):
+    """
+    write the job state so that a crash at any moment leaves either the old or the new checkpoint
+    """
+    path = os.path.join(out_dir, CHECKPOINT)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fout:
+        json.dump(state, fout, indent=2, sort_keys=True)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_path, path)
+
+
+def new_job(out_dir, n, count=None, preset="easy", custom_weights=None, seed=None, shard_size=1000, fmt="text",
+            time_limit=None, max_evaluations=None):
+    """
+    set up a generation job of `count` puzzles (None for no end) in `out_dir`, returns its state
+    the puzzle at index i is generated from a seed derived from (`seed`, i) like in `generate_many`,
+    so progress is just the number of puzzles written, and a resumed job writes exactly what an uninterrupted
+    one would have (unless `time_limit` is set, which makes the output depend on machine speed)
+    """
+    if os.path.exists(os.path.join(out_dir, CHECKPOINT)):
+        raise ValueError("there is a job in {out_dir} already, resume it instead".format(out_dir=out_dir))
+    if fmt not in FORMATS:
+        raise ValueError("unknown format: {fmt}".format(fmt=fmt))
+    os.makedirs(out_dir, exist_ok=True)
+    state = {
+        "n": n,
+        "count": count,
+        "weights": WEIGHT_PRESETS[preset] if custom_weights is None else custom_weights,
+        "seed": seed if seed is not None else int.from_bytes(os.urandom(8), "big"),
+        "shard_size": shard_size,
+        "format": fmt,
+        "time_limit": time_limit,
+        "max_evaluations": max_evaluations,
+        # puzzles written and made durable, and the size of the shard they end in
+        "next_index": 0,
+        "shard_bytes": 0,
+        "stats": GeneratorStats().as_dict(),
+    }
+    save_checkpoint(out_dir, state)
+    return state
+
+
+def open_shard(out_dir, state):
+    """
+    open the shard that the next puzzle goes to, dropping anything written to it after the last checkpoint
+    (as well as any later shard), so that the resumed job doesn't write duplicates
+    raises `ValueError` if the shard is shorter than at the last checkpoint (e.g., it was removed or replaced)
+    """
+    shard = state["next_index"] // state["shard_size"]
+    shard_name = re.compile(r"shard-(\d{5,})" + re.escape(FORMATS[state["format"]]))
+    for name in os.listdir(out_dir):
+        match = shard_name.fullmatch(name)
+        if match and int(match.group(1)) > shard:
+            os.remove(os.path.join(out_dir, name))
+    path = shard_path(out_dir, shard, state["format"])
+    # at a shard boundary, `shard_bytes` is the size of the previous (full) shard
+    size = state["shard_bytes"] if state["next_index"] % state["shard_size"] else 0
+    actual_size = os.path.getsize(path) if os.path.exists(path) else 0
+    if actual_size < size:
+        raise ValueError("{path} has {actual_size} bytes, the checkpoint expects at least {size}".format(
+            path=path, actual_size=actual_size, size=size,
+        ))
+    fout = open(path, "ab", buffering=WRITE_BUFFER_SIZE)
+    fout.truncate(size)
+    return fout
+
+
+def run_job(out_dir, workers=None, checkpoint_every=100, checkpoint_interval=30.0, verbose=False):
+    """
+    run (or resume) the job in `out_dir` until all its puzzles are written (or it is interrupted)
+    puzzles are generated on a pool of `workers` processes and written in index order to shards of
+    `shard_size` puzzles, a checkpoint is made every `checkpoint_every` puzzles or `checkpoint_interval` seconds
+    (whichever comes first), when a shard is full, and when the job stops (also on KeyboardInterrupt)
+    returns the final job state
+    """
+    state = load_checkpoint(out_dir)
+    stats = GeneratorStats.from_dict(state["stats"])
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if state["count"] is None:
+        indices = itertools.count(state["next_index"])
+    else:
+        indices = range(state["next_index"], state["count"])
+    tasks = (
+        (i, state["n"], derive_seed(state["seed"], i), state["weights"], state["time_limit"], state["max_evaluations"])
+        for i in indices
+    )
+    # the shard is opened once a puzzle is written to it, so that a job ending at a shard boundary
+    # (or a finished job that is resumed) doesn't leave an empty next shard
+    fout = None
+    # (puzzles written, size of the current shard with them), replaced as a whole after each puzzle,
+    # so that an interrupt never leaves a puzzle written but not counted (or the other way round)
+    progress = (state["next_index"], state["shard_bytes"])
+
+    def checkpoint():
+        if fout is not None and not fout.closed:
+            fout.flush()
+            os.fsync(fout.fileno())
+        state["next_index"], state["shard_bytes"] = progress
+        state["stats"] = stats.as_dict()
+        save_checkpoint(out_dir, state)
+
+    last_checkpoint, last_time = progress[0], time.monotonic()
+    try:
+        for index, puzzle, puzzle_stats in ordered_map(generate_one, tasks, workers=workers):
+            data = format_puzzle(index, puzzle, state["format"]).encode()
+            if fout is None:
+                fout = open_shard(out_dir, state)
+            fout.write(data)
+            progress = (index + 1, progress[1] + len(data))
+            stats.merge(puzzle_stats)
+            # shard full - make it durable, the next one is opened with the next puzzle
+            if progress[0] % state["shard_size"] == 0:
+                checkpoint()
+                fout.close()
+                fout = None
+                progress = (progress[0], 0)
+            elif progress[0] - last_checkpoint >= checkpoint_every or time.monotonic() - last_time >= checkpoint_interval:
+                checkpoint()
+            else:
+                continue
+            last_checkpoint, last_time = progress[0], time.monotonic()
+            if verbose:
+                print("{cnt} puzzles written".format(cnt=progress[0]), file=sys.stderr)
+    finally:
+        checkpoint()
+        if fout is not None:
+            fout.close()
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="long-running puzzle generation into checkpointed, sharded files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    start_parser = subparsers.add_parser("start", help="set up a new job in a directory and run it")
+    start_parser.add_argument("out_dir")
+    start_parser.add_argument("--n", type=int, required=True)
+    start_parser.add_argument("--count", type=int, default=None, help="number of puzzles (default: until stopped)")
+    start_parser.add_argument("--preset", choices=sorted(WEIGHT_PRESETS.keys()), default="easy")
+    start_parser.add_argument("--seed", type=int, default=None)
+    start_parser.add_argument("--shard-size", type=int, default=1000, help="puzzles per output file")
+    start_parser.add_argument("--format", choices=sorted(FORMATS.keys()), default="text")
+    start_parser.add_argument("--time-limit", type=float, default=None, help="seconds per candidate")
+    start_parser.add_argument("--max-evaluations", type=int, default=None, help="rule evaluations per candidate")
+    resume_parser = subparsers.add_parser("resume", help="continue an interrupted job")
+    resume_parser.add_argument("out_dir")
+    for subparser in [start_parser, resume_parser]:
+        subparser.add_argument("--workers", type=int, default=None)
+        subparser.add_argument("--checkpoint-every", type=int, default=100, help="puzzles between checkpoints")
+        subparser.add_argument("--checkpoint-interval", type=float, default=30.0, help="seconds between checkpoints")
+    status_parser = subparsers.add_parser("status", help="progress of a job")
+    status_parser.add_argument("out_dir")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        state = load_checkpoint(args.out_dir)
+        print("{done}/{count} puzzles of n={n} written".format(
+            done=state["next_index"], count=state["count"] if state["count"] is not None else "-", n=state["n"],
+        ))
+        return 0
+    if args.command == "start":
+        new_job(
+            args.out_dir, args.n, count=args.count, preset=args.preset, seed=args.seed, shard_size=args.shard_size,
+            fmt=args.format, time_limit=args.time_limit, max_evaluations=args.max_evaluations,
+        )
+    try:
+        state = run_job(
+            args.out_dir, workers=args.workers, checkpoint_every=args.checkpoint_every,
+            checkpoint_interval=args.checkpoint_interval, verbose=True,
+        )
+    except KeyboardInterrupt:
+        print("interrupted, continue with `resume`", file=sys.stderr)
+        return 1
+    print("{cnt} puzzles written, {stats}".format(cnt=state["next_index"], stats=GeneratorStats.from_dict(state["stats"])),
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,16 @@
+import collections
+import hashlib
+import os
 import random
-import string
+import time
 
-from puzzle import Puzzle
+from budget import Budget, BudgetExceeded, DEADLINE
+from puzzle import Puzzle, variable_names
 from rule import Rule
-from solver_brute import BruteForceSolver
+from solutions import count_solutions
 from solver_logic import LogicBasedSolver
+from solver_search import SearchSolver
+from stats import GeneratorStats
 
 
 WEIGHT_PRESETS = {
@@ -31,23 +37,20 @@ WEIGHT_PRESETS = {
     },
 }
 
-# initialize RNG object so that sympy doesn't mess with our seed
-rng = random.Random()
-
 
 # uniformly random number from interval
-def ri(a, b):
+def ri(rng, a, b):
     return rng.randint(a, b)
 
 
 # uniformly random element from array a
-def sample(a):
-    return a[ri(0, len(a)-1)]
+def sample(rng, a):
+    return a[ri(rng, 0, len(a)-1)]
 
 
 # random array index according to (integer) weights
-def choice(weights):
-    x = ri(1, sum(weights))
+def choice(rng, weights):
+    x = ri(rng, 1, sum(weights))
     s = 0
     for i, w in enumerate(weights):
         s += w
@@ -56,16 +59,38 @@ def choice(weights):
 
 
 class BasicGenerator:
-    def __init__(self, n, seed=None, verbose=False, custom_weights=None):
+    # up to this size all solutions of partial puzzles are counted, for larger ones that is infeasible (n!)
+    MAX_COUNTING_N = 8
+
+    def __init__(self, n, seed=None, verbose=False, custom_weights=None, time_limit=None, max_evaluations=None,
+                 deadline=None):
         self.n = n
-        self.variables = string.ascii_uppercase[:self.n]
+        self.variables = variable_names(self.n)
         self.values = None
-        if seed is not None:
-            rng.seed(seed)
+        # each generator owns its RNG object, so that sympy doesn't mess with our seed
+        # and seeding one generator doesn't affect any other
+        self.rng = random.Random(seed)
         self.verbose = verbose
         self.number_range = [1, self.n + 2]
         # weights for random sampling
         self.weights = WEIGHT_PRESETS["easy"] if custom_weights is None else custom_weights
+        # budget (seconds, rule evaluations) for building a candidate, and separately for its logic check
+        # candidates that run out of it are abandoned
+        # note that time limits make the output depend on machine speed, evaluation limits don't
+        self.time_limit = time_limit
+        self.max_evaluations = max_evaluations
+        # absolute `time.monotonic()` deadline of the whole generation (`generate` raises `BudgetExceeded` after it)
+        self.deadline = deadline
+        # budget of the candidate that is currently being built
+        self.budget = Budget()
+        # stage counters and timers, accumulated over all generated puzzles
+        self.stats = GeneratorStats()
+
+    def new_budget(self):
+        """
+        fresh budget for a candidate
+        """
+        return Budget(time_limit=self.time_limit, deadline=self.deadline, max_evaluations=self.max_evaluations)
 
     def get_random_rule(self):
         """
@@ -75,13 +100,13 @@ class BasicGenerator:
         # can specify a subset of allowed operations `ops`
         def rec_get_expression(ops=None):
             # decide whether to get a value (variable or number)
-            if choice(self.weights["val_exp"]) == 0:
+            if choice(self.rng, self.weights["val_exp"]) == 0:
                 # decide whether to get a variable
-                if choice(self.weights["var_num"]) == 0:
-                    value = sample(self.variables)
+                if choice(self.rng, self.weights["var_num"]) == 0:
+                    value = sample(self.rng, self.variables)
                 # get number
                 else:
-                    value = ri(*self.number_range)
+                    value = ri(self.rng, *self.number_range)
                 return {
                     "value": value
                 }
@@ -89,9 +114,9 @@ class BasicGenerator:
             else:
                 # choose operation
                 if ops is not None:
-                    op = sample(ops)
-                elif choice(self.weights["add_mul"]) == 0:
-                    op = sample(["+", "-"] if ops is None else ops)
+                    op = sample(self.rng, ops)
+                elif choice(self.rng, self.weights["add_mul"]) == 0:
+                    op = sample(self.rng, ["+", "-"] if ops is None else ops)
                 else:
                     op = "*"
                 # if we have multiplication here, only allow multiplication further to avoid bracketing
@@ -105,10 +130,10 @@ class BasicGenerator:
         # get random relation (>, <, =, or !=)
         def get_relation():
             # choose between equalities and inequalities
-            if choice(self.weights["eq_ineq"]) == 0:
+            if choice(self.rng, self.weights["eq_ineq"]) == 0:
                 op = "="
             else:
-                op = sample([">", ">=", "!="])
+                op = sample(self.rng, [">", ">=", "!="])
             return {
                 "op": op,
                 "lhs": rec_get_expression(),
@@ -116,10 +141,10 @@ class BasicGenerator:
             }
 
         # decide whether to use logical operator
-        if choice(self.weights["logic_eq"]) == 0:
+        if choice(self.rng, self.weights["logic_eq"]) == 0:
             # generate logical operator with random expressions on both sides
             rule_structured = {
-                "op": sample(["=>", "<=>"]),
+                "op": sample(self.rng, ["=>", "<=>"]),
                 "lhs": get_relation(),
                 "rhs": get_relation(),
             }
@@ -135,9 +160,9 @@ class BasicGenerator:
         generate a simple random rule
         variable (+/-/*) variable (>/</=/!=) number
         """
-        var1 = self.variables[ri(0, self.n - 1)]
-        var2 = self.variables[ri(0, self.n - 1)]
-        op1 = ["+", "-", "*", ][ri(0, 2)]
+        var1 = self.variables[ri(self.rng, 0, self.n - 1)]
+        var2 = self.variables[ri(self.rng, 0, self.n - 1)]
+        op1 = ["+", "-", "*", ][ri(self.rng, 0, 2)]
         lhs = {
             "op": op1,
             "lhs": {
@@ -147,11 +172,11 @@ class BasicGenerator:
                 "value": var2,
             },
         }
-        val = ri(1, 10)
+        val = ri(self.rng, 1, 10)
         rhs = {
             "value": val,
         }
-        op0 = [">", "<", "=", "!=", ][ri(0, 3)]
+        op0 = [">", "<", "=", "!=", ][ri(self.rng, 0, 3)]
         if op0 == "<":
             op0 = ">"
             lhs, rhs = rhs, lhs
@@ -161,50 +186,119 @@ class BasicGenerator:
             "rhs": rhs,
         })
 
-    def get_solution_count(self, puzzle):
+    def get_solution_count(self, puzzle, limit=None):
         """
         get the number of solutions to given (partial) puzzle
+        stop counting at `limit` (if given)
+        """
+        # enumerate solutions with whichever engine is fastest for the puzzle size
+        start = time.perf_counter()
+        try:
+            return count_solutions(puzzle, limit=limit, budget=self.budget)
+        finally:
+            self.stats.solution_count_calls += 1
+            self.stats.solution_count_time += time.perf_counter() - start
+
+    def has_solution(self, puzzle, negated_rules=None):
+        """
+        whether the puzzle has a solution (in which none of `negated_rules` hold)
+        """
+        start = time.perf_counter()
+        try:
+            solver = SearchSolver(puzzle, negated_rules=negated_rules)
+            return next(solver.iter_solutions(budget=self.budget), None) is not None
+        finally:
+            self.stats.solution_count_calls += 1
+            self.stats.solution_count_time += time.perf_counter() - start
+
+    def get_candidate_rule(self):
+        """
+        random rule that is ok and not in form "A=1" (None otherwise)
         """
-        # first do 3 steps of logical solver, to (hopefully) greatly reduce search space
-        lbs = LogicBasedSolver(puzzle)
-        _, possible_values = lbs.solve(max_steps=2)
-        # then apply brute force to check all possible assignments (after logical reductions)
-        bfs = BruteForceSolver(puzzle)
-        cnt, _ = bfs.solve(possible_values=possible_values)
-        # return the number of solutions
-        return cnt
+        start = time.perf_counter()
+        random_rule = self.get_random_rule()
+        self.stats.rules_sampled += 1
+        self.stats.sampling_time += time.perf_counter() - start
+        # skip rule if not ok or if it is in form "A=1"
+        if not random_rule.is_ok() or (len(random_rule.variables) == 1 and random_rule.rule["op"] == "="):
+            self.stats.rules_rejected_not_ok += 1
+            return None
+        return random_rule
 
     def reduce_until_unique(self, puzzle):
         """
         generate and add new random rules until we have a unique solution
         """
+        if self.n > self.MAX_COUNTING_N:
+            return self.reduce_until_unique_by_search(puzzle)
         cnt = self.get_solution_count(puzzle)
         while True:
             # add new random rule
-            random_rule = self.get_random_rule()
-            # skip rule if not ok or if it is in form "A=1"
-            if not random_rule.is_ok() or (len(random_rule.variables) == 1 and random_rule.rule["op"] == "="):
+            random_rule = self.get_candidate_rule()
+            if random_rule is None:
                 continue
             puzzle.rules.append(random_rule)
             # get the new number of solutions
             cnt_new = self.get_solution_count(puzzle)
             # unique solution - we are done
             if cnt_new == 1:
+                self.stats.rules_accepted += 1
                 break
             # either no solution or no reduction - drop the new rule
             elif cnt_new == 0 or cnt_new == cnt:
+                if cnt_new == 0:
+                    self.stats.rules_rejected_no_solution += 1
+                else:
+                    self.stats.rules_rejected_no_reduction += 1
                 del puzzle.rules[-1]
             # solution count reduced - update count and proceed
             else:
+                self.stats.rules_accepted += 1
                 cnt = cnt_new
 
+    def reduce_until_unique_by_search(self, puzzle):
+        """
+        same as `reduce_until_unique`, but without counting all solutions of partial puzzles:
+        a new rule keeps some solution iff the puzzle with the rule is still solvable,
+        and it reduces the solution count iff some current solution breaks it
+        """
+        while True:
+            random_rule = self.get_candidate_rule()
+            if random_rule is None:
+                continue
+            puzzle.rules.append(random_rule)
+            # no solution - drop the new rule
+            if not self.has_solution(puzzle):
+                self.stats.rules_rejected_no_solution += 1
+                del puzzle.rules[-1]
+                continue
+            # no reduction (all solutions satisfy the new rule) - drop the new rule
+            if not self.has_solution(Puzzle.with_rules(puzzle.n, puzzle.rules[:-1]), negated_rules=[random_rule]):
+                self.stats.rules_rejected_no_reduction += 1
+                del puzzle.rules[-1]
+                continue
+            self.stats.rules_accepted += 1
+            # unique solution - we are done
+            if self.get_solution_count(puzzle, limit=2) == 1:
+                break
+
     def drop_redundant_rules(self, puzzle):
         """
         drop redundant rules one by one
         (those that don't reduce solution count within the context of the other rules)
         """
+        start = time.perf_counter()
+        count_time = self.stats.solution_count_time
+        try:
+            self.drop_redundant_rules_loop(puzzle)
+        finally:
+            self.stats.drop_time += time.perf_counter() - start
+            self.stats.drop_solution_count_time += self.stats.solution_count_time - count_time
+
+    def drop_redundant_rules_loop(self, puzzle):
         updated = True
         while updated:
+            self.stats.drop_iterations += 1
             updated = False
             # rules backup
             rules_prev = puzzle.rules
@@ -213,29 +307,57 @@ class BasicGenerator:
                 # drop the rule
                 puzzle.rules = puzzle.rules[:i] + puzzle.rules[i+1:]
                 # still unique solution - dropped rules was redundant
-                cnt = self.get_solution_count(puzzle)
+                cnt = self.get_solution_count(puzzle, limit=2)
                 if cnt == 1:
+                    self.stats.rules_dropped += 1
                     updated = True
                     break
             # no rule was redundant - apply the backup
             else:
                 puzzle.rules = rules_prev
 
+    def record_logic_check(self, ok, elapsed):
+        self.stats.logic_checks += 1
+        self.stats.logic_check_time += elapsed
+        if ok:
+            self.stats.puzzles += 1
+        else:
+            self.stats.logic_failures += 1
+
     def generate(self):
+        start = time.perf_counter()
+        try:
+            return self.generate_loop()
+        finally:
+            self.stats.total_time += time.perf_counter() - start
+
+    def generate_loop(self):
         # try generating forever, until successful
         while True:
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                raise BudgetExceeded(DEADLINE)
             if self.verbose:
                 print("generating puzzle..")
-            # generate puzzle
+            # generate puzzle, abandon it if it runs out of budget
             puzzle = Puzzle(self.n)
-            self.reduce_until_unique(puzzle)
-            self.drop_redundant_rules(puzzle)
+            self.budget = self.new_budget()
+            self.stats.candidates += 1
+            try:
+                self.reduce_until_unique(puzzle)
+                self.drop_redundant_rules(puzzle)
+            except BudgetExceeded as e:
+                self.stats.candidates_abandoned += 1
+                if self.verbose:
+                    print("puzzle abandoned:", e.reason)
+                continue
             if self.verbose:
                 print("puzzle generated")
                 print(puzzle)
             # check if it is solvable by logic
-            lbs = LogicBasedSolver(puzzle)
-            ok, _ = lbs.solve(4)
+            ok, elapsed = check_logic_solvable(
+                puzzle, time_limit=self.time_limit, deadline=self.deadline, max_evaluations=self.max_evaluations,
+            )
+            self.record_logic_check(ok, elapsed)
             if ok:
                 if self.verbose:
                     print("puzzle successful")
@@ -243,6 +365,146 @@ class BasicGenerator:
             elif self.verbose:
                 print("puzzle unsuccessful")
 
+    def iter_generate(self, queue_size=2):
+        """
+        generate puzzles lazily, one per `next()`
+        the work is split into three stages connected by bounded queues:
+          1. add random rules until unique (in this process, since it is the only stage using the RNG)
+          2. drop redundant rules (worker process)
+          3. check solvability by logic (worker process)
+        so that e.g. the logic check of candidate k runs while candidate k+1 is being built
+        at most `queue_size` candidates wait in each queue, and nothing is built while the caller
+        doesn't ask for the next puzzle
+        yields the same puzzles in the same order as repeated calls of `generate`
+        the stats of all stages are collected in `self.stats` (total time is not, since stages overlap)
+        """
+        # imported here to keep the import of this module (and of every CLI and worker) cheap
+        import concurrent.futures
+        drop_executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        check_executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        reduced, checked = collections.deque(), collections.deque()
+        try:
+            while True:
+                # stage 3 -> caller: take the oldest checked candidate once it is done or the queue is full
+                if checked and (checked[0][1].done() or len(checked) == queue_size):
+                    puzzle, future = checked.popleft()
+                    ok, elapsed = future.result()
+                    self.record_logic_check(ok, elapsed)
+                    if ok:
+                        yield puzzle
+                    continue
+                # stage 2 -> stage 3: pass on the oldest reduced candidate once it is done or the queue is full
+                if reduced and (reduced[0].done() or len(reduced) == queue_size):
+                    puzzle, stats = reduced.popleft().result()
+                    self.stats.merge(stats)
+                    # candidate ran out of budget
+                    if puzzle is None:
+                        self.stats.candidates_abandoned += 1
+                        continue
+                    checked.append((puzzle, check_executor.submit(
+                        check_logic_solvable, puzzle,
+                        time_limit=self.time_limit, deadline=self.deadline, max_evaluations=self.max_evaluations,
+                    )))
+                    continue
+                # stage 1 -> stage 2: build a new candidate
+                if self.deadline is not None and time.monotonic() > self.deadline:
+                    raise BudgetExceeded(DEADLINE)
+                puzzle = Puzzle(self.n)
+                self.budget = self.new_budget()
+                self.stats.candidates += 1
+                try:
+                    self.reduce_until_unique(puzzle)
+                except BudgetExceeded:
+                    self.stats.candidates_abandoned += 1
+                    continue
+                reduced.append(drop_executor.submit(drop_redundant_rules, self, puzzle))
+        finally:
+            drop_executor.shutdown(wait=False, cancel_futures=True)
+            check_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def drop_redundant_rules(generator, puzzle):
+    """
+    drop redundant rules of the puzzle using the given generator (runs inside a worker process)
+    returns the puzzle (None if the candidate runs out of the generator's budget) and the stats of the stage
+    """
+    generator.stats = GeneratorStats()
+    try:
+        generator.drop_redundant_rules(puzzle)
+    except BudgetExceeded:
+        return None, generator.stats
+    return puzzle, generator.stats
+
+
+def is_logic_solvable(puzzle, max_steps=4, time_limit=None, deadline=None, max_evaluations=None):
+    """
+    check whether the puzzle is solvable by logic within `max_steps` steps
+    (and within the given time and rule evaluation limits)
+    raises `BudgetExceeded` if the absolute `deadline` (of the whole generation) passes,
+    while running out of `time_limit` just means the puzzle doesn't count as solvable
+    """
+    lbs = LogicBasedSolver(puzzle)
+    ok, _ = lbs.solve(max_steps, budget=Budget(time_limit=time_limit, deadline=deadline, max_evaluations=max_evaluations))
+    if not ok and deadline is not None and time.monotonic() > deadline:
+        raise BudgetExceeded(DEADLINE)
+    return ok
+
+
+def check_logic_solvable(puzzle, max_steps=4, time_limit=None, deadline=None, max_evaluations=None):
+    """
+    timed `is_logic_solvable`, returns whether solvable and the time it took
+    """
+    start = time.perf_counter()
+    ok = is_logic_solvable(
+        puzzle, max_steps=max_steps, time_limit=time_limit, deadline=deadline, max_evaluations=max_evaluations,
+    )
+    return ok, time.perf_counter() - start
+
+
+def derive_seed(seed, index):
+    """
+    deterministic seed for the puzzle at position `index` of a batch seeded with `seed`
+    """
+    digest = hashlib.sha256("{seed}:{index}".format(seed=seed, index=index).encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def generate_one(task):
+    """
+    generate a single puzzle of a batch (runs inside a worker process)
+    """
+    index, n, seed, weights, time_limit, max_evaluations = task
+    bg = BasicGenerator(n, seed=seed, custom_weights=weights, time_limit=time_limit, max_evaluations=max_evaluations)
+    return index, bg.generate(), bg.stats
+
+
+def generate_many(count, n, preset="easy", workers=None, seed=None, custom_weights=None,
+                  time_limit=None, max_evaluations=None, with_stats=False):
+    """
+    generate `count` puzzles of size `n` across a process pool
+    every puzzle gets its own seed derived from (`seed`, index), so the puzzle at a given index
+    is the same regardless of the number of workers
+    yields (index, puzzle) pairs as soon as they are finished, i.e., not necessarily in index order
+    with `with_stats` yields (index, puzzle, stats) with the `GeneratorStats` of each puzzle (to be merged)
+    """
+    weights = WEIGHT_PRESETS[preset] if custom_weights is None else custom_weights
+    if seed is None:
+        seed = int.from_bytes(os.urandom(8), "big")
+    tasks = ((i, n, derive_seed(seed, i), weights, time_limit, max_evaluations) for i in range(count))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # single worker - generate in this process
+    if workers <= 1:
+        results = (generate_one(task) for task in tasks)
+        for index, puzzle, stats in results:
+            yield (index, puzzle, stats) if with_stats else (index, puzzle)
+        return
+    import multiprocessing
+    with multiprocessing.Pool(workers) as pool:
+        for index, puzzle, stats in pool.imap_unordered(generate_one, tasks):
+            yield (index, puzzle, stats) if with_stats else (index, puzzle)
+
+
 if __name__ == "__main__":
     # bg = BasicGenerator(7, seed=2019, verbose=True)
     # puzzle = bg.generate()
@@ -251,3 +513,10 @@ if __name__ == "__main__":
     for i in range(10):
         puzzle = bg.generate()
         print(puzzle)
+    # generate puzzles lazily through the staged pipeline
+    bg = BasicGenerator(6, seed=2019, custom_weights=WEIGHT_PRESETS["easy"])
+    for puzzle, _ in zip(bg.iter_generate(), range(10)):
+        print(puzzle)
+    # generate a batch of puzzles across worker processes (same puzzles for any number of workers)
+    for i, puzzle in generate_many(8, 5, preset="easy", workers=4, seed=2019):
+        print(i, puzzle)
@@ -1,6 +1,21 @@
+import re
+
+
+# variable names: a letter, optionally followed by digits ("A", "X12")
+VARIABLE_PATTERN = re.compile(r"[A-Z][0-9]*")
+# tokens of an implicit multiplication block ("12AC" => "12", "A", "C"; "2X12Y3" => "2", "X12", "Y3")
+IMPLICIT_MULTIPLICATION_TOKEN_PATTERN = re.compile(r"[0-9]+|[A-Z][0-9]*")
+
+
+def is_variable_name(s):
+    return VARIABLE_PATTERN.fullmatch(s) is not None
+
+
 def raw_to_structured_rule(rule_str):
     """
     parses raw rule string into structured rule
+    variables are a letter optionally followed by digits (e.g., "A" or "X12"),
+    so a letter directly followed by a number is a single variable ("A2" is variable "A2", not "A*2")
     example input `rule_str`:
         "A+B>4"
     example result:
@@ -56,20 +71,14 @@ def raw_to_structured_rule(rule_str):
     # value (number or a single variable)
     elif rule_str.isnumeric():
         val = int(rule_str)
-    elif rule_str.isalpha() and len(rule_str) == 1:
+    elif is_variable_name(rule_str):
         val = rule_str
 
-    # implicit multiplication
+    # implicit multiplication - split off the first number or variable
     elif rule_str.isalnum():
-        # first value is variable
-        if rule_str[0].isalpha():
-            op = "*"
-            lhs_str, rhs_str = rule_str[:1], rule_str[1:]
-        # first value is number
-        else:
-            first_letter = [x.isalpha() for x in rule_str].index(True)
-            op = "*"
-            lhs_str, rhs_str = rule_str[:first_letter], rule_str[first_letter:]
+        op = "*"
+        first_token = IMPLICIT_MULTIPLICATION_TOKEN_PATTERN.match(rule_str).group()
+        lhs_str, rhs_str = rule_str[:len(first_token)], rule_str[len(first_token):]
 
     # parse complex expression (containing brackets and/or explicit operations)
     else:
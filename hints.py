@@ -0,0 +1,163 @@
+from budget import Budget
+from puzzle import Puzzle
+from rule import Rule
+from solver_logic import LogicBasedSolver
+
+
+class Hint:
+    """
+    a single deduction: the values `removed` ({variable: set of values}) from the possible values by `strategy`
+    ("rule" with the `rule` used, "naked_subset", "hidden_subset" or "placement" of a value by the user),
+    or the `new_rules` introduced by substituting variable expressions into rules ("derive")
+    `derived` tells whether the rule used is a derived one (i.e., introduced by an earlier "derive" hint)
+    """
+    def __init__(self, strategy, removed=None, rule: Rule = None, derived=False, new_rules=None):
+        self.strategy = strategy
+        self.removed = removed or {}
+        self.rule = rule
+        self.derived = derived
+        self.new_rules = new_rules or []
+
+    def __str__(self):
+        if self.strategy == "derive":
+            return "derive: {rules}".format(rules=", ".join(rule.get_simplified_str() for rule in self.new_rules))
+        removed = "; ".join(
+            "{var}: -{vals}".format(var=var, vals=",".join(str(val) for val in sorted(vals)))
+            for var, vals in sorted(self.removed.items())
+        )
+        if self.strategy == "rule":
+            return "rule {rule}{derived}: {removed}".format(
+                rule=self.rule.get_simplified_str(), derived=" (derived)" if self.derived else "", removed=removed,
+            )
+        return "{strategy}: {removed}".format(strategy=self.strategy.replace("_", " "), removed=removed)
+
+    def as_dict(self):
+        return {
+            "strategy": self.strategy,
+            "removed": {var: sorted(vals) for var, vals in self.removed.items()},
+            "rule": self.rule.get_simplified_str() if self.rule is not None else None,
+            "derived": self.derived,
+            "new_rules": [rule.get_simplified_str() for rule in self.new_rules],
+        }
+
+
+class HintSolver:
+    """
+    interactive, step by step solving: every `next_hint` call makes the single next deduction a human would make
+    (reduce by a rule, then by the subset strategies, derive new rules only when nothing else works)
+    the state is kept in a `LogicBasedSolver` between calls, and only rules with a variable whose possible values
+    changed since they were last checked are checked again, so a call does only the work of its own step
+    values placed by the user (`place`) are propagated the same way
+    """
+    def __init__(self, puzzle: Puzzle, max_rules=LogicBasedSolver.MAX_RULES, max_expressions=LogicBasedSolver.MAX_EXPRESSIONS):
+        self.solver = LogicBasedSolver(puzzle, max_rules=max_rules, max_expressions=max_expressions)
+        self.solver.stats.start_step()
+        # rules that can't reduce the current possible values, by id (keeping the rule alive, so the id is not reused)
+        self.checked = {}
+        # some variable has no possible value left, or two variables have the same single one
+        # (e.g., after a wrong placement)
+        self.contradiction = False
+
+    @property
+    def possible_values(self):
+        return self.solver.possible_values
+
+    def is_solved(self):
+        return not self.contradiction and all(len(vals) == 1 for vals in self.possible_values.values())
+
+    def changed(self, previous_possible_values, strategy, rule: Rule = None, derived=False):
+        """
+        the hint describing the change of the possible values since `previous_possible_values`
+        rules with a variable that lost values are to be checked again
+        """
+        removed = {
+            var: vals - self.possible_values[var]
+            for var, vals in previous_possible_values.items() if vals != self.possible_values[var]
+        }
+        for rule_id, checked_rule in list(self.checked.items()):
+            if any(var in removed for var in checked_rule.variables):
+                del self.checked[rule_id]
+        singles = [next(iter(vals)) for vals in self.possible_values.values() if len(vals) == 1]
+        if any(not vals for vals in self.possible_values.values()) or len(set(singles)) < len(singles):
+            self.contradiction = True
+        return Hint(strategy, removed=removed, rule=rule, derived=derived)
+
+    def next_hint(self, derive=True, budget: Budget = None):
+        """
+        make the next deduction and return its `Hint`, None if there is none
+        (solved, contradiction, or nothing left to deduce - without `derive`, as soon as no rule or strategy
+        removes a value)
+        raises `BudgetExceeded` if `budget` runs out (the state stays consistent, the next call just repeats the work)
+        """
+        if self.contradiction:
+            return None
+        solver = self.solver
+        solver.budget = budget if budget is not None else Budget()
+        # the first rule that removes a value
+        for rule, usage in zip(solver.rules, solver.rule_usage):
+            if id(rule) in self.checked:
+                continue
+            possible_values = solver.possible_values
+            if solver.reduce_by_rule(rule, usage):
+                return self.changed(possible_values, "rule", rule=rule, derived=usage is not None)
+            self.checked[id(rule)] = rule
+        for strategy in solver.SUBSET_STRATEGIES:
+            possible_values = solver.possible_values
+            if solver.reduce_by_subsets(strategy):
+                return self.changed(possible_values, strategy)
+        if not derive or self.is_solved():
+            return None
+        # nothing reduces any more - end of the solver step, derive new rules
+        solver.evict_rules()
+        solver.evict_variable_expressions()
+        solver.steps_done += 1
+        current = {id(rule) for rule in solver.rules}
+        self.checked = {rule_id: rule for rule_id, rule in self.checked.items() if rule_id in current}
+        new_rules = solver.derive_rules()
+        solver.stats.start_step()
+        if not new_rules:
+            return None
+        return Hint("derive", new_rules=new_rules)
+
+    def place(self, var, val, propagate=True):
+        """
+        place a value entered by the user (the value is removed from the other variables as part of the placement),
+        returns the hints of the placement and
+        (with `propagate`) of its consequences - the deductions by rules and strategies it enables
+        raises `ValueError` if the value is not possible for the variable any more
+        """
+        if val not in self.possible_values.get(var, ()):
+            raise ValueError("{val} is not a possible value of {var}".format(val=val, var=var))
+        possible_values = self.possible_values
+        self.solver.possible_values = {
+            other: {val} if other == var else vals - {val} for other, vals in possible_values.items()
+        }
+        hints = [self.changed(possible_values, "placement")]
+        while propagate:
+            hint = self.next_hint(derive=False)
+            if hint is None:
+                break
+            hints.append(hint)
+        return hints
+
+
+if __name__ == "__main__":
+    puzzle = Puzzle(7)
+    puzzle.add_rules([
+        "B+G=D",
+        "B+C=A",
+        "C+E+G=F",
+        "D<A=>C=2",
+        "D>A=>E=2",
+    ])
+    hs = HintSolver(puzzle)
+    while True:
+        hint = hs.next_hint()
+        if hint is None:
+            break
+        print(hint)
+    print("solved" if hs.is_solved() else "stuck", hs.possible_values)
+    # placing a value propagates just its consequences
+    hs = HintSolver(puzzle)
+    for hint in hs.place("G", 3):
+        print(hint)
@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from itertools import islice
+
+from budget import Budget, BudgetExceeded, MAX_STEPS, SOLVED
+from generator import BasicGenerator, WEIGHT_PRESETS
+from puzzle import Puzzle
+from solutions import ENGINES, iter_solutions
+from solver_logic import LogicBasedSolver
+from run import iter_input
+from solver_table import MAX_TABLE_N, open_table
+
+
+# regression corpus of slow puzzles, one JSON line per reproducer (timed by the benchmark's "regress" stage)
+REGRESSIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "regressions.jsonl")
+# what is timed: solving with an engine (first `SOLVE_LIMIT` solutions, like `solve_batch.py` and the service),
+# or the generator's logic solvability check
+LOGIC_CHECK = "logic_check"
+TARGETS = sorted(ENGINES.keys()) + [LOGIC_CHECK]
+SOLVE_LIMIT = 2
+LOGIC_CHECK_STEPS = 4
+METRICS = ["time", "evaluations"]
+
+
+def run_target(puzzle: Puzzle, target, budget=None):
+    """
+    do the work of `target` on the puzzle (raises `BudgetExceeded` if `budget` runs out)
+    """
+    if target == LOGIC_CHECK:
+        solver = LogicBasedSolver(puzzle)
+        solver.solve(max_steps=LOGIC_CHECK_STEPS, budget=budget)
+        if budget is not None and solver.stop_reason not in [SOLVED, MAX_STEPS]:
+            raise BudgetExceeded(solver.stop_reason)
+        return
+    for _ in islice(iter_solutions(puzzle, engine=target, budget=budget), SOLVE_LIMIT):
+        pass
+
+
+def measure(puzzle: Puzzle, target, time_limit=None):
+    """
+    wall time and rule evaluations of `target` on the puzzle
+    runs that hit `time_limit` are stopped and reported with `timed_out` (the time limit then is the cost)
+    """
+    if target == "table":
+        if puzzle.n > MAX_TABLE_N:
+            return None
+        # every run starts without cached rule masks, so that runs don't get cheaper by seeing the same rules again
+        open_table(puzzle.n).masks.clear()
+    budget = Budget(time_limit=time_limit)
+    start = time.perf_counter()
+    timed_out = False
+    try:
+        run_target(puzzle, target, budget=budget)
+    except BudgetExceeded:
+        timed_out = True
+    return {"time": time.perf_counter() - start, "evaluations": budget.evaluations, "timed_out": timed_out}
+
+
+def weights_ok(key, pair):
+    """
+    whether a pair of generator weights can be used:
+    some choice has to be possible, rules need variables, and expressions must stay small
+    (an expression is expanded further with probability at most 1/3, otherwise they may grow without end)
+    """
+    if key == "var_num":
+        return pair[0] > 0
+    if key == "val_exp":
+        return pair[0] > 0 and 2 * pair[1] <= pair[0]
+    return any(pair)
+
+
+def random_weights(rng, base=None):
+    """
+    generator weights: a mutation of `base` (each weight moved by up to 2), or entirely random ones
+    """
+    weights = {}
+    for key, pair in WEIGHT_PRESETS["easy"].items():
+        while True:
+            if base is not None:
+                new_pair = [max(0, w + rng.randint(-2, 2)) for w in base[key]]
+            else:
+                new_pair = [rng.randint(0, 10) for _ in pair]
+            if weights_ok(key, new_pair):
+                break
+        weights[key] = new_pair
+    return weights
+
+
+def random_candidate(n, weights, seed, time_limit=None):
+    """
+    puzzle with a unique solution from the generator's candidate stages (adding rules until unique,
+    dropping redundant ones), without the logic solvability check - the puzzles solvers are asked to solve,
+    None if it couldn't be built within `time_limit` seconds
+    """
+    bg = BasicGenerator(n, seed=seed, custom_weights=weights, time_limit=time_limit)
+    puzzle = Puzzle(n)
+    bg.budget = bg.new_budget()
+    try:
+        bg.reduce_until_unique(puzzle)
+        bg.drop_redundant_rules(puzzle)
+    except BudgetExceeded:
+        return None
+    return puzzle
+
+
+def minimize(puzzle: Puzzle, target, metric, cost, keep_ratio=0.5, time_limit=None):
+    """
+    drop rules one by one as long as the puzzle stays slow (at least `keep_ratio` of the original `cost`)
+    returns the reduced puzzle and its cost
+    """
+    threshold = keep_ratio * cost
+    updated = True
+    while updated:
+        updated = False
+        for i in range(len(puzzle.rules)):
+            reduced = Puzzle.with_rules(puzzle.n, puzzle.rules[:i] + puzzle.rules[i+1:])
+            result = measure(reduced, target, time_limit=time_limit)
+            if result[metric] >= threshold:
+                puzzle, cost = reduced, result[metric]
+                updated = True
+                break
+    return puzzle, cost
+
+
+def iter_file_puzzles(paths):
+    """
+    puzzles from files in the `data/` text format, with their origin
+    """
+    for path in paths:
+        with open(path, "r") as fin:
+            for ind, puzzle_raw in enumerate(iter_input(fin)):
+                puzzle = Puzzle(puzzle_raw["n"])
+                puzzle.add_rules(rules_str=puzzle_raw["rules"])
+                yield puzzle, {"source": path, "index": ind}
+
+
+def hunt(sizes, targets, rounds, metric="time", seed=None, top=3, time_limit=10.0, candidate_time_limit=5.0,
+         keep_ratio=0.5, files=(), verbose=False):
+    """
+    search for the slowest puzzles of each target: every round generates a candidate (with weights mutated from
+    those that produced the slowest puzzle of a random target so far, or random ones) and measures all targets
+    puzzles from `files` (e.g., the bundled ones) are measured as well, before the search
+    the `top` slowest puzzles of each target are then minimized
+    returns the reproducers as dicts (see `REGRESSIONS_PATH`)
+    """
+    rng = random.Random(seed)
+    # target -> [(cost, puzzle, origin)], slowest first
+    worst = {target: [] for target in targets}
+
+    def add_candidate(puzzle, origin):
+        for target in targets:
+            result = measure(puzzle, target, time_limit=time_limit)
+            if result is None:
+                continue
+            found = worst[target]
+            found.append((result[metric], puzzle, origin))
+            found.sort(key=lambda item: -item[0])
+            del found[top:]
+
+    for puzzle, origin in iter_file_puzzles(files):
+        add_candidate(puzzle, origin)
+    for round_ind in range(rounds):
+        n = rng.choice(sizes)
+        best = [found[0][2]["weights"] for found in worst.values() if found and "weights" in found[0][2]]
+        base = rng.choice(best) if best and rng.random() < 0.7 else None
+        weights = random_weights(rng, base)
+        candidate_seed = rng.getrandbits(32)
+        puzzle = random_candidate(n, weights, candidate_seed, time_limit=candidate_time_limit)
+        if puzzle is None:
+            continue
+        add_candidate(puzzle, {"weights": weights, "seed": candidate_seed})
+        if verbose:
+            print("round {ind}: {worst}".format(ind=round_ind, worst=", ".join(
+                "{target} {cost:.4g}".format(target=target, cost=found[0][0]) for target, found in worst.items() if found
+            )), file=sys.stderr)
+    reproducers = []
+    for target, found in worst.items():
+        for cost, puzzle, origin in found:
+            reduced, reduced_cost = minimize(puzzle, target, metric, cost, keep_ratio=keep_ratio, time_limit=time_limit)
+            reproducers.append({
+                "target": target,
+                "metric": metric,
+                "cost": reduced_cost,
+                "n": reduced.n,
+                "rules": [rule.get_simplified_str() for rule in reduced.rules],
+                "original": dict(origin, cost=cost, rules=[rule.get_simplified_str() for rule in puzzle.rules]),
+            })
+            if verbose:
+                print("{target}: {cost:.4g} with {k} rules ({original_k} before minimizing)".format(
+                    target=target, cost=reduced_cost, k=len(reduced.rules), original_k=len(puzzle.rules),
+                ), file=sys.stderr)
+    return reproducers
+
+
+def load_regressions(path=REGRESSIONS_PATH):
+    """
+    reproducers of the regression corpus, empty if there is none
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+
+def save_regressions(reproducers, path=REGRESSIONS_PATH):
+    """
+    add reproducers to the regression corpus, skipping those that are already in it (same target and rules)
+    returns the number added
+    """
+    present = {(entry["target"], tuple(entry["rules"])) for entry in load_regressions(path)}
+    added = 0
+    with open(path, "a") as fout:
+        for entry in reproducers:
+            key = (entry["target"], tuple(entry["rules"]))
+            if key in present:
+                continue
+            present.add(key)
+            fout.write(json.dumps(entry, sort_keys=True) + "\n")
+            added += 1
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="search for puzzles that are slow to solve, save minimized reproducers")
+    parser.add_argument("files", nargs="*", help="puzzle files to measure as well (e.g., data/input*x*.txt)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 6, 7])
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=TARGETS)
+    parser.add_argument("--rounds", type=int, default=50, help="candidate puzzles to generate")
+    parser.add_argument("--metric", choices=METRICS, default="time",
+                        help="cost to maximize (rule evaluations are deterministic, time is what users see)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--top", type=int, default=3, help="slowest puzzles to keep per target")
+    parser.add_argument("--time-limit", type=float, default=10.0, help="stop measuring a run after this many seconds")
+    parser.add_argument("--candidate-time-limit", type=float, default=5.0, help="seconds to build a candidate")
+    parser.add_argument("--keep-ratio", type=float, default=0.5,
+                        help="minimized reproducers keep at least this fraction of the original cost")
+    parser.add_argument("--output", default=REGRESSIONS_PATH, help="regression corpus to add reproducers to")
+    parser.add_argument("--dry-run", action="store_true", help="print reproducers instead of saving them")
+    args = parser.parse_args(argv)
+
+    reproducers = hunt(
+        args.sizes, args.targets, args.rounds,
+        metric=args.metric,
+        seed=args.seed,
+        top=args.top,
+        time_limit=args.time_limit,
+        candidate_time_limit=args.candidate_time_limit,
+        keep_ratio=args.keep_ratio,
+        files=args.files,
+        verbose=True,
+    )
+    if args.dry_run:
+        for entry in reproducers:
+            print(json.dumps(entry, sort_keys=True))
+    else:
+        added = save_regressions(reproducers, args.output)
+        print("added {added} reproducers to {path}".format(added=added, path=args.output), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
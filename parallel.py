@@ -0,0 +1,28 @@
+import collections
+
+
+def ordered_map(fn, iterable, workers=1, window=None):
+    """
+    map `fn` over `iterable` on a pool of `workers` processes, yielding results in input order
+    at most `window` tasks (default: 4 per worker) are in flight at any time,
+    so the input is only consumed as fast as the results are taken and memory use stays flat
+    """
+    if workers <= 1:
+        for item in iterable:
+            yield fn(item)
+        return
+    if window is None:
+        window = 4 * workers
+    # imported only when a pool is actually needed, it's a noticeable part of the CLI's start-up time
+    import concurrent.futures
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    pending = collections.deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
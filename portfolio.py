@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import time
+from itertools import islice
+
+from puzzle import Puzzle
+from run import iter_input
+from solutions import ENGINES, iter_solutions, solution_to_dict
+from stats import PortfolioStats
+
+
+# engines raced by default
+PORTFOLIO_ENGINES = ["brute", "logic", "search", "cdcl"]
+
+
+def puzzle_class(puzzle: Puzzle):
+    """
+    coarse class of similar puzzles that engine wins are collected for:
+    size and whether the puzzle is equality-heavy (at least half of its rules are equations)
+    """
+    equations = sum(1 for rule in puzzle.rules if rule.rule["op"] == "=")
+    kind = "equalities" if 2 * equations >= len(puzzle.rules) else "mixed"
+    return "n={n}/{kind}".format(n=puzzle.n, kind=kind)
+
+
+def run_engine(engine, puzzle: Puzzle, limit, results):
+    """
+    count the puzzle's solutions up to `limit` with a single engine, put the answer to `results`
+    (runs in its own process, which is terminated once another engine answers first)
+    """
+    start = time.perf_counter()
+    try:
+        cnt, first_solution = 0, None
+        for solution in islice(iter_solutions(puzzle, engine=engine), limit):
+            cnt += 1
+            if first_solution is None:
+                first_solution = solution
+        solution = solution_to_dict(puzzle, first_solution) if first_solution is not None else None
+        results.put((engine, cnt, solution, time.perf_counter() - start, None))
+    except Exception as e:
+        results.put((engine, None, None, time.perf_counter() - start, repr(e)))
+
+
+def race(puzzle: Puzzle, engines=None, limit=2, timeout=None, stats: PortfolioStats = None):
+    """
+    run `engines` on the puzzle in parallel processes, return the first definitive answer and stop the others
+    an answer is the solution count (up to `limit`) and a solution, engines that fail don't answer
+    returns {"engine", "count", "solution", "engine_time", "time", "errors"} with the winner's own solving time
+    and the time of the whole race (including starting and stopping processes),
+    engine (and the rest) None if no engine answered within `timeout` seconds
+    the winner and its solving time are recorded in `stats` (if given)
+    """
+    import multiprocessing
+    engines = engines or PORTFOLIO_ENGINES
+    start = time.perf_counter()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_engine, args=(engine, puzzle, limit, results), daemon=True)
+        for engine in engines
+    ]
+    for process in processes:
+        process.start()
+    answer = {"engine": None, "count": None, "solution": None, "engine_time": None, "time": None, "errors": {}}
+    try:
+        for _ in processes:
+            remaining = None if timeout is None else max(0.0, timeout - (time.perf_counter() - start))
+            try:
+                engine, cnt, solution, engine_time, error = results.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if error is not None:
+                answer["errors"][engine] = error
+                continue
+            answer.update(engine=engine, count=cnt, solution=solution, engine_time=engine_time)
+            break
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        results.close()
+    answer["time"] = time.perf_counter() - start
+    if stats is not None:
+        stats.record(puzzle_class(puzzle), answer["engine"], answer["engine_time"])
+    return answer
+
+
+def pick_engine(puzzle: Puzzle, stats: PortfolioStats, min_races=5, default="auto"):
+    """
+    engine that won most races on puzzles of the same class, `default` if there is not enough data
+    """
+    return stats.best_engine(puzzle_class(puzzle), min_races=min_races) or default
+
+
+def load_stats(path):
+    """
+    portfolio stats from a JSON file, empty stats if it doesn't exist
+    """
+    if path is None or not os.path.exists(path):
+        return PortfolioStats()
+    with open(path, "r") as fin:
+        return PortfolioStats.from_dict(json.load(fin))
+
+
+def save_stats(stats: PortfolioStats, path):
+    with open(path, "w") as fout:
+        json.dump(stats.as_dict(), fout, indent=2, sort_keys=True)
+
+
+# portfolio stats loaded once per (worker) process and path
+_loaded_stats = {}
+
+
+def open_stats(path):
+    """
+    portfolio stats from `path`, loaded once per process
+    """
+    key = (os.getpid(), path)
+    if key not in _loaded_stats:
+        _loaded_stats[key] = load_stats(path)
+    return _loaded_stats[key]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="race solver engines on puzzles, collect which engine wins")
+    parser.add_argument("files", nargs="*", default=["-"], help="puzzle files, - for stdin (default)")
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES.keys()), default=PORTFOLIO_ENGINES)
+    parser.add_argument("--limit", type=int, default=2, help="count solutions up to this number")
+    parser.add_argument("--timeout", type=float, default=None, help="give up on a puzzle after this many seconds")
+    parser.add_argument("--stats", help="JSON file of win stats to update (e.g., for `solve_batch.py --portfolio-stats`)")
+    args = parser.parse_args(argv)
+
+    stats = load_stats(args.stats)
+    for path in args.files:
+        fin = sys.stdin if path == "-" else open(path, "r")
+        try:
+            for ind, puzzle_raw in enumerate(iter_input(fin)):
+                puzzle = Puzzle(puzzle_raw["n"])
+                puzzle.add_rules(rules_str=puzzle_raw["rules"])
+                answer = race(puzzle, engines=args.engines, limit=args.limit, timeout=args.timeout, stats=stats)
+                print(json.dumps(dict(answer, source=path, index=ind, puzzle_class=puzzle_class(puzzle))))
+        finally:
+            if fin is not sys.stdin:
+                fin.close()
+    if args.stats:
+        save_stats(stats, args.stats)
+    print("{puzzle_class:<20} {races:>6} {best:>8}  wins".format(puzzle_class="class", races="races", best="best"),
+          file=sys.stderr)
+    for cls in sorted(set(stats.wins) | set(stats.unanswered)):
+        wins = stats.wins.get(cls, {})
+        print("{puzzle_class:<20} {races:>6} {best:>8}  {wins}".format(
+            puzzle_class=cls,
+            races=sum(wins.values()) + stats.unanswered.get(cls, 0),
+            best=str(stats.best_engine(cls, min_races=1)),
+            wins=", ".join("{engine}: {cnt}".format(engine=engine, cnt=cnt) for engine, cnt in sorted(wins.items())),
+        ), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
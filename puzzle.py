@@ -1,11 +1,21 @@
+import hashlib
 import string
 from rule import Rule
 
 
+def variable_names(n):
+    """
+    names of the puzzle's variables: "A", "B", .. for up to 26 variables, "X1", "X2", .. for more
+    """
+    if n <= len(string.ascii_uppercase):
+        return list(string.ascii_uppercase[:n])
+    return ["X{i}".format(i=i) for i in range(1, n+1)]
+
+
 class Puzzle:
     def __init__(self, n):
         self.n = n
-        self.variables = string.ascii_uppercase[:n]
+        self.variables = variable_names(n)
         self.rules = []
 
     def __str__(self):
@@ -14,6 +24,15 @@ class Puzzle:
             rules=",\n  ".join(rule.__str__() for rule in self.rules)
         )
 
+    @classmethod
+    def with_rules(cls, n, rules):
+        """
+        puzzle of size `n` with the given (already constructed) rules
+        """
+        puzzle = cls(n)
+        puzzle.rules = list(rules)
+        return puzzle
+
     def add_rule(self, rule_str=None, rule_structured=None):
         if rule_str is not None:
             self.rules.append(Rule(rule_raw=rule_str))
@@ -27,3 +46,12 @@ class Puzzle:
         else:
             for rule_structured in rules_structured:
                 self.add_rule(rule_structured=rule_structured)
+
+    def fingerprint(self):
+        """
+        canonical fingerprint of the puzzle: n and the sorted canonical (simplified) rule strings
+        puzzles that differ only in the order or formatting of their rules have the same fingerprint
+        """
+        rules_canonical = sorted(rule.get_simplified_str() for rule in self.rules)
+        key = "{n}:{rules}".format(n=self.n, rules="\n".join(rules_canonical))
+        return hashlib.sha256(key.encode()).hexdigest()
@@ -1,5 +1,5 @@
+import math
 from collections import defaultdict
-import sympy
 
 from helpers import raw_to_structured_rule, structured_to_raw_rule
 
@@ -12,12 +12,25 @@ class Rule:
         # used to maintain the form "X=..." as opposed to "...=0"
         self.is_variable_expression = is_variable_expression
         if self.is_variable_expression:
-            assert "value" in self.rule["lhs"] and self.rule["lhs"]["value"].isalpha()
+            assert "value" in self.rule["lhs"] and isinstance(self.rule["lhs"]["value"], str)
         self.variables, self.variable_counts = None, None
         self.update_rule_variables()
         # simplify after initialization
         self.simplify()
 
+    @classmethod
+    def from_simplified(cls, rule_structured):
+        """
+        rule from a structured rule that is already simplified (e.g., `rule.rule` of a rule stored earlier),
+        skips simplifying it again
+        """
+        rule = cls.__new__(cls)
+        rule.rule = rule_structured
+        rule.is_variable_expression = False
+        rule.variables, rule.variable_counts = None, None
+        rule.update_rule_variables()
+        return rule
+
     def __str__(self):
         return "<Rule: {simplified}>" .format(simplified=self.get_simplified_str())
 
@@ -54,11 +67,14 @@ class Rule:
         get the simplified version of the rule as string
         """
         # replace exponents with multiple multipliers
-        # "A**3" => "A*A*A"
+        # "A**3" => "A*A*A", "X12**2" => "X12*X12"
         def replace_exponents(expr):
             while "**" in expr:
                 ind = expr.index("**")
-                p, var = "", expr[ind-1]
+                ind1 = ind
+                while ind1 > 0 and expr[ind1-1].isalnum():
+                    ind1 -= 1
+                p, var = "", expr[ind1:ind]
                 ind2 = ind + 2
                 while ind2 < len(expr) and expr[ind2].isnumeric():
                     p += expr[ind2]
@@ -66,11 +82,16 @@ class Rule:
                 # case "A**(-2)" or similar - too complex and we will skip it later anyway, so disregard the expression
                 if not p:
                     return expr
-                expr = expr[:ind-1] + "*".join([var, ] * int(p)) + expr[ind+3:]
+                expr = expr[:ind1] + "*".join([var, ] * int(p)) + expr[ind2:]
             return expr
 
         # simplify an expression ("A+A-1" => "2A-1")
+        # polynomials are expanded here, sympy (slow to import) is only needed for division
         def simplify_expression(expression):
+            polynomial = expression_polynomial(expression)
+            if polynomial is not None:
+                return polynomial_str(polynomial)
+            import sympy
             raw_tmp = structured_to_raw_rule(expression)
             raw_simple = str(sympy.expand(raw_tmp.lower())).upper()
             raw_simple = raw_simple.replace(" ", "").upper()
@@ -220,6 +241,339 @@ class Rule:
         raise Exception("Failed to eval!", self.rule, values)
 
 
+def compile_rule(rule: Rule):
+    """
+    compile the rule into a function that gives the same result as `rule.eval_rule`,
+    but takes the values of `rule.variables` as positional arguments (in that order)
+    rules without division become a single python expression, the rest nested closures
+    (division has to give "no value" unless it is exact, which plain python operators don't do)
+    """
+    args = ["v{i}".format(i=i) for i in range(len(rule.variables))]
+    names = dict(zip(rule.variables, args))
+    if "/" not in structured_to_raw_rule(rule.rule):
+        return eval("lambda {args}: bool({code})".format(args=", ".join(args), code=rule_code(rule.rule, names)), {})
+    eval_closure = compile_rule_closure(rule)
+    return lambda *values: eval_closure(dict(zip(rule.variables, values)))
+
+
+def rule_code(expression, names):
+    """
+    python source of a (division-free) structured rule or expression, variables replaced by `names`
+    """
+    if "value" in expression:
+        if isinstance(expression["value"], int):
+            return str(expression["value"])
+        return names[expression["value"]]
+    lhs, rhs = rule_code(expression["lhs"], names), rule_code(expression["rhs"], names)
+    op = expression["op"]
+    if op == "=>":
+        return "((not {lhs}) or {rhs})".format(lhs=lhs, rhs=rhs)
+    if op == "<=>":
+        return "({lhs} == {rhs})".format(lhs=lhs, rhs=rhs)
+    if op not in ["+", "-", "*", "=", "!=", ">", "<", ">=", "<="]:
+        raise Exception("Failed to compile!", expression)
+    return "({lhs} {op} {rhs})".format(lhs=lhs, op="==" if op == "=" else op, rhs=rhs)
+
+
+def compile_rule_closure(rule: Rule):
+    """
+    compile the rule into a function of {variable: value} that gives the same result as `rule.eval_rule`
+    (nested closures instead of walking the structured rule on every evaluation)
+    """
+    arithmetic_ops = {
+        "+": lambda a, b: a + b,
+        "-": lambda a, b: a - b,
+        "*": lambda a, b: a * b,
+        "/": lambda a, b: a // b if a > 0 and a % b == 0 else None,
+        "=": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        ">": lambda a, b: a > b,
+        "<": lambda a, b: a < b,
+        ">=": lambda a, b: a >= b,
+        "<=": lambda a, b: a <= b,
+    }
+    logical_ops = {
+        "=>": lambda a, b: (a and b) or (not a),
+        "<=>": lambda a, b: (a and b) or (not a and not b),
+    }
+
+    def rec(expression):
+        if "value" in expression:
+            value = expression["value"]
+            if isinstance(value, int):
+                return lambda values: value
+            return lambda values: values[value]
+        f = arithmetic_ops[expression["op"]]
+        get_lhs, get_rhs = rec(expression["lhs"]), rec(expression["rhs"])
+
+        def get_val(values):
+            lhs, rhs = get_lhs(values), get_rhs(values)
+            if lhs is None or rhs is None:
+                return None
+            return f(lhs, rhs)
+        return get_val
+
+    op = rule.rule["op"]
+    f = logical_ops[op] if op in logical_ops else arithmetic_ops[op]
+    get_lhs, get_rhs = rec(rule.rule["lhs"]), rec(rule.rule["rhs"])
+
+    def eval_compiled(values):
+        lhs, rhs = get_lhs(values), get_rhs(values)
+        if lhs is None or rhs is None:
+            return False
+        return bool(f(lhs, rhs))
+    return eval_compiled
+
+
+# relations that bounds of both sides can rule out
+BOUNDED_RELATIONS = {
+    "=": lambda lhs, rhs: lhs[0] <= rhs[1] and rhs[0] <= lhs[1],
+    "!=": lambda lhs, rhs: not (lhs[0] == lhs[1] == rhs[0] == rhs[1]),
+    ">": lambda lhs, rhs: lhs[1] > rhs[0],
+    "<": lambda lhs, rhs: lhs[0] < rhs[1],
+    ">=": lambda lhs, rhs: lhs[1] >= rhs[0],
+    "<=": lambda lhs, rhs: lhs[0] <= rhs[1],
+}
+# relations that bounds of both sides can prove
+CERTAIN_RELATIONS = {
+    "=": lambda lhs, rhs: lhs[0] == lhs[1] == rhs[0] == rhs[1],
+    "!=": lambda lhs, rhs: lhs[1] < rhs[0] or rhs[1] < lhs[0],
+    ">": lambda lhs, rhs: lhs[0] > rhs[1],
+    "<": lambda lhs, rhs: lhs[1] < rhs[0],
+    ">=": lambda lhs, rhs: lhs[0] >= rhs[1],
+    "<=": lambda lhs, rhs: lhs[1] <= rhs[0],
+}
+
+
+def expression_bounds(expression, bounds):
+    """
+    (min, max) of an arithmetic expression given {variable: (min, max)} of its variables
+    (interval arithmetic, so the range may be wider than the true one, but never narrower)
+    """
+    if "value" in expression:
+        if isinstance(expression["value"], int):
+            return expression["value"], expression["value"]
+        return bounds[expression["value"]]
+    op = expression["op"]
+    (lhs_min, lhs_max), (rhs_min, rhs_max) = expression_bounds(expression["lhs"], bounds), expression_bounds(expression["rhs"], bounds)
+    if op == "+":
+        return lhs_min + rhs_min, lhs_max + rhs_max
+    if op == "-":
+        return lhs_min - rhs_max, lhs_max - rhs_min
+    if op == "*":
+        products = [lhs_min * rhs_min, lhs_min * rhs_max, lhs_max * rhs_min, lhs_max * rhs_max]
+        return min(products), max(products)
+    # division (exact or no value) - don't bother
+    return -math.inf, math.inf
+
+
+def relation_possible(relation, bounds):
+    """
+    whether the (structured) relation can hold for some values within {variable: (min, max)}
+    """
+    op = relation["op"]
+    if op == "=>":
+        return not relation_certain(relation["lhs"], bounds) or relation_possible(relation["rhs"], bounds)
+    if op == "<=>":
+        lhs, rhs = relation["lhs"], relation["rhs"]
+        return (
+            (relation_possible(lhs, bounds) and relation_possible(rhs, bounds))
+            or (not relation_certain(lhs, bounds) and not relation_certain(rhs, bounds))
+        )
+    return BOUNDED_RELATIONS[op](expression_bounds(relation["lhs"], bounds), expression_bounds(relation["rhs"], bounds))
+
+
+def relation_certain(relation, bounds):
+    """
+    whether the (structured) relation holds for all values within {variable: (min, max)}
+    """
+    op = relation["op"]
+    if op == "=>":
+        return not relation_possible(relation["lhs"], bounds) or relation_certain(relation["rhs"], bounds)
+    if op == "<=>":
+        lhs, rhs = relation["lhs"], relation["rhs"]
+        return (
+            (relation_certain(lhs, bounds) and relation_certain(rhs, bounds))
+            or (not relation_possible(lhs, bounds) and not relation_possible(rhs, bounds))
+        )
+    return CERTAIN_RELATIONS[op](expression_bounds(relation["lhs"], bounds), expression_bounds(relation["rhs"], bounds))
+
+
+def rule_possible(rule: Rule, bounds):
+    """
+    whether the rule can hold for some values within {variable: (min, max)}
+    """
+    return relation_possible(rule.rule, bounds)
+
+
+def rule_certain(rule: Rule, bounds):
+    """
+    whether the rule holds for all values within {variable: (min, max)}
+    """
+    return relation_certain(rule.rule, bounds)
+
+
+def expression_polynomial(expression):
+    """
+    expand an arithmetic expression into a polynomial {monomial: coefficient},
+    a monomial being the sorted tuple of its variables (with repetition), () for the constant term
+    None if the expression has division (no exact polynomial form)
+    """
+    if "value" in expression:
+        if isinstance(expression["value"], int):
+            return {(): expression["value"]} if expression["value"] else {}
+        return {(expression["value"], ): 1}
+    op = expression["op"]
+    if op not in ["+", "-", "*"]:
+        return None
+    lhs, rhs = expression_polynomial(expression["lhs"]), expression_polynomial(expression["rhs"])
+    if lhs is None or rhs is None:
+        return None
+    result = defaultdict(int)
+    if op == "*":
+        for monomial_lhs, coef_lhs in lhs.items():
+            for monomial_rhs, coef_rhs in rhs.items():
+                result[tuple(sorted(monomial_lhs + monomial_rhs))] += coef_lhs * coef_rhs
+    else:
+        sign = 1 if op == "+" else -1
+        for monomial, coef in lhs.items():
+            result[monomial] += coef
+        for monomial, coef in rhs.items():
+            result[monomial] += sign * coef
+    return {monomial: coef for monomial, coef in result.items() if coef != 0}
+
+
+def polynomial_str(polynomial):
+    """
+    string of a polynomial (see `expression_polynomial`) with terms in the order sympy prints them:
+    lexicographically by exponents of the variables sorted by name (higher first), constant term last
+    e.g., {("A", "A"): 1, ("A", "B"): -2, (): 3} => "A*A-2*A*B+3"
+    """
+    if not polynomial:
+        return "0"
+    variables = sorted({var for monomial in polynomial for var in monomial})
+
+    def exponents(monomial):
+        return tuple(monomial.count(var) for var in variables)
+
+    result = ""
+    for monomial in sorted(polynomial, key=exponents, reverse=True):
+        coef = polynomial[monomial]
+        sign = "-" if coef < 0 else "+" if result else ""
+        if not monomial:
+            term = str(abs(coef))
+        elif abs(coef) == 1:
+            term = "*".join(monomial)
+        else:
+            term = str(abs(coef)) + "*" + "*".join(monomial)
+        result += sign + term
+    return result
+
+
+# relation => (normalized relation, sign of "lhs - rhs", shift of the constant) for `normalized_relation`
+# strict inequalities are tightened by one (values are integers), "<"/"<=" are flipped to ">="
+NORMALIZED_RELATIONS = {
+    "=": ("=", 1, 0),
+    "!=": ("!=", 1, 0),
+    ">": (">=", 1, -1),
+    ">=": (">=", 1, 0),
+    "<": (">=", -1, -1),
+    "<=": (">=", -1, 0),
+}
+
+
+def normalized_relation(relation):
+    """
+    canonical form (op, terms, constant) of a polynomial relation, meaning "terms + constant op 0",
+    op being one of "=", "!=", ">=" and terms ((monomial, coefficient), ..) sorted by monomial
+    coefficients are divided by their GCD (if the constant allows it, for ">=" it's rounded down),
+    "=" and "!=" are oriented so that the first coefficient is positive
+    e.g., "2*A=2*B" and "B=A" both give ("=", ((("A", ), 1), (("B", ), -1)), 0)
+    None if the relation is not polynomial (division, logical operators)
+    """
+    if relation["op"] not in NORMALIZED_RELATIONS:
+        return None
+    op, sign, shift = NORMALIZED_RELATIONS[relation["op"]]
+    lhs, rhs = expression_polynomial(relation["lhs"]), expression_polynomial(relation["rhs"])
+    if lhs is None or rhs is None:
+        return None
+    polynomial = defaultdict(int)
+    for monomial, coef in lhs.items():
+        polynomial[monomial] += sign * coef
+    for monomial, coef in rhs.items():
+        polynomial[monomial] -= sign * coef
+    constant = polynomial.pop((), 0) + shift
+    terms = sorted((monomial, coef) for monomial, coef in polynomial.items() if coef != 0)
+    if not terms:
+        return op, (), constant
+    divisor = 0
+    for _, coef in terms:
+        divisor = math.gcd(divisor, coef)
+    if op == ">=" or constant % divisor == 0:
+        terms, constant = [(monomial, coef // divisor) for monomial, coef in terms], constant // divisor
+    if op != ">=" and terms[0][1] < 0:
+        terms, constant = [(monomial, -coef) for monomial, coef in terms], -constant
+    return op, tuple(terms), constant
+
+
+def normalized_certain(normalized):
+    """
+    whether the normalized relation holds for any values at all (e.g., "2*A!=1", "A-A>=0")
+    """
+    op, terms, constant = normalized
+    divisor = 0
+    for _, coef in terms:
+        divisor = math.gcd(divisor, coef)
+    if not terms:
+        return constant == 0 if op == "=" else constant != 0 if op == "!=" else constant >= 0
+    # "!=" with coefficients whose GCD doesn't divide the constant
+    return op == "!=" and constant % divisor != 0
+
+
+def normalized_implies(normalized, other):
+    """
+    whether the normalized relation implies the other one (only detected for the same or negated terms)
+    """
+    op, terms, constant = normalized
+    other_op, other_terms, other_constant = other
+    if other_terms == terms:
+        sign = 1
+    elif other_terms == tuple((monomial, -coef) for monomial, coef in terms):
+        sign = -1
+    else:
+        return False
+    # terms are fixed to -constant, the other terms to -sign * constant
+    if op == "=":
+        value = -sign * constant + other_constant
+        return value == 0 if other_op == "=" else value != 0 if other_op == "!=" else value >= 0
+    # terms are at least -constant
+    if op == ">=":
+        if sign == 1:
+            return other_constant >= constant if other_op == ">=" else other_op == "!=" and other_constant > constant
+        # the other terms are at most constant
+        return other_op == "!=" and -other_constant > constant
+    # terms are not -constant
+    return other_op == "!=" and other_constant == sign * constant
+
+
+def rule_key(rule: Rule):
+    """
+    key that is the same for rules that are equal up to normalization (see `normalized_relation`),
+    falls back to the simplified string for rules that are not polynomial
+    """
+    def relation_key(relation):
+        normalized = normalized_relation(relation)
+        return normalized if normalized is not None else ("str", structured_to_raw_rule(relation))
+
+    op = rule.rule["op"]
+    if op == "=>":
+        return op, relation_key(rule.rule["lhs"]), relation_key(rule.rule["rhs"])
+    if op == "<=>":
+        return (op, ) + tuple(sorted([relation_key(rule.rule["lhs"]), relation_key(rule.rule["rhs"])], key=repr))
+    normalized = normalized_relation(rule.rule)
+    return normalized if normalized is not None else ("str", rule.get_simplified_str())
+
+
 if __name__ == "__main__":
     import json
     rule_raw = "-2B>C-4"
@@ -1,16 +1,10 @@
-import os
-
-from generator import BasicGenerator
-from puzzle import Puzzle
-from rule import Rule
-from solver_brute import BruteForceSolver
-from solver_logic import LogicBasedSolver
-
-
-def read_input(path):
-    puzzles, puzzle = [], None
-    fin = open(path, "r")
-    for line in fin.readlines():
+def iter_input(lines):
+    """
+    lazily parse puzzles from lines in the "n k" + k rule lines format
+    yields {"n": n, "k": k, "rules": [rule strings]} dicts
+    """
+    puzzle = None
+    for line in lines:
         line = line.strip()
         if line:
             if puzzle is None:
@@ -18,13 +12,27 @@ def read_input(path):
                 puzzle = {"n": n, "k": k, "rules": []}
             else:
                 puzzle["rules"].append(line)
-                if len(puzzle["rules"]) == puzzle["k"]:
-                    puzzles.append(puzzle)
-                    puzzle = None
-    return puzzles
+            if len(puzzle["rules"]) == puzzle["k"]:
+                yield puzzle
+                puzzle = None
+
+
+def read_input(path):
+    with open(path, "r") as fin:
+        return list(iter_input(fin))
 
 
 if __name__ == "__main__":
+    # imported here, so that modules that only need the input parsing (batch solving, workers) start fast
+    import os
+
+    from budget import Budget
+    from generator import BasicGenerator
+    from puzzle import Puzzle
+    from rule import Rule
+    from solver_brute import BruteForceSolver
+    from solver_logic import LogicBasedSolver
+
     print("define rule from string")
     rule = Rule("A+BC=D-2E+11<=>F>G")
     print(rule)
@@ -86,6 +94,14 @@ if __name__ == "__main__":
     print("possible values after reduction:", possible_values)
     print()
 
+    print("limit the logical solver by wall-clock time and rule evaluations instead")
+    lbs = LogicBasedSolver(puzzle2, verbose=False)
+    solved, possible_values = lbs.solve(budget=Budget(time_limit=1.0, max_evaluations=100000))
+    print("solved by logic?:", solved)
+    print("stopped because of:", lbs.stop_reason)
+    print("possible values after reduction:", possible_values)
+    print()
+
     print("generate a puzzle")
     bg = BasicGenerator(5, seed=2018, verbose=False)
     puzzle_generated = bg.generate()
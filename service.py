@@ -0,0 +1,484 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import socket
+import stat
+import sys
+import time
+from itertools import islice
+
+from budget import Budget, BudgetExceeded, DEADLINE
+from generator import BasicGenerator, WEIGHT_PRESETS
+from puzzle import Puzzle
+from rule import Rule
+from run import iter_input
+from solutions import count_solutions, iter_solutions, solution_to_dict
+from solver_logic import LogicBasedSolver
+from stats import summarize
+
+
+# error of requests cancelled by the client (or dropped because the client went away)
+CANCELLED = "cancelled"
+# operations answered by the worker pool, the rest are answered by the server itself
+POOL_OPS = ["solve", "count", "generate"]
+
+# parsed rules by rule string, per worker process
+# puzzles of the same size share many rules, so a batch mostly hits this instead of parsing and simplifying again
+_rule_cache = {}
+RULE_CACHE_SIZE = 100000
+
+
+def parse_rules(rules_str):
+    """
+    rules from strings, through the worker's rule cache
+    (rules are never modified by the solvers, so the same object can be used by many puzzles)
+    """
+    rules = []
+    for rule_str in rules_str:
+        rule = _rule_cache.get(rule_str)
+        if rule is None:
+            if len(_rule_cache) >= RULE_CACHE_SIZE:
+                _rule_cache.clear()
+            rule = _rule_cache[rule_str] = Rule(rule_str)
+        rules.append(rule)
+    return rules
+
+
+def answer_request(n, request):
+    """
+    answer a single solve or count request (runs inside a worker process)
+    `request["deadline"]` is an absolute `time.monotonic()` timestamp,
+    which is shared by all processes of the machine
+    """
+    budget = Budget(deadline=request["deadline"])
+    try:
+        budget.check_deadline()
+        puzzle = Puzzle.with_rules(n, parse_rules(request["rules"]))
+        engine = request.get("engine", "auto")
+        if request["op"] == "count":
+            return {"count": count_solutions(puzzle, limit=request.get("limit"), engine=engine, budget=budget)}
+        cnt, first_solution = 0, None
+        for solution in islice(iter_solutions(puzzle, engine=engine, budget=budget), request.get("limit", 2)):
+            cnt += 1
+            if first_solution is None:
+                first_solution = solution
+        result = {
+            "count": cnt,
+            "solution": solution_to_dict(puzzle, first_solution) if first_solution is not None else None,
+        }
+        if request.get("logic_steps"):
+            result["logic_solvable"], _ = LogicBasedSolver(puzzle).solve(max_steps=request["logic_steps"], budget=budget)
+        return result
+    except BudgetExceeded as e:
+        return {"error": e.reason}
+    except Exception as e:
+        return {"error": "failed: {e}".format(e=e)}
+
+
+def run_batch(n, requests):
+    """
+    answer a batch of solve/count requests for puzzles of size `n` (runs inside a worker process)
+    returns the results in the order of `requests`
+    """
+    return [answer_request(n, request) for request in requests]
+
+
+def run_generate(request):
+    """
+    answer a generate request (runs inside a worker process)
+    """
+    preset = request.get("preset", "easy")
+    if preset not in WEIGHT_PRESETS:
+        return {"error": "unknown preset: {preset}".format(preset=preset)}
+    bg = BasicGenerator(
+        request["n"],
+        seed=request.get("seed"),
+        custom_weights=WEIGHT_PRESETS[preset],
+        time_limit=request.get("time_limit"),
+        deadline=request["deadline"],
+    )
+    try:
+        puzzle = bg.generate()
+    except BudgetExceeded as e:
+        return {"error": e.reason}
+    return {"rules": [rule.get_simplified_str() for rule in puzzle.rules]}
+
+
+class PendingRequest:
+    """
+    request accepted by the server and not answered yet
+    """
+    __slots__ = ["request", "arrival", "deadline", "future", "cancelled"]
+
+    def __init__(self, request, arrival, deadline, future):
+        self.request = request
+        self.arrival = arrival
+        self.deadline = deadline
+        self.future = future
+        self.cancelled = False
+
+    def answer(self, result):
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def cancel(self):
+        self.cancelled = True
+        self.answer({"error": CANCELLED})
+
+    def payload(self):
+        """
+        what a worker process needs to answer the request
+        """
+        payload = dict(self.request)
+        payload["deadline"] = self.deadline
+        return payload
+
+
+class PuzzleService:
+    """
+    long-lived asyncio server answering solve/count/generate requests, so that callers don't pay
+    for a fresh python start (and imports) on every call
+    protocol: one JSON object per line in both directions, responses carry the "id" of their request
+    (the ids of the pending requests of a connection must be distinct, a missing id counts as null)
+    and may come out of order (requests of a connection are handled concurrently):
+      {"id": 1, "op": "solve", "n": 5, "rules": ["B+A=6", ..], "limit": 2, "engine": "auto", "logic_steps": 0, "timeout": 1.0}
+      {"id": 2, "op": "count", "n": 5, "rules": [..], "limit": null}
+      {"id": 3, "op": "generate", "n": 5, "preset": "easy", "seed": 2018}
+      {"id": 4, "op": "cancel", "target": 1}
+      {"id": 5, "op": "metrics"}
+    solve/count requests are micro-batched by n: they wait up to `batch_window` seconds (or until `batch_size`
+    of them are queued) and go to a worker process together, where they share parsed rules
+    `timeout` (seconds) sets a deadline: the worker stops working on the request once it passes
+    and the response is {"error": "deadline"} either way
+    a cancelled request is dropped if it's still queued and its response is {"error": "cancelled"} right away
+    (a request that is already being solved runs until it finishes or its deadline passes)
+    """
+    # number of latest requests that latency and batch size metrics are computed from
+    METRICS_WINDOW = 10000
+
+    def __init__(self, workers=None, batch_size=32, batch_window=0.005):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.executor = None
+        # queued solve/count requests by n, and the timers that flush them
+        self.queues = collections.defaultdict(list)
+        self.flush_timers = {}
+        # unanswered requests by (connection, request id), for cancellation
+        self.active = {}
+        self.connection_ids = itertools.count(1)
+        # requests being worked on by the pool
+        self.in_flight = 0
+        self.counters = collections.Counter()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=self.METRICS_WINDOW))
+        self.queue_waits = collections.deque(maxlen=self.METRICS_WINDOW)
+        self.batch_sizes = collections.deque(maxlen=self.METRICS_WINDOW)
+
+    async def serve(self, path=None, host="127.0.0.1", port=8765, ready=None):
+        """
+        serve on the unix socket `path` if given, otherwise on `host`:`port`, until cancelled
+        `ready` (an `asyncio.Event`) is set once the server accepts connections
+        """
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        if path is not None:
+            # socket file left over from a previous run
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(self.handle_connection, path=path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+        try:
+            async with server:
+                if ready is not None:
+                    ready.set()
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        connection = next(self.connection_ids)
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.handle_line(connection, line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # end of input (e.g., the client half-closed its side after sending) - still answer what it has sent
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            # the client went away - no one is waiting for its requests anymore
+            self.cancel_connection(connection)
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    def cancel_connection(self, connection):
+        """
+        cancel the pending requests of a connection
+        """
+        for (conn, _), entry in list(self.active.items()):
+            if conn == connection:
+                entry.cancel()
+
+    async def handle_line(self, connection, line, writer):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("not an object")
+        except ValueError as e:
+            response = {"id": None, "error": "bad request: {e}".format(e=e)}
+        else:
+            response = await self.handle_request(connection, request)
+            response["id"] = request.get("id")
+        writer.write((json.dumps(response) + "\n").encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # responses can't be delivered any more
+            self.cancel_connection(connection)
+
+    async def handle_request(self, connection, request):
+        op = request.get("op")
+        self.counters["requests/{op}".format(op=op)] += 1
+        if not all(isinstance(request.get(field), (int, float, str, type(None))) for field in ["id", "target"]):
+            return {"error": "bad request: id and target must be numbers, strings or null"}
+        if op == "metrics":
+            return {"metrics": self.metrics()}
+        if op == "cancel":
+            entry = self.active.get((connection, request.get("target")))
+            if entry is not None:
+                entry.cancel()
+            return {"cancelled": entry is not None}
+        if op not in POOL_OPS:
+            return {"error": "unknown op: {op}".format(op=op)}
+        if not isinstance(request.get("n"), int) or request["n"] < 1:
+            return {"error": "bad request: n must be a positive integer"}
+        if op != "generate" and not isinstance(request.get("rules"), list):
+            return {"error": "bad request: rules must be a list of strings"}
+        timeout = request.get("timeout")
+        if timeout is not None and (not isinstance(timeout, (int, float)) or isinstance(timeout, bool)):
+            return {"error": "bad request: timeout must be a number"}
+
+        # the id is what `cancel` refers to, so it must tell the pending requests of a connection apart
+        key = (connection, request.get("id"))
+        if key in self.active:
+            return {"error": "bad request: id {id} is already in use by a pending request".format(
+                id=json.dumps(request.get("id")),
+            )}
+
+        arrival = time.monotonic()
+        deadline = arrival + timeout if timeout is not None else None
+        entry = PendingRequest(request, arrival, deadline, asyncio.get_running_loop().create_future())
+        self.active[key] = entry
+        try:
+            if op == "generate":
+                self.submit(run_generate, [entry], entry.payload())
+            else:
+                self.enqueue(entry)
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                result = await asyncio.wait_for(asyncio.shield(entry.future), timeout)
+            except asyncio.TimeoutError:
+                entry.cancelled = True
+                result = {"error": DEADLINE}
+        finally:
+            if self.active.get(key) is entry:
+                del self.active[key]
+        self.latencies[op].append(time.monotonic() - arrival)
+        # errors with details ("failed: ..") are counted by their kind only
+        self.counters["responses/{status}".format(status=result.get("error", "ok").split(":")[0])] += 1
+        return result
+
+    def enqueue(self, entry: PendingRequest):
+        """
+        queue a solve/count request for the next batch of its n
+        """
+        n = entry.request["n"]
+        queue = self.queues[n]
+        queue.append(entry)
+        if len(queue) >= self.batch_size:
+            self.flush(n)
+        elif n not in self.flush_timers:
+            self.flush_timers[n] = asyncio.get_running_loop().call_later(self.batch_window, self.flush, n)
+
+    def flush(self, n):
+        """
+        send the queued requests of size `n` to the pool as a single batch
+        """
+        timer = self.flush_timers.pop(n, None)
+        if timer is not None:
+            timer.cancel()
+        entries = [entry for entry in self.queues.pop(n, []) if not entry.cancelled]
+        if not entries:
+            return
+        now = time.monotonic()
+        self.queue_waits.extend(now - entry.arrival for entry in entries)
+        self.batch_sizes.append(len(entries))
+        self.submit(run_batch, entries, n, [entry.payload() for entry in entries])
+
+    def submit(self, fn, entries, *args):
+        """
+        run `fn(*args)` on the pool, answer `entries` with its results
+        (a list of results for several entries, a single result for one)
+        """
+        self.in_flight += len(entries)
+        future = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+        def done(future):
+            self.in_flight -= len(entries)
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [{"error": "failed: {e}".format(e=e)}] * len(entries)
+            if not isinstance(results, list):
+                results = [results]
+            for entry, result in zip(entries, results):
+                entry.answer(result)
+
+        future.add_done_callback(done)
+
+    def metrics(self):
+        """
+        queue depths, work in flight, request/response counters and latency summaries (seconds)
+        """
+        return {
+            "workers": self.workers,
+            "queue_depth": {str(n): len(queue) for n, queue in sorted(self.queues.items()) if queue},
+            "queued": sum(len(queue) for queue in self.queues.values()),
+            "in_flight": self.in_flight,
+            "active": len(self.active),
+            "counters": dict(self.counters),
+            "latency": {op: summarize(list(values)) for op, values in self.latencies.items() if values},
+            "queue_wait": summarize(list(self.queue_waits)) if self.queue_waits else None,
+            "batch_size": summarize(list(self.batch_sizes)) if self.batch_sizes else None,
+        }
+
+
+class ServiceClient:
+    """
+    blocking client of `PuzzleService`
+    `call` sends a request and waits for its response,
+    `send` and `receive` pipeline many requests over the connection
+    """
+    def __init__(self, path=None, host="127.0.0.1", port=8765, timeout=None):
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.sock.makefile("rwb")
+        self.ids = itertools.count(1)
+        # responses received while waiting for another one
+        self.responses = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def send(self, op, **fields):
+        """
+        send a request, returns its id
+        """
+        request_id = next(self.ids)
+        request = dict(fields, id=request_id, op=op)
+        self.file.write((json.dumps(request) + "\n").encode())
+        self.file.flush()
+        return request_id
+
+    def receive(self, request_id):
+        """
+        wait for the response to the request with `request_id`
+        """
+        while request_id not in self.responses:
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError("service closed the connection")
+            response = json.loads(line)
+            self.responses[response["id"]] = response
+        return self.responses.pop(request_id)
+
+    def call(self, op, **fields):
+        return self.receive(self.send(op, **fields))
+
+    def solve(self, n, rules, **fields):
+        return self.call("solve", n=n, rules=rules, **fields)
+
+    def count(self, n, rules, **fields):
+        return self.call("count", n=n, rules=rules, **fields)
+
+    def generate(self, n, **fields):
+        return self.call("generate", n=n, **fields)
+
+    def cancel(self, request_id):
+        return self.call("cancel", target=request_id)
+
+    def metrics(self):
+        return self.call("metrics")["metrics"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="local solve/count/generate service and its client")
+    parser.add_argument("--socket", help="unix socket path (default: localhost TCP)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="run the service")
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument("--batch-size", type=int, default=32, help="max solve/count requests per batch")
+    serve_parser.add_argument("--batch-window", type=float, default=0.005, help="seconds to wait for a batch to fill")
+    client_parser = subparsers.add_parser("client", help="send the puzzles of files to the service, print JSON lines")
+    client_parser.add_argument("files", nargs="*", default=["-"], help="puzzle files, - for stdin (default)")
+    client_parser.add_argument("--op", choices=["solve", "count"], default="solve")
+    client_parser.add_argument("--limit", type=int, default=None, help="stop counting solutions at this number")
+    client_parser.add_argument("--timeout", type=float, default=None, help="deadline of each request (seconds)")
+    subparsers.add_parser("metrics", help="print the service's metrics")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        service = PuzzleService(workers=args.workers, batch_size=args.batch_size, batch_window=args.batch_window)
+        try:
+            asyncio.run(service.serve(path=args.socket, host=args.host, port=args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    with ServiceClient(path=args.socket, host=args.host, port=args.port) as client:
+        if args.command == "metrics":
+            print(json.dumps(client.metrics(), indent=2, sort_keys=True))
+            return 0
+        fields = {"timeout": args.timeout}
+        if args.limit is not None:
+            fields["limit"] = args.limit
+        request_ids = []
+        for path in args.files:
+            fin = sys.stdin if path == "-" else open(path, "r")
+            try:
+                for puzzle_raw in iter_input(fin):
+                    request_ids.append(client.send(args.op, n=puzzle_raw["n"], rules=puzzle_raw["rules"], **fields))
+            finally:
+                if fin is not sys.stdin:
+                    fin.close()
+        for request_id in request_ids:
+            print(json.dumps(client.receive(request_id)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+from itertools import islice
+
+from puzzle import Puzzle
+from solver_brute import BruteForceSolver
+from solver_cdcl import CDCLSolver
+from solver_counting import EliminationCounter
+from solver_logic import LogicBasedSolver
+from solver_search import SearchSolver
+from solver_table import MAX_TABLE_N, TableSolver
+
+
+def iter_solutions_brute(puzzle: Puzzle, budget=None):
+    """
+    enumerate solutions by brute force (with rules checked on partial assignments)
+    """
+    return BruteForceSolver(puzzle).iter_solutions(budget=budget)
+
+
+def iter_solutions_logic(puzzle: Puzzle, budget=None):
+    """
+    enumerate solutions by brute force after reducing possible values with a couple of logical steps
+    """
+    return LogicBasedSolver(puzzle).iter_solutions(max_steps=2, budget=budget)
+
+
+def iter_solutions_search(puzzle: Puzzle, budget=None):
+    """
+    enumerate solutions by backtracking search with constraint propagation
+    """
+    return SearchSolver(puzzle).iter_solutions(budget=budget)
+
+
+def iter_solutions_cdcl(puzzle: Puzzle, budget=None):
+    """
+    enumerate solutions by conflict-driven clause learning over a boolean encoding of the puzzle
+    """
+    return CDCLSolver(puzzle).iter_solutions(budget=budget)
+
+
+def iter_solutions_table(puzzle: Puzzle, budget=None):
+    """
+    enumerate solutions by intersecting rule masks over the permutation table shared by all puzzles of the size
+    (for batches of puzzles with common rules), puzzles larger than `MAX_TABLE_N` have no table and use search
+    """
+    if puzzle.n > MAX_TABLE_N:
+        return iter_solutions_search(puzzle, budget=budget)
+    return TableSolver(puzzle).iter_solutions(budget=budget)
+
+
+ENGINES = {
+    "brute": iter_solutions_brute,
+    "logic": iter_solutions_logic,
+    "search": iter_solutions_search,
+    "cdcl": iter_solutions_cdcl,
+    "table": iter_solutions_table,
+}
+
+
+def pick_engine(puzzle: Puzzle):
+    """
+    engine expected to be the fastest for the given puzzle
+    search with propagation beats brute force (even with early rule checks) on all bundled sizes (n = 5-8),
+    and it is the only engine that doesn't enumerate all assignments for large n
+    """
+    return "search"
+
+
+def iter_solutions(puzzle: Puzzle, engine="auto", budget=None):
+    """
+    lazily enumerate solutions of the puzzle as tuples of values in the order of `puzzle.variables`
+    e.g., `itertools.islice(iter_solutions(puzzle), 2)` to stop after the first two solutions
+    """
+    if engine == "auto":
+        engine = pick_engine(puzzle)
+    solutions = ENGINES[engine](puzzle, budget=budget)
+    if budget is None or budget.deadline is None:
+        return solutions
+    return iter_until_deadline(solutions, budget)
+
+
+def iter_until_deadline(solutions, budget):
+    """
+    pass solutions through, checking the budget's deadline before each of them
+    (assigning variables that are in no rule takes no rule evaluations, so the budget wouldn't notice otherwise)
+    """
+    for solution in solutions:
+        budget.check_deadline()
+        yield solution
+
+
+def count_solutions(puzzle: Puzzle, limit=None, engine="auto", budget=None):
+    """
+    count the solutions of the puzzle, stop counting at `limit` (if given)
+    exact counts (no `limit`) come from dynamic programming over the rule graph instead of enumerating solutions,
+    `engine="elimination"` uses it with a limit as well
+    """
+    if engine == "elimination" or (engine == "auto" and limit is None):
+        return EliminationCounter(puzzle).count(limit=limit, budget=budget)
+    return sum(1 for _ in islice(iter_solutions(puzzle, engine=engine, budget=budget), limit))
+
+
+def solution_to_dict(puzzle: Puzzle, solution):
+    """
+    convert solution tuple into {variable: value} form
+    """
+    return dict(zip(puzzle.variables, solution))
+
+
+if __name__ == "__main__":
+    puzzle = Puzzle(5)
+    puzzle.add_rules([
+        "E+B=C",
+        "E+C+B=8",
+    ])
+    # only take what is needed
+    for solution in islice(iter_solutions(puzzle), 2):
+        print(solution_to_dict(puzzle, solution))
+    print(count_solutions(puzzle), count_solutions(puzzle, limit=2))
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+from cache import open_cache
+from corpus import is_corpus, open_corpus
+from parallel import ordered_map
+from portfolio import open_stats, pick_engine
+from puzzle import Puzzle
+from run import iter_input
+from solutions import ENGINES, iter_solutions, solution_to_dict
+from solver_logic import LogicBasedSolver
+
+
+def iter_sources(paths):
+    """
+    lazily parse puzzles from the given files ("-" for stdin)
+    yields (source, index within source, raw puzzle) triples
+    puzzles of binary corpora (see `corpus.py`) are not read here at all, the worker loads them by index
+    """
+    for path in paths:
+        if is_corpus(path):
+            for ind in range(len(open_corpus(path))):
+                yield path, ind, {"corpus": path}
+        elif path == "-":
+            for ind, puzzle_raw in enumerate(iter_input(sys.stdin)):
+                yield "<stdin>", ind, puzzle_raw
+        else:
+            with open(path, "r") as fin:
+                for ind, puzzle_raw in enumerate(iter_input(fin)):
+                    yield path, ind, puzzle_raw
+
+
+def solve_task(task):
+    """
+    solve a single puzzle (runs inside a worker process)
+    """
+    (source, ind, puzzle_raw), engine, limit, logic_steps, cache_path, cache_size, portfolio_stats_path = task
+    timings = {}
+
+    start = time.perf_counter()
+    # solution count and a solution stored in the corpus
+    stored_count, stored_solution = None, None
+    if "corpus" in puzzle_raw:
+        puzzle, stored_count, stored_solution = open_corpus(puzzle_raw["corpus"]).entry(ind)
+        rules_str = [rule.get_simplified_str() for rule in puzzle.rules]
+    else:
+        puzzle = Puzzle(puzzle_raw["n"])
+        puzzle.add_rules(rules_str=puzzle_raw["rules"])
+        rules_str = puzzle_raw["rules"]
+    timings["parse"] = time.perf_counter() - start
+
+    # consult the result cache first
+    cache, fingerprint, cached = None, None, []
+    if cache_path is not None:
+        cache = open_cache(cache_path, max_entries=cache_size)
+        fingerprint = puzzle.fingerprint()
+
+    start = time.perf_counter()
+    count_cached = cache.get_count(fingerprint, limit=limit) if cache is not None else None
+    if stored_count is not None and (stored_solution is not None or stored_count == 0):
+        cnt = stored_count if limit is None else min(stored_count, limit)
+        solution = stored_solution
+        cached.append("corpus")
+    elif count_cached is not None:
+        cnt, solution = count_cached
+        cached.append("count")
+    else:
+        # engine that won portfolio races on similar puzzles
+        if engine == "auto" and portfolio_stats_path is not None:
+            engine = pick_engine(puzzle, open_stats(portfolio_stats_path))
+        cnt, last_solution = 0, None
+        for last_solution in islice(iter_solutions(puzzle, engine=engine), limit):
+            cnt += 1
+        solution = solution_to_dict(puzzle, last_solution) if last_solution is not None else None
+        if cache is not None:
+            cache.put_count(fingerprint, puzzle.n, cnt, solution, limit=limit)
+    timings["count"] = time.perf_counter() - start
+
+    logic_solvable = None
+    if logic_steps > 0:
+        start = time.perf_counter()
+        logic_solvable = cache.get_logic_solvable(fingerprint, logic_steps) if cache is not None else None
+        if logic_solvable is not None:
+            cached.append("logic")
+        else:
+            logic_solvable, _ = LogicBasedSolver(puzzle).solve(max_steps=logic_steps)
+            if cache is not None:
+                cache.put_logic_solvable(fingerprint, puzzle.n, logic_solvable, logic_steps)
+        timings["logic"] = time.perf_counter() - start
+
+    return {
+        "source": source,
+        "index": ind,
+        "n": puzzle.n,
+        "rules": rules_str,
+        "count": cnt,
+        "solution": solution,
+        "logic_solvable": logic_solvable,
+        "cached": cached,
+        "timings": timings,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="solve puzzles in the data/ text format, write results as JSON lines")
+    parser.add_argument("files", nargs="*", default=["-"], help="puzzle files, - for stdin (default)")
+    parser.add_argument("--engine", choices=["auto"] + sorted(ENGINES.keys()), default="auto")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--limit", type=int, default=None, help="stop counting solutions at this number")
+    parser.add_argument("--logic-steps", type=int, default=4, help="max steps of logic solvability check (0 to skip)")
+    parser.add_argument("--output", default="-", help="output file (default: stdout)")
+    parser.add_argument("--cache", help="SQLite result cache to consult first and fill")
+    parser.add_argument("--cache-size", type=int, default=1000000, help="max number of cached puzzles")
+    parser.add_argument("--portfolio-stats", help="with --engine auto, use the engine that won most races "
+                                                  "on similar puzzles (JSON stats of `portfolio.py --stats`)")
+    args = parser.parse_args(argv)
+
+    tasks = (
+        (item, args.engine, args.limit, args.logic_steps, args.cache, args.cache_size, args.portfolio_stats)
+        for item in iter_sources(args.files)
+    )
+    fout = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for result in ordered_map(solve_task, tasks, workers=args.workers):
+            fout.write(json.dumps(result) + "\n")
+    finally:
+        if fout is not sys.stdout:
+            fout.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
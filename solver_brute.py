@@ -6,63 +6,98 @@ class BruteForceSolver:
     def __init__(self, puzzle: Puzzle):
         self.puzzle = puzzle
 
-    def solve_full_search(self):
+    def solve_full_search(self, budget=None, limit=None):
         """
         check all possible value assignments
         count the number of assignments that satisfy the puzzle
         also return one of the solutions
+        every rule evaluation is charged to `budget` (if given), which raises once it runs out
+        stop counting once `limit` solutions are found (if given)
         """
         cnt, last_solution = 0, None
         for permutation in permutations(list(range(1, self.puzzle.n+1))):
             values = dict(zip(self.puzzle.variables, permutation))
             for rule in self.puzzle.rules:
+                if budget is not None:
+                    budget.charge_evaluations()
                 ok = rule.eval_rule(values)
                 if not ok:
                     break
             else:
                 cnt += 1
                 last_solution = values
+                if limit is not None and cnt == limit:
+                    break
         return cnt, last_solution
 
-    def solve(self, possible_values=None):
+    def iter_satisfying_assignments(self, possible_values, budget=None):
+        """
+        lazily enumerate the assignments (of distinct values from `possible_values`) that satisfy the puzzle
+        a single dict is reused for all assignments - copy it if it has to outlive the next iteration step
+        each rule is checked as soon as all of its variables are assigned,
+        so partial assignments that already break a rule are not extended any further
+        every rule evaluation is charged to `budget` (if given), which raises once it runs out
+        """
+        variables = self.puzzle.variables
+        # rules to check right after assigning the variable at each position
+        rules_by_ind = [[] for _ in variables]
+        for rule in self.puzzle.rules:
+            rules_by_ind[max([variables.index(var) for var in rule.variables], default=0)].append(rule)
+        values, used_vals = {}, set()
+
+        # assigns variables recursively, yields on complete assignments
+        def rec(ind):
+            if ind == len(variables):
+                yield values
+                return
+            var = variables[ind]
+            for val in possible_values[var]:
+                if val in used_vals:
+                    continue
+                values[var] = val
+                for rule in rules_by_ind[ind]:
+                    if budget is not None:
+                        budget.charge_evaluations()
+                    if not rule.eval_rule(values):
+                        break
+                else:
+                    used_vals.add(val)
+                    yield from rec(ind + 1)
+                    used_vals.remove(val)
+            values.pop(var, None)
+
+        return rec(0)
+
+    def iter_solutions(self, possible_values=None, budget=None):
+        """
+        lazily enumerate solutions as tuples of values in the order of `puzzle.variables`
+        reduce search space if `possible_values` is given
+        """
+        if possible_values is None:
+            possible_values = {var: range(1, self.puzzle.n+1) for var in self.puzzle.variables}
+        for values in self.iter_satisfying_assignments(possible_values, budget=budget):
+            yield tuple(values[var] for var in self.puzzle.variables)
+
+    def solve(self, possible_values=None, budget=None, limit=None):
         """
         check all possible value assignments
         reduce search space if `possible_values` is given
         count the number of assignments that satisfy the puzzle
         also return one of the solutions
+        every rule evaluation is charged to `budget` (if given), which raises once it runs out
+        stop counting once `limit` solutions are found (if given)
         """
         # `possible_values` not given, do full search
         if possible_values is None:
-            return self.solve_full_search()
+            return self.solve_full_search(budget=budget, limit=limit)
 
-        # generates assignments recursively
-        def rec_get_assignments(ind, assignment, used_vals, assignments):
-            if ind == len(self.puzzle.variables):
-                assignments.append({var: val for var, val in assignment.items()})
-            else:
-                var = self.puzzle.variables[ind]
-                for val in possible_values[var]:
-                    if val not in used_vals:
-                        assignment[var] = val
-                        used_vals.add(val)
-                        rec_get_assignments(ind+1, assignment, used_vals, assignments)
-                        used_vals.remove(val)
-                        del assignment[var]
-
-        # get all possible assignments
-        assignments, assignment, used_vals = [], {}, set()
-        rec_get_assignments(0, assignment, used_vals, assignments)
-
-        # count how many of the assignments satisfy the puzzle
+        # count how many of the assignments satisfy the puzzle, checking them as they are generated
         cnt, last_solution = 0, None
-        for values in assignments:
-            for rule in self.puzzle.rules:
-                ok = rule.eval_rule(values)
-                if not ok:
-                    break
-            else:
-                cnt += 1
-                last_solution = values
+        for values in self.iter_satisfying_assignments(possible_values, budget=budget):
+            cnt += 1
+            last_solution = dict(values)
+            if limit is not None and cnt == limit:
+                break
         return cnt, last_solution
 
 
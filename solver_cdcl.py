@@ -0,0 +1,451 @@
+from itertools import product
+
+from puzzle import Puzzle
+from rule import compile_rule, rule_possible
+
+
+def luby(i):
+    """
+    i-th element (from 1) of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, ..
+    """
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    if (1 << k) - 1 == i:
+        return 1 << (k - 1)
+    return luby(i - (1 << (k - 1)) + 1)
+
+
+class CDCLSolver:
+    """
+    conflict-driven clause learning over a boolean encoding of the puzzle
+    boolean variable x(var, val) is true iff variable `var` has value `val`, encoded as literal `var index * n + val`
+    (negative literal for its negation):
+      - every variable has exactly one value and every value is taken by exactly one variable (clauses)
+      - rules with few value combinations are encoded up front as clauses forbidding the combinations that break them,
+        the rest are checked lazily: once the variables of a rule that don't have values yet have few enough value
+        combinations left, each of their values without support is forbidden by a new clause (a nogood) explained by
+        the values of the other variables of the rule and the values their possible value sets have lost;
+        before that, values ruled out by the bounds of the other variables are forbidden
+        (explained by the values outside of the bounds)
+    binary clauses are kept as implication lists, longer ones are watched by two literals,
+    conflicts are analyzed up to the first unique implication point,
+    and the learnt clause sends the search back to the level where it becomes unit (non-chronological backtracking)
+    counts solutions by blocking each one found with the negation of its decisions
+    """
+    # rules with at most this many value combinations are encoded as clauses up front
+    EAGER_MAX_COMBINATIONS = 400
+    # lazily encoded rules are checked once the value combinations of their unassigned variables are at most this
+    LAZY_MAX_COMBINATIONS = 256
+    # number of conflicts between restarts is this times the Luby sequence
+    RESTART_BASE = 64
+    ACTIVITY_DECAY = 0.95
+
+    def __init__(self, puzzle: Puzzle):
+        self.puzzle = puzzle
+        self.n = puzzle.n
+        self.variables = list(puzzle.variables)
+        var_index = {var: i for i, var in enumerate(self.variables)}
+        # rules as (variable indices, check function of the variables' values, rule)
+        self.rules = [([var_index[var] for var in rule.variables], compile_rule(rule), rule) for rule in puzzle.rules]
+        self.budget = None
+
+    def lit(self, i, val):
+        return i * self.n + val
+
+    def lit_value(self, lit):
+        """
+        1 if the literal is true, -1 if false, 0 if unassigned
+        """
+        return self.value[lit]
+
+    def reset(self, possible_values=None):
+        """
+        encode the puzzle (restricted to `possible_values` if given) from scratch
+        returns False if the encoding is already inconsistent
+        """
+        n = self.n
+        size = n * n
+        # value of each literal, indexed by the literal itself
+        # (negative literals index from the end of the list, which doesn't overlap with the positive ones)
+        self.value = [0] * (2 * size + 1)
+        self.level = [0] * (size + 1)
+        self.reason = [None] * (size + 1)
+        self.activity = [0.0] * (size + 1)
+        self.bump_amount = 1.0
+        # value of each puzzle variable (None if not known yet)
+        self.assigned_value = [None] * n
+        self.trail, self.trail_lim, self.qhead = [], [], 0
+        # lazily encoded rules are checked for the trail up to this position
+        self.checked = 0
+        self.clauses = []
+        self.watches = {lit: [] for b in range(1, size + 1) for lit in (b, -b)}
+        # literal => [(literal implied by it, binary clause index)]
+        self.implications = {lit: [] for b in range(1, size + 1) for lit in (b, -b)}
+        self.lazy_rules = []
+        self.lazy_rules_by_var = [[] for _ in range(n)]
+
+        clauses = []
+        for i in range(n):
+            # at least one value per variable, at least one variable per value
+            clauses.append([self.lit(i, val) for val in range(1, n + 1)])
+            clauses.append([self.lit(j, i + 1) for j in range(n)])
+            # at most one of each
+            for a in range(n):
+                for b in range(a + 1, n):
+                    clauses.append([-self.lit(i, a + 1), -self.lit(i, b + 1)])
+                    clauses.append([-self.lit(a, i + 1), -self.lit(b, i + 1)])
+        domains = [
+            set(possible_values[var]) if possible_values is not None else set(range(1, n + 1))
+            for var in self.variables
+        ]
+        for i, vals in enumerate(domains):
+            for val in range(1, n + 1):
+                if val not in vals:
+                    clauses.append([-self.lit(i, val)])
+        for indices, check, rule in self.rules:
+            combinations = 1
+            for i in indices:
+                combinations *= len(domains[i])
+            if combinations > self.EAGER_MAX_COMBINATIONS:
+                for i in indices:
+                    self.lazy_rules_by_var[i].append(len(self.lazy_rules))
+                self.lazy_rules.append((indices, check, rule))
+                continue
+            for vals in product(*[sorted(domains[i]) for i in indices]):
+                if len(set(vals)) == len(vals) and not check(*vals):
+                    clauses.append([-self.lit(i, val) for i, val in zip(indices, vals)])
+        for clause in clauses:
+            if self.add_clause(clause) is not None:
+                return False
+        return True
+
+    def enqueue(self, lit, reason):
+        b = abs(lit)
+        self.value[lit] = 1
+        self.value[-lit] = -1
+        self.level[b] = len(self.trail_lim)
+        self.reason[b] = reason
+        self.trail.append(lit)
+        if lit > 0:
+            self.assigned_value[(b - 1) // self.n] = (b - 1) % self.n + 1
+
+    def backtrack(self, level):
+        if len(self.trail_lim) <= level:
+            return
+        pos = self.trail_lim[level]
+        for lit in self.trail[pos:]:
+            b = abs(lit)
+            self.value[lit] = 0
+            self.value[-lit] = 0
+            self.reason[b] = None
+            if lit > 0:
+                self.assigned_value[(b - 1) // self.n] = None
+        del self.trail[pos:]
+        del self.trail_lim[level:]
+        self.qhead = pos
+        self.checked = min(self.checked, pos)
+
+    def add_clause(self, lits):
+        """
+        add a clause at any point of the search, enqueue its literal if it is unit
+        returns the clause index if the clause is false under the current assignment (a conflict), None otherwise
+        """
+        # true literals first, then unassigned ones, then false ones from the highest level down
+        def key(lit):
+            val = self.lit_value(lit)
+            return (0, 0) if val == 1 else (1, 0) if val == 0 else (2, -self.level[abs(lit)])
+        lits = sorted(lits, key=key)
+        ci = len(self.clauses)
+        self.clauses.append(lits)
+        if len(lits) == 2:
+            self.implications[-lits[0]].append((lits[1], ci))
+            self.implications[-lits[1]].append((lits[0], ci))
+        elif len(lits) > 2:
+            self.watches[lits[0]].append(ci)
+            self.watches[lits[1]].append(ci)
+        first = self.lit_value(lits[0])
+        if first == -1:
+            return ci
+        if first == 0 and (len(lits) == 1 or self.lit_value(lits[1]) == -1):
+            self.enqueue(lits[0], ci)
+        return None
+
+    def propagate(self):
+        """
+        unit propagation over binary implications and the two watched literals of longer clauses
+        returns the index of a conflicting clause or None
+        """
+        value = self.value
+        while self.qhead < len(self.trail):
+            true_lit = self.trail[self.qhead]
+            false_lit = -true_lit
+            self.qhead += 1
+            for lit, ci in self.implications[true_lit]:
+                if value[lit] == -1:
+                    return ci
+                if value[lit] == 0:
+                    self.enqueue(lit, ci)
+            watchers = self.watches[false_lit]
+            kept = []
+            for k, ci in enumerate(watchers):
+                clause = self.clauses[ci]
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], clause[0]
+                if value[clause[0]] == 1:
+                    kept.append(ci)
+                    continue
+                # look for a new literal to watch
+                for j in range(2, len(clause)):
+                    if value[clause[j]] != -1:
+                        clause[1], clause[j] = clause[j], clause[1]
+                        self.watches[clause[1]].append(ci)
+                        break
+                else:
+                    kept.append(ci)
+                    # all false - conflict
+                    if value[clause[0]] == -1:
+                        kept.extend(watchers[k + 1:])
+                        self.watches[false_lit] = kept
+                        return ci
+                    self.enqueue(clause[0], ci)
+            self.watches[false_lit] = kept
+        return None
+
+    def check_rules(self):
+        """
+        check the lazily encoded rules whose unassigned variables have few enough value combinations left,
+        adding nogoods for the values without support
+        only rules with variables that got a literal assigned since the last check need to be checked
+        returns the index of a conflicting nogood or None
+        """
+        touched = set()
+        for lit in self.trail[self.checked:]:
+            touched.update(self.lazy_rules_by_var[(abs(lit) - 1) // self.n])
+        self.checked = len(self.trail)
+        for rule_index in sorted(touched):
+            indices, check, rule = self.lazy_rules[rule_index]
+            vals = [self.assigned_value[i] for i in indices]
+            missing = [k for k, val in enumerate(vals) if val is None]
+            if not missing:
+                if self.budget is not None:
+                    self.budget.charge_evaluations()
+                if not check(*vals):
+                    return self.add_nogood([-self.lit(i, val) for i, val in zip(indices, vals)])
+                continue
+            domains = {k: [val for val in range(1, self.n + 1) if self.value[self.lit(indices[k], val)] == 0] for k in missing}
+            combinations = 1
+            for k in missing:
+                combinations *= len(domains[k])
+            if combinations <= self.LAZY_MAX_COMBINATIONS:
+                self.check_supports(indices, check, vals, missing, domains)
+            else:
+                self.check_bounds(rule, indices, vals, missing, domains)
+        return None
+
+    def check_supports(self, indices, check, vals, missing, domains):
+        """
+        forbid the values of the unassigned variables of a rule that have no support
+        """
+        # the nogood holds only while the assigned variables keep their values
+        # and the other unassigned ones don't get back the values they have lost
+        reasons = [-self.lit(i, val) for i, val in zip(indices, vals) if val is not None]
+        for k in missing:
+            lost = [
+                self.lit(indices[j], val)
+                for j in missing if j != k
+                for val in range(1, self.n + 1) if self.value[self.lit(indices[j], val)] == -1
+            ]
+            for val in domains[k]:
+                if not self.has_support(indices, check, vals, missing, domains, k, val):
+                    self.add_nogood([-self.lit(indices[k], val)] + reasons + lost)
+
+    def check_bounds(self, rule, indices, vals, missing, domains):
+        """
+        forbid the values of the unassigned variables of a rule that the bounds of the other variables rule out
+        """
+        bounds = {}
+        # a variable stays within its bounds while the values outside of them stay forbidden
+        reasons = {}
+        for k, i in enumerate(indices):
+            if vals[k] is not None:
+                bounds[rule.variables[k]] = (vals[k], vals[k])
+                reasons[k] = [-self.lit(i, vals[k])]
+            else:
+                low, high = min(domains[k]), max(domains[k])
+                bounds[rule.variables[k]] = (low, high)
+                reasons[k] = [self.lit(i, val) for val in range(1, self.n + 1) if val < low or val > high]
+        for k in missing:
+            var = rule.variables[k]
+            var_bounds = bounds[var]
+            for val in domains[k]:
+                bounds[var] = (val, val)
+                if not rule_possible(rule, bounds):
+                    self.add_nogood([-self.lit(indices[k], val)] + [lit for j in reasons if j != k for lit in reasons[j]])
+            bounds[var] = var_bounds
+
+    def add_nogood(self, lits):
+        """
+        add a clause derived from a lazily encoded rule, enqueue its first literal unless it is false
+        (all the other literals have to be false already)
+        the clause is not watched, `check_rules` derives it again whenever it matters,
+        it is only kept as a reason for conflict analysis
+        returns the clause index if the clause is false (a conflict), None otherwise
+        """
+        ci = len(self.clauses)
+        self.clauses.append(lits)
+        if self.value[lits[0]] == -1:
+            return ci
+        self.enqueue(lits[0], ci)
+        return None
+
+    def has_support(self, indices, check, vals, missing, domains, k, val):
+        """
+        whether the rule holds for some distinct values of the unassigned variables (the k-th fixed to `val`)
+        """
+        others = [j for j in missing if j != k]
+        vals = list(vals)
+        vals[k] = val
+        for combination in product(*[domains[j] for j in others]):
+            if len(set(combination)) < len(combination) or val in combination:
+                continue
+            for j, v in zip(others, combination):
+                vals[j] = v
+            if self.budget is not None:
+                self.budget.charge_evaluations()
+            if check(*vals):
+                return True
+        return False
+
+    def bump(self, b):
+        self.activity[b] += self.bump_amount
+        if self.activity[b] > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.bump_amount *= 1e-100
+
+    def analyze(self, ci):
+        """
+        first unique implication point learning
+        returns the learnt clause (asserting literal first) and the level to backtrack to
+        """
+        current = len(self.trail_lim)
+        seen, learnt, path, p, ind = set(), [], 0, None, len(self.trail) - 1
+        clause = self.clauses[ci]
+        while True:
+            for q in clause:
+                b = abs(q)
+                if p is not None and b == abs(p):
+                    continue
+                if b not in seen and self.level[b] > 0:
+                    seen.add(b)
+                    self.bump(b)
+                    if self.level[b] == current:
+                        path += 1
+                    else:
+                        learnt.append(q)
+            # next literal of the current level on the trail that takes part in the conflict
+            while abs(self.trail[ind]) not in seen:
+                ind -= 1
+            p = self.trail[ind]
+            ind -= 1
+            path -= 1
+            if path == 0:
+                break
+            clause = self.clauses[self.reason[abs(p)]]
+        learnt.insert(0, -p)
+        return learnt, max((self.level[abs(q)] for q in learnt[1:]), default=0)
+
+    def resolve_conflict(self, ci):
+        """
+        learn from the conflict and backtrack
+        returns False if the conflict doesn't depend on any decision (no more solutions)
+        """
+        level = max(self.level[abs(lit)] for lit in self.clauses[ci])
+        if level == 0:
+            return False
+        self.backtrack(level)
+        learnt, backtrack_level = self.analyze(ci)
+        self.backtrack(backtrack_level)
+        self.add_clause(learnt)
+        self.bump_amount /= self.ACTIVITY_DECAY
+        return True
+
+    def decide(self):
+        """
+        next decision literal: a value of the variable with the fewest values left (ties: the most active)
+        None if all variables have values
+        """
+        best, best_key = None, None
+        for i in range(self.n):
+            if self.assigned_value[i] is not None:
+                continue
+            lits = [lit for lit in range(i * self.n + 1, (i + 1) * self.n + 1) if self.value[lit] == 0]
+            lit = max(lits, key=lambda lit: self.activity[lit])
+            key = (len(lits), -self.activity[lit])
+            if best is None or key < best_key:
+                best, best_key = lit, key
+        return best
+
+    def iter_solutions(self, possible_values=None, budget=None):
+        """
+        lazily enumerate solutions as tuples of values in the order of `puzzle.variables`
+        reduce search space if `possible_values` is given
+        every rule evaluation is charged to `budget` (if given), which raises once it runs out
+        """
+        self.budget = budget
+        if not self.reset(possible_values):
+            return
+        conflicts, restarts = 0, 1
+        restart_limit = self.RESTART_BASE * luby(restarts)
+        while True:
+            ci = self.propagate()
+            if ci is None:
+                trail_size = len(self.trail)
+                ci = self.check_rules()
+                # new nogoods became unit, propagate them first
+                if ci is None and len(self.trail) > trail_size:
+                    continue
+            if ci is not None:
+                if not self.resolve_conflict(ci):
+                    return
+                conflicts += 1
+                if conflicts >= restart_limit:
+                    conflicts, restarts = 0, restarts + 1
+                    restart_limit = self.RESTART_BASE * luby(restarts)
+                    self.backtrack(0)
+                continue
+            lit = self.decide()
+            # everything assigned - a solution
+            if lit is None:
+                yield tuple(self.assigned_value)
+                # block it, i.e., at least one of the decisions that led to it has to change
+                if not self.trail_lim:
+                    return
+                ci = self.add_clause([-self.trail[pos] for pos in self.trail_lim])
+                if not self.resolve_conflict(ci):
+                    return
+                continue
+            self.trail_lim.append(len(self.trail))
+            self.enqueue(lit, None)
+
+    def solve(self, possible_values=None, budget=None, limit=None):
+        """
+        count the number of solutions (up to `limit` if given), also return one of the solutions
+        """
+        cnt, last_solution = 0, None
+        for solution in self.iter_solutions(possible_values=possible_values, budget=budget):
+            cnt += 1
+            last_solution = dict(zip(self.variables, solution))
+            if limit is not None and cnt == limit:
+                break
+        return cnt, last_solution
+
+
+if __name__ == "__main__":
+    puzzle = Puzzle(5)
+    puzzle.add_rules([
+        "B+A=6",
+        "E+B=C",
+        "E+C+B=8",
+    ])
+    print(CDCLSolver(puzzle).solve())
@@ -0,0 +1,125 @@
+from collections import defaultdict
+from math import factorial
+
+from puzzle import Puzzle
+from rule import compile_rule
+
+
+class EliminationCounter:
+    """
+    exact solution counting by dynamic programming over the rule/variable interaction graph
+    variables are assigned one by one in an order that keeps few of them "open" at a time (the width),
+    a variable is open from its assignment until the last variable of all rules it appears in is assigned
+    the state after each step is (values of the open variables, bitmask of the used values),
+    mapped to the number of partial assignments that lead to it:
+      - each rule is checked at the step of its last variable (all its variables are open then)
+      - the bitmask enforces all different, so variables can be summed out as soon as they close
+    variables that don't appear in any rule (and can take any value) are not assigned at all:
+    they take the values left over in any order (k! ways for k such variables)
+    """
+    def __init__(self, puzzle: Puzzle):
+        self.puzzle = puzzle
+        self.rules = [(rule.variables, compile_rule(rule)) for rule in puzzle.rules]
+
+    def open_variables(self, assigned):
+        """
+        variables from `assigned` that appear in some rule with a variable that is not assigned yet
+        """
+        open_vars = set()
+        for variables, _ in self.rules:
+            if any(var not in assigned for var in variables):
+                open_vars.update(var for var in variables if var in assigned)
+        return open_vars
+
+    def elimination_order(self, variables):
+        """
+        greedy low-width order of `variables`:
+        always assign the variable that leaves the fewest variables open (ties: the first one)
+        returns the order and its width (max number of open variables, including the one being assigned)
+        """
+        order, assigned, width = [], set(), 0
+        remaining = list(variables)
+        while remaining:
+            best, best_open = None, None
+            for var in remaining:
+                open_vars = self.open_variables(assigned | {var})
+                if best is None or len(open_vars) < len(best_open):
+                    best, best_open = var, open_vars
+            width = max(width, len(self.open_variables(assigned)) + 1)
+            order.append(best)
+            assigned.add(best)
+            remaining.remove(best)
+        return order, width
+
+    def count(self, possible_values=None, budget=None, limit=None):
+        """
+        count the solutions (capped at `limit` if given, the count itself is always exact)
+        reduce search space if `possible_values` is given
+        every rule evaluation is charged to `budget` (if given), which raises once it runs out
+        """
+        n = self.puzzle.n
+        all_values = set(range(1, n+1))
+        domains = {
+            var: set(possible_values[var]) if possible_values is not None else all_values
+            for var in self.puzzle.variables
+        }
+        rules = []
+        for variables, check in self.rules:
+            # rule without variables - either always or never holds
+            if not variables:
+                if not check():
+                    return 0
+                continue
+            rules.append((variables, check))
+        in_rules = {var for variables, _ in rules for var in variables}
+        free = [var for var in self.puzzle.variables if var not in in_rules and domains[var] == all_values]
+        order, _ = self.elimination_order([var for var in self.puzzle.variables if var not in free])
+        position = {var: i for i, var in enumerate(order)}
+        # rules to check at each step, and the last step at which each variable is needed
+        rules_at = [[] for _ in order]
+        last_needed = {var: position[var] for var in order}
+        for variables, check in rules:
+            last = max(position[var] for var in variables)
+            rules_at[last].append((variables, check))
+            for var in variables:
+                last_needed[var] = max(last_needed[var], last)
+
+        # (values of open variables, used values bitmask) -> number of partial assignments
+        states = {((), 0): 1}
+        open_vars = []
+        for step, var in enumerate(order):
+            new_open = [v for v in open_vars + [var] if last_needed[v] > step]
+            new_states = defaultdict(int)
+            for (values, mask), cnt in states.items():
+                assignment = dict(zip(open_vars, values))
+                for val in domains[var]:
+                    bit = 1 << (val-1)
+                    if mask & bit:
+                        continue
+                    assignment[var] = val
+                    ok = True
+                    for variables, check in rules_at[step]:
+                        if budget is not None:
+                            budget.charge_evaluations()
+                        if not check(*[assignment[v] for v in variables]):
+                            ok = False
+                            break
+                    if ok:
+                        new_states[(tuple(assignment[v] for v in new_open), mask | bit)] += cnt
+            if not new_states:
+                return 0
+            states, open_vars = new_states, new_open
+        cnt = sum(states.values()) * factorial(len(free))
+        return cnt if limit is None else min(cnt, limit)
+
+
+if __name__ == "__main__":
+    puzzle = Puzzle(8)
+    puzzle.add_rules([
+        "B+A=6",
+        "E+B=C",
+        "G>H",
+    ])
+    counter = EliminationCounter(puzzle)
+    print(counter.elimination_order(["A", "B", "C", "E", "G", "H"]))
+    print(counter.count())
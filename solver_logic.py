@@ -1,28 +1,48 @@
 import copy
+import time
 from collections import defaultdict
 
+from budget import Budget, BudgetExceeded, MAX_STEPS, SOLVED
 from puzzle import Puzzle
-from rule import Rule
+from rule import Rule, compile_rule, normalized_certain, normalized_implies, normalized_relation, rule_certain, rule_key, rule_possible
+from solver_brute import BruteForceSolver
+from stats import SolverStats
 
 
-def reduce_possible_values_by_rule(rule: Rule, possible_values):
+def reduce_possible_values_by_rule(rule: Rule, possible_values, budget=None):
     """
     reduce possible value sets according to a given rule
     for each variable in the rule and each value from its possible value set
     checks if it is actually viable to use that value considering all possible ways of other variables in the rule
     if a certain value is not viable, the value is removed from variable's possible value set
+    values that the bounds of the other variables already rule out are removed without trying any assignments
+    every rule evaluation is charged to `budget` (if given)
     """
     updated_possible_values = copy.deepcopy(possible_values)
+    check = compile_rule(rule)
     cont = True
     # repeat until not updated
     while cont:
         cont = False
+        # values that are part of some valid assignment found so far (valid until possible values change)
+        supported = defaultdict(set)
         # fix a variable in the rule to investigate
         for var_fixed in rule.variables:
             # we will save verified possible values here
             var_fixed_new_possible_values = set()
+            # bounds of the variables' possible values (none if some variable has no possible values left)
+            bounds = None
+            if all(updated_possible_values[var] for var in rule.variables):
+                bounds = {var: (min(updated_possible_values[var]), max(updated_possible_values[var])) for var in rule.variables}
             # fix a value for the variable from it possible value set
             for val_fixed in updated_possible_values[var_fixed]:
+                if val_fixed in supported[var_fixed]:
+                    var_fixed_new_possible_values.add(val_fixed)
+                    continue
+                if bounds is not None:
+                    bounds[var_fixed] = (val_fixed, val_fixed)
+                    if not rule_possible(rule, bounds):
+                        continue
                 # maintain set of used values (since values cannot be repeated) and chosen values for variables
                 used_values, chosen_values = {val_fixed}, {var_fixed: val_fixed}
 
@@ -31,7 +51,9 @@ def reduce_possible_values_by_rule(rule: Rule, possible_values):
                 def rec(ind):
                     # all variables are assigned, return whether they satisfy the rule
                     if ind == len(rule.variables):
-                        return rule.eval_rule(chosen_values)
+                        if budget is not None:
+                            budget.charge_evaluations()
+                        return check(*[chosen_values[var] for var in rule.variables])
                     # assign the next variable
                     else:
                         var = rule.variables[ind]
@@ -59,6 +81,8 @@ def reduce_possible_values_by_rule(rule: Rule, possible_values):
                 # if assignment was found, add the fixed value to new possible value set for the fixed variable
                 if rec(0):
                     var_fixed_new_possible_values.add(val_fixed)
+                    for var, val in chosen_values.items():
+                        supported[var].add(val)
 
             # break and repeat process if we had a successful update
             if var_fixed_new_possible_values != updated_possible_values[var_fixed]:
@@ -260,63 +284,288 @@ def apply_variable_expression(rule: Rule, var_expression: Rule):
     return Rule(rule_structured=rule_structured)
 
 
+def count_possible_values(possible_values):
+    """
+    total number of values in all possible value sets
+    """
+    return sum(len(vals) for vals in possible_values.values())
+
+
+def copy_solver_state(state):
+    """
+    copy of the `LogicBasedSolver.STATE_ATTRIBUTES` in `state` that shares nothing mutable with it except the rules
+    """
+    return {
+        "max_rules": state["max_rules"],
+        "max_expressions": state["max_expressions"],
+        "possible_values": {var: set(vals) for var, vals in state["possible_values"].items()},
+        "stats": copy.deepcopy(state["stats"]),
+        "rules": list(state["rules"]),
+        "rule_usage": [list(usage) if usage is not None else None for usage in state["rule_usage"]],
+        "rule_keys": set(state["rule_keys"]),
+        "normalized_rules": defaultdict(list, {
+            terms: list(relations) for terms, relations in state["normalized_rules"].items() if relations
+        }),
+        "variable_expressions": {var: set(expressions) for var, expressions in state["variable_expressions"].items()},
+        "expression_usage": {expression: list(usage) for expression, usage in state["expression_usage"].items()},
+        "variable_expression_keys": set(state["variable_expression_keys"]),
+        "steps_done": state["steps_done"],
+        "derivation_pending": state["derivation_pending"],
+        "stop_reason": state["stop_reason"],
+    }
+
+
 class LogicBasedSolver:
-    def __init__(self, puzzle: Puzzle, verbose=False):
+    """
+    solves puzzles step by step like a human would: reduce possible values by rules and subset strategies,
+    then express variables from equations and substitute them into rules to derive new rules
+    derived rules and variable expressions are kept in bounded stores (`max_rules`, `max_expressions`):
+    after each reduction pass the least useful ones beyond the capacity are evicted (see `evict_rules`),
+    original puzzle rules never are
+    (so new rules always get one pass, and the stores may exceed their capacity in between)
+    the solver state is kept between `solve` runs, so `solve(4)` after `solve(2)` only runs the two missing steps,
+    and it can be saved with `snapshot` and restored (e.g., in another process) with `from_snapshot`
+    """
+    # default capacities of the derived rule and variable expression stores (None for unbounded)
+    MAX_RULES = 100
+    MAX_EXPRESSIONS = 100
+    # strategies that reduce possible values without looking at the rules
+    SUBSET_STRATEGIES = {
+        "naked_subset": reduce_possible_values_by_naked_subset_strategy,
+        "hidden_subset": reduce_possible_values_by_hidden_subset_strategy,
+    }
+    # attributes that make up the state saved by `snapshot`
+    STATE_ATTRIBUTES = [
+        "max_rules", "max_expressions", "possible_values", "stats",
+        "rules", "rule_usage", "rule_keys", "normalized_rules",
+        "variable_expressions", "expression_usage", "variable_expression_keys",
+        "steps_done", "derivation_pending", "stop_reason",
+    ]
+
+    def __init__(self, puzzle: Puzzle, verbose=False, max_rules=MAX_RULES, max_expressions=MAX_EXPRESSIONS):
         self.puzzle = puzzle
         self.verbose = verbose
+        self.max_rules = max_rules
+        self.max_expressions = max_expressions
         self.possible_values = {
             variable: set(range(1, self.puzzle.n+1))
             for variable in self.puzzle.variables
         }
+        # per-strategy counters and timers, accumulated over all `solve` runs
+        self.stats = SolverStats()
         self.rules = []
-        self.rule_hashes = set()
+        # usefulness of the rules, aligned with `self.rules`: [values pruned, step of last pruning (or of adding)]
+        # for derived rules, None for original puzzle rules
+        self.rule_usage = []
+        # normalized keys of the rules (see `rule_key`), evicted rules keep theirs so that they are not derived again
+        self.rule_keys = set()
+        # normalized polynomial relations of the rules by their terms, to find subsumed rules
+        self.normalized_rules = defaultdict(list)
         for rule in self.puzzle.rules:
-            self.add_new_rule(rule)
+            self.add_new_rule(rule, derived=False)
         self.variable_expressions = {
             variable: set()
             for variable in self.puzzle.variables
         }
-        self.variable_expression_hashes = set()
+        # usefulness of the variable expressions: {expression: [derived rules kept, step of last kept rule (or of adding)]}
+        self.expression_usage = {}
+        # simplified strings of all expressions ever added (string hashes differ between processes,
+        # so they would not survive a snapshot)
+        self.variable_expression_keys = set()
+        # completed steps (reduction passes) over all `solve` runs,
+        # and whether the derivation of new rules that follows the last one is still to be done
+        self.steps_done = 0
+        self.derivation_pending = False
+        # budget of the current/last `solve` run and the reason why it stopped
+        self.budget = Budget()
+        self.stop_reason = None
 
-    def add_new_rule(self, rule: Rule):
+    def snapshot(self):
         """
-        add new rule if it is not already present
+        picklable copy of the solver state: puzzle, possible values, rules and expressions (with their usage),
+        step counter and stats (the rules themselves are shared, they are never modified)
         """
-        h = rule.__hash__()
-        if h not in self.rule_hashes:
-            self.rules.append(rule)
-            self.rule_hashes.add(h)
-            return True
-        return False
+        state = {attr: getattr(self, attr) for attr in self.STATE_ATTRIBUTES}
+        return dict(copy_solver_state(state), puzzle=self.puzzle)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, verbose=False):
+        """
+        solver in the state of `snapshot` (see `snapshot`), the next `solve` continues from there
+        """
+        solver = cls.__new__(cls)
+        solver.puzzle = snapshot["puzzle"]
+        solver.verbose = verbose
+        solver.budget = Budget()
+        solver.restore(snapshot)
+        return solver
+
+    def restore(self, snapshot):
+        """
+        reset the solver to the state of `snapshot` (taken from a solver of the same puzzle)
+        the snapshot itself is left intact, so it can be restored again
+        """
+        for attr, value in copy_solver_state(snapshot).items():
+            setattr(self, attr, value)
+
+    def add_new_rule(self, rule: Rule, derived=True):
+        """
+        add new rule unless it's redundant:
+          - duplicate: same as a present rule up to normalization (e.g., "2*A=2*B" and "B=A")
+          - subsumed: implied by a present rule on the same terms (e.g., "A+B>4" by "A+B=6")
+          - trivial: always holds given the current possible values (e.g., "A>B" when A is in 4..5 and B in 1..3)
+        the reason for dropping a rule is recorded in stats
+        a derived rule is charged to the budget before it is added, so that it's not kept if that exceeds the budget
+        """
+        reason = self.redundancy_reason(rule)
+        if reason is None and derived:
+            self.budget.charge_derived_rules()
+        self.stats.record_rule(reason)
+        if reason is not None:
+            return False
+        self.rules.append(rule)
+        self.rule_usage.append([0, len(self.stats.steps)] if derived else None)
+        self.rule_keys.add(rule_key(rule))
+        normalized = normalized_relation(rule.rule)
+        if normalized is not None:
+            self.normalized_rules[normalized[1]].append(normalized)
+        return True
+
+    def evict_rules(self):
+        """
+        evict derived rules beyond `max_rules`, least useful first:
+        those that pruned values least recently (never pruning rules count from when they were added),
+        then those that pruned fewer values
+        """
+        derived = [ind for ind, usage in enumerate(self.rule_usage) if usage is not None]
+        if self.max_rules is None or len(derived) <= self.max_rules:
+            return
+        derived.sort(key=lambda ind: (self.rule_usage[ind][1], self.rule_usage[ind][0]))
+        evicted = set(derived[:len(derived) - self.max_rules])
+        for ind in evicted:
+            rule = self.rules[ind]
+            normalized = normalized_relation(rule.rule)
+            if normalized is not None:
+                self.normalized_rules[normalized[1]].remove(normalized)
+            self.stats.record_eviction("rules", self.rule_usage[ind][0])
+            if self.verbose:
+                print("evicted rule:", rule)
+        self.rules = [rule for ind, rule in enumerate(self.rules) if ind not in evicted]
+        self.rule_usage = [usage for ind, usage in enumerate(self.rule_usage) if ind not in evicted]
+
+    def evict_variable_expressions(self):
+        """
+        evict variable expressions beyond `max_expressions`, least useful first
+        (same order as `evict_rules`, usefulness being the number of derived rules that were kept)
+        """
+        if self.max_expressions is None or len(self.expression_usage) <= self.max_expressions:
+            return
+        ordered = sorted(
+            ((var, expression) for var, expressions in self.variable_expressions.items() for expression in expressions),
+            key=lambda item: (self.expression_usage[item[1]][1], self.expression_usage[item[1]][0]),
+        )
+        for var, expression in ordered[:len(ordered) - self.max_expressions]:
+            self.variable_expressions[var].remove(expression)
+            self.stats.record_eviction("expressions", self.expression_usage.pop(expression)[0])
+            if self.verbose:
+                print("evicted variable expression:", expression)
+
+    def redundancy_reason(self, rule: Rule):
+        """
+        why the rule is redundant given the present rules and possible values, None if it isn't
+        """
+        if rule_key(rule) in self.rule_keys:
+            return "duplicate"
+        normalized = normalized_relation(rule.rule)
+        if normalized is not None:
+            if normalized_certain(normalized):
+                return "trivial"
+            terms = normalized[1]
+            negated_terms = tuple((monomial, -coef) for monomial, coef in terms)
+            for present in self.normalized_rules[terms] + self.normalized_rules[negated_terms]:
+                if normalized_implies(present, normalized):
+                    return "subsumed"
+        if all(self.possible_values[var] for var in rule.variables):
+            bounds = {var: (min(self.possible_values[var]), max(self.possible_values[var])) for var in rule.variables}
+            if rule_certain(rule, bounds):
+                return "trivial"
+        return None
 
     def add_new_variable_expression(self, var, variable_expression: Rule):
         """
         add new rule if it is not already present
         """
-        h = variable_expression.__hash__()
-        if h not in self.variable_expression_hashes:
+        key = variable_expression.get_simplified_str()
+        if key not in self.variable_expression_keys:
             self.variable_expressions[var].add(variable_expression)
-            self.variable_expression_hashes.add(h)
+            self.expression_usage[variable_expression] = [0, len(self.stats.steps)]
+            self.variable_expression_keys.add(key)
             return True
         return False
 
-    def solve(self, max_steps=None):
-        steps = 0
-        while True:
-            steps += 1
-            self.reduce_possible_values()
-            if all(len(vals) == 1 for vals in self.possible_values.values()):
-                if self.verbose:
-                    print("we are done")
-                    print(self.possible_values)
-                return True, self.possible_values
-            if max_steps is not None and steps == max_steps:
-                if self.verbose:
-                    print("fail")
-                    print(self.possible_values)
-                return False, self.possible_values
-            self.try_expressing_variables()
-            self.try_applying_variable_expressions()
+    def solve(self, max_steps=None, budget: Budget = None, return_stats=False):
+        """
+        solve by logic, step by step, until solved or `max_steps` is reached
+        steps of earlier runs count towards `max_steps`: the run continues where the last one stopped
+        `budget` can limit wall-clock time and work (rule evaluations, derived rules) of the run
+        if anything runs out, the possible values reduced so far are returned as a partial result
+        the reason for stopping is stored in `self.stop_reason`
+        with `return_stats` the solver's `SolverStats` are returned as the third element of the result
+        """
+        ok, possible_values = self.solve_steps(max_steps=max_steps, budget=budget)
+        if return_stats:
+            return ok, possible_values, self.stats
+        return ok, possible_values
+
+    def solve_steps(self, max_steps=None, budget: Budget = None):
+        self.budget = budget if budget is not None else Budget()
+        # solved by an earlier run
+        if self.stop_reason == SOLVED:
+            return True, self.possible_values
+        self.stop_reason = None
+        try:
+            while True:
+                if max_steps is not None and self.steps_done >= max_steps:
+                    if self.verbose:
+                        print("fail")
+                        print(self.possible_values)
+                    self.stop_reason = MAX_STEPS
+                    return False, self.possible_values
+                if self.derivation_pending:
+                    self.derive_rules()
+                    self.derivation_pending = False
+                self.stats.start_step()
+                self.reduce_possible_values()
+                # every rule has had a reduction pass (and every expression has been applied) by now,
+                # so their usefulness is known
+                self.evict_rules()
+                self.evict_variable_expressions()
+                self.steps_done += 1
+                if all(len(vals) == 1 for vals in self.possible_values.values()):
+                    if self.verbose:
+                        print("we are done")
+                        print(self.possible_values)
+                    self.stop_reason = SOLVED
+                    return True, self.possible_values
+                self.derivation_pending = True
+        except BudgetExceeded as e:
+            if self.verbose:
+                print("out of budget:", e.reason)
+                print(self.possible_values)
+            self.stop_reason = e.reason
+            return False, self.possible_values
+
+    def iter_solutions(self, max_steps=2, budget: Budget = None):
+        """
+        lazily enumerate solutions as tuples of values in the order of `puzzle.variables`
+        first reduces possible values by `max_steps` steps of logic, then enumerates what is left
+        raises `BudgetExceeded` if the budget runs out
+        """
+        _, possible_values = self.solve(max_steps=max_steps, budget=budget)
+        if self.stop_reason not in [SOLVED, MAX_STEPS]:
+            raise BudgetExceeded(self.stop_reason)
+        bfs = BruteForceSolver(self.puzzle)
+        return bfs.iter_solutions(possible_values=possible_values, budget=self.budget)
 
     def reduce_possible_values(self):
         """
@@ -327,33 +576,77 @@ class LogicBasedSolver:
         while cont:
             cont = False
             # try reducing by rules
-            for rule in self.rules:
-                updated, updated_possible_values = reduce_possible_values_by_rule(rule, self.possible_values)
-                if updated:
-                    if self.verbose:
-                        print("reduced by rule:", rule, ",", self.possible_values, "==>", updated_possible_values)
-                    self.possible_values = updated_possible_values
+            for rule, usage in zip(self.rules, self.rule_usage):
+                if self.reduce_by_rule(rule, usage):
                     cont = True
                     break
-            # try reducing by naked subset strategy
-            updated, updated_possible_values = reduce_possible_values_by_naked_subset_strategy(self.possible_values)
-            if updated:
-                if self.verbose:
-                    print("reduced by naked subset strategy:", self.possible_values, "==>", updated_possible_values)
-                self.possible_values = updated_possible_values
-                cont = True
-            # try reducing by hidden subset strategy
-            updated, updated_possible_values = reduce_possible_values_by_hidden_subset_strategy(self.possible_values)
-            if updated:
-                if self.verbose:
-                    print("reduced by hidden subset strategy:", self.possible_values, "==>", updated_possible_values)
-                self.possible_values = updated_possible_values
-                cont = True
+            # try reducing by naked and hidden subset strategies
+            for strategy in self.SUBSET_STRATEGIES:
+                if self.reduce_by_subsets(strategy):
+                    cont = True
+
+    def reduce_by_rule(self, rule: Rule, usage):
+        """
+        reduce possible value sets by a single rule (`usage` being its entry of `rule_usage`)
+        returns whether any value was removed
+        """
+        start, evaluations = time.perf_counter(), self.budget.evaluations
+        updated, updated_possible_values = reduce_possible_values_by_rule(rule, self.possible_values, self.budget)
+        self.record_reduction("rule", start, evaluations, updated, updated_possible_values)
+        if updated and usage is not None:
+            usage[0] += count_possible_values(self.possible_values) - count_possible_values(updated_possible_values)
+            usage[1] = len(self.stats.steps)
+        if updated:
+            if self.verbose:
+                print("reduced by rule:", rule, ",", self.possible_values, "==>", updated_possible_values)
+            self.possible_values = updated_possible_values
+        return updated
+
+    def reduce_by_subsets(self, strategy):
+        """
+        reduce possible value sets by one of the `SUBSET_STRATEGIES`
+        returns whether any value was removed
+        """
+        start = time.perf_counter()
+        updated, updated_possible_values = self.SUBSET_STRATEGIES[strategy](self.possible_values)
+        self.record_reduction(strategy, start, None, updated, updated_possible_values)
+        if updated:
+            if self.verbose:
+                print("reduced by {name} strategy:".format(name=strategy.replace("_", " ")),
+                      self.possible_values, "==>", updated_possible_values)
+            self.possible_values = updated_possible_values
+        return updated
+
+    def record_reduction(self, strategy, start, evaluations, updated, updated_possible_values):
+        """
+        record a call of a reduction strategy started at `start` (with `evaluations` rule evaluations done before)
+        """
+        self.stats.record(
+            strategy,
+            time.perf_counter() - start,
+            values_eliminated=(
+                count_possible_values(self.possible_values) - count_possible_values(updated_possible_values)
+                if updated else 0
+            ),
+            evaluations=self.budget.evaluations - evaluations if evaluations is not None else 0,
+        )
+
+    def derive_rules(self):
+        """
+        express variables from equations and substitute the expressions into the rules
+        returns the newly added rules
+        """
+        num_rules = len(self.rules)
+        self.budget.check_deadline()
+        self.try_expressing_variables()
+        self.try_applying_variable_expressions()
+        return self.rules[num_rules:]
 
     def try_expressing_variables(self):
         """
         go through all rules and try to express each variable
         """
+        start = time.perf_counter()
         new_expressions = []
         for rule in self.rules:
             if rule.rule["op"] != "=":
@@ -361,30 +654,54 @@ class LogicBasedSolver:
             for var, cnt in rule.variable_counts.items():
                 if cnt != 1:
                     continue
+                self.budget.check_deadline()
                 new_expression = express_variable_from_rule(rule, var)
                 if new_expression is not None and new_expression.is_ok():
                     new_expressions.append((var, new_expression))
+        added_cnt = 0
         for var, new_expression in new_expressions:
             added = self.add_new_variable_expression(var, new_expression)
+            added_cnt += added
             if added and self.verbose:
                 print("new variable expression:", new_expression)
-                
+        self.stats.record(
+            "express_variables",
+            time.perf_counter() - start,
+            rules_derived=added_cnt,
+            rules_deduplicated=len(new_expressions) - added_cnt,
+        )
+
     def try_applying_variable_expressions(self):
         """
         go through all rules and try to apply each variable expression to generate new rules
-        :return: 
         """
+        start = time.perf_counter()
         new_rules = []
         for rule in self.rules:
             for var in rule.variables:
                 for var_expression in self.variable_expressions[var]:
+                    self.budget.check_deadline()
                     new_rule = apply_variable_expression(rule, var_expression)
                     if new_rule.is_ok():
-                        new_rules.append(new_rule)
-        for new_rule in new_rules:
-            added = self.add_new_rule(new_rule)
-            if added and self.verbose:
-                print("new rule:", new_rule)
+                        new_rules.append((new_rule, var_expression))
+        added_cnt = 0
+        try:
+            for new_rule, var_expression in new_rules:
+                added = self.add_new_rule(new_rule)
+                if added:
+                    added_cnt += 1
+                    usage = self.expression_usage[var_expression]
+                    usage[0] += 1
+                    usage[1] = len(self.stats.steps)
+                    if self.verbose:
+                        print("new rule:", new_rule)
+        finally:
+            self.stats.record(
+                "apply_variable_expressions",
+                time.perf_counter() - start,
+                rules_derived=added_cnt,
+                rules_deduplicated=len(new_rules) - added_cnt,
+            )
 
 
 if __name__ == "__main__":
@@ -410,4 +727,8 @@ if __name__ == "__main__":
     #     "D + A = C",
     # ])
     lbs = LogicBasedSolver(puzzle, verbose=True)
-    lbs.solve(5)
+    lbs.solve(2)
+    # continue in a copy restored from a (pickled) snapshot, as another process would
+    import pickle
+    resumed = LogicBasedSolver.from_snapshot(pickle.loads(pickle.dumps(lbs.snapshot())), verbose=True)
+    resumed.solve(5)
@@ -0,0 +1,204 @@
+from itertools import product
+
+from puzzle import Puzzle
+from rule import Rule, compile_rule, rule_possible
+
+
+class SearchSolver:
+    """
+    backtracking search with constraint propagation
+    never enumerates all assignments, so it scales to puzzles with many variables (n = 12-20 and beyond):
+      - all different: a fixed variable's value is removed from all other variables,
+        and a value that fits only a single variable is assigned to it
+      - rules: values without support among the rule's other variables are removed
+        (only for rules with few enough value combinations, the rest only get values removed
+        that the bounds of the other variables rule out)
+      - branching on the variable with the fewest possible values (ties: the one in most rules)
+    `negated_rules` are rules that must NOT hold (e.g., to look for a solution that breaks a rule)
+    """
+    # rules are propagated only if the product of their variables' possible value set sizes is at most this
+    MAX_PROPAGATION_PRODUCT = 256
+
+    def __init__(self, puzzle: Puzzle, negated_rules=None):
+        self.puzzle = puzzle
+        self.variables = list(puzzle.variables)
+        self.var_index = {var: i for i, var in enumerate(self.variables)}
+        # constraints as (variable indices, check function of the variables' values, rule for bounds or None)
+        self.constraints = []
+        for rule in puzzle.rules:
+            self.add_constraint(rule, compile_rule(rule), rule)
+        for rule in negated_rules or []:
+            f = compile_rule(rule)
+            self.add_constraint(rule, lambda *values, f=f: not f(*values), None)
+        self.constraints_by_var = [[] for _ in self.variables]
+        for constraint in self.constraints:
+            for i in constraint[0]:
+                self.constraints_by_var[i].append(constraint)
+        self.budget = None
+
+    def add_constraint(self, rule: Rule, check, bounds_rule):
+        self.constraints.append(([self.var_index[var] for var in rule.variables], check, bounds_rule))
+
+    def revise(self, constraint, domains):
+        """
+        remove values without support from the constraint's variables
+        (a value is supported if some assignment of distinct values to the other variables satisfies the constraint)
+        returns the set of indices of updated variables, or None if some variable ran out of values
+        """
+        indices, check, _ = constraint
+        doms = [domains[i] for i in indices]
+        size = 1
+        for vals in doms:
+            size *= len(vals)
+        if size > self.MAX_PROPAGATION_PRODUCT:
+            return self.revise_bounds(constraint, domains)
+        # every satisfying assignment found supports all of its values at once
+        supported = [set() for _ in indices]
+        evaluations = 0
+        for k in range(len(indices)):
+            for val in doms[k]:
+                if val in supported[k]:
+                    continue
+                for vals in product(*[(val, ) if j == k else doms[j] for j in range(len(indices))]):
+                    if len(set(vals)) < len(vals):
+                        continue
+                    evaluations += 1
+                    if check(*vals):
+                        for j, v in enumerate(vals):
+                            supported[j].add(v)
+                        break
+        if self.budget is not None:
+            self.budget.charge_evaluations(evaluations)
+        updated = set()
+        for k, i in enumerate(indices):
+            if len(supported[k]) != len(doms[k]):
+                if not supported[k]:
+                    return None
+                domains[i] = supported[k]
+                updated.add(i)
+        return updated
+
+    def revise_bounds(self, constraint, domains):
+        """
+        cheap version of `revise` for rules with too many value combinations:
+        remove values for which the rule can't hold given just the bounds of the other variables
+        """
+        indices, _, rule = constraint
+        if rule is None:
+            return set()
+        bounds = {self.variables[i]: (min(domains[i]), max(domains[i])) for i in indices}
+        updated = set()
+        for i in indices:
+            var = self.variables[i]
+            kept = set()
+            for val in domains[i]:
+                bounds[var] = (val, val)
+                if rule_possible(rule, bounds):
+                    kept.add(val)
+            if not kept:
+                return None
+            bounds[var] = (min(kept), max(kept))
+            if len(kept) != len(domains[i]):
+                domains[i] = kept
+                updated.add(i)
+        return updated
+
+    def propagate(self, domains, changed):
+        """
+        propagate changes of the variables with indices `changed` until nothing changes
+        `domains` is updated in place (sets are replaced, never mutated, so that copies of the list can share them)
+        returns False if the domains turn out to be inconsistent
+        """
+        n = len(domains)
+        pending = set(changed)
+        # domains each constraint was last revised with, no need to revise again while they stay the same
+        revised = {}
+        while True:
+            while pending:
+                i = pending.pop()
+                # all different: a fixed variable's value is taken
+                if len(domains[i]) == 1:
+                    val = next(iter(domains[i]))
+                    for j in range(n):
+                        if j != i and val in domains[j]:
+                            domains[j] = domains[j] - {val}
+                            if not domains[j]:
+                                return False
+                            pending.add(j)
+                for constraint in self.constraints_by_var[i]:
+                    doms = [domains[j] for j in constraint[0]]
+                    if id(constraint) in revised and all(a is b for a, b in zip(revised[id(constraint)], doms)):
+                        continue
+                    updated = self.revise(constraint, domains)
+                    revised[id(constraint)] = [domains[j] for j in constraint[0]]
+                    if updated is None:
+                        return False
+                    pending |= updated
+            # all different: every value has to be taken by some variable
+            val_to_vars = {}
+            for i, vals in enumerate(domains):
+                for val in vals:
+                    val_to_vars.setdefault(val, []).append(i)
+            if len(val_to_vars) < n:
+                return False
+            for val, indices in val_to_vars.items():
+                if len(indices) == 1 and len(domains[indices[0]]) > 1:
+                    domains[indices[0]] = {val}
+                    pending.add(indices[0])
+            if not pending:
+                return True
+
+    def iter_solutions(self, possible_values=None, budget=None):
+        """
+        lazily enumerate solutions as tuples of values in the order of `puzzle.variables`
+        reduce search space if `possible_values` is given
+        every rule evaluation is charged to `budget` (if given), which raises once it runs out
+        """
+        self.budget = budget
+        domains = [
+            set(possible_values[var]) if possible_values is not None else set(range(1, self.puzzle.n+1))
+            for var in self.variables
+        ]
+        if any(not vals for vals in domains) or not self.propagate(domains, range(len(domains))):
+            return
+        yield from self.rec(domains)
+
+    def rec(self, domains):
+        # branch on the variable with the fewest possible values
+        best, best_key = None, None
+        for i, vals in enumerate(domains):
+            if len(vals) > 1:
+                key = (len(vals), -len(self.constraints_by_var[i]))
+                if best is None or key < best_key:
+                    best, best_key = i, key
+        # everything fixed - a solution
+        if best is None:
+            yield tuple(next(iter(vals)) for vals in domains)
+            return
+        for val in sorted(domains[best]):
+            domains_new = list(domains)
+            domains_new[best] = {val}
+            if self.propagate(domains_new, [best]):
+                yield from self.rec(domains_new)
+
+    def solve(self, possible_values=None, budget=None, limit=None):
+        """
+        count the number of solutions (up to `limit` if given), also return one of the solutions
+        """
+        cnt, last_solution = 0, None
+        for solution in self.iter_solutions(possible_values=possible_values, budget=budget):
+            cnt += 1
+            last_solution = dict(zip(self.variables, solution))
+            if limit is not None and cnt == limit:
+                break
+        return cnt, last_solution
+
+
+if __name__ == "__main__":
+    puzzle = Puzzle(5)
+    puzzle.add_rules([
+        "B+A=6",
+        "E+B=C",
+        "E+C+B=8",
+    ])
+    print(SearchSolver(puzzle).solve())
@@ -0,0 +1,195 @@
+from itertools import permutations
+from math import factorial
+
+from puzzle import Puzzle
+from rule import Rule, compile_rule, rule_key
+
+
+# largest puzzle size with a table (8! = 40320 assignments, about 5 kB per mask)
+MAX_TABLE_N = 8
+# rule masks kept per table, the cache is cleared once full
+MASK_CACHE_SIZE = 4096
+
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+
+class PermutationTable:
+    """
+    all n! assignments of a puzzle size in lexicographic order, as bit positions of python integers:
+    a mask has bit i set iff the i-th assignment has some property (e.g., satisfies a rule)
+    the masks of rules are cached by normalized rule (see `rule_key`), so a rule that appears in many puzzles
+    (or in several forms, e.g., "2A=2B" and "B=A") is evaluated only once, and solving a puzzle is just
+    intersecting the masks of its rules
+    """
+    def __init__(self, n):
+        if n > MAX_TABLE_N:
+            raise ValueError("no permutation table for n={n} (at most {max_n})".format(n=n, max_n=MAX_TABLE_N))
+        self.n = n
+        self.size = factorial(n)
+        self.all_mask = (1 << self.size) - 1
+        self.position = {var: ind for ind, var in enumerate(Puzzle(n).variables)}
+        # value_masks[position][value]: assignments with the value at the position
+        self.value_masks = []
+        for column in zip(*permutations(range(1, n+1))):
+            column = bytes(column)
+            masks = [0]
+            for val in range(1, n+1):
+                # one digit per assignment, reversed so that assignment i is bit i
+                digits = column.translate(bytes(0x31 if b == val else 0x30 for b in range(256)))
+                masks.append(int(digits[::-1], 2))
+            self.value_masks.append(masks)
+        self.masks = {}
+        # number of rule masks asked for and computed (the rest came from the cache)
+        self.lookups = 0
+        self.computed = 0
+
+    def rule_mask(self, rule: Rule, budget=None):
+        """
+        mask of the assignments that satisfy the rule, through the cache
+        every rule evaluation is charged to `budget` (if given)
+        """
+        self.lookups += 1
+        key = rule_key(rule)
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = self.compute_rule_mask(rule, budget=budget)
+            if len(self.masks) >= MASK_CACHE_SIZE:
+                self.masks.clear()
+            self.masks[key] = mask
+            self.computed += 1
+        return mask
+
+    def compute_rule_mask(self, rule: Rule, budget=None):
+        """
+        evaluate the rule once per assignment of distinct values to its own variables (n!/(n-k)! for k variables)
+        and combine the masks of the assignments that satisfy it
+        """
+        check = compile_rule(rule)
+        if not rule.variables:
+            return self.all_mask if check() else 0
+        positions = [self.position[var] for var in rule.variables]
+        values, result = [], 0
+
+        def rec(partial):
+            nonlocal result
+            if len(values) == len(positions):
+                if budget is not None:
+                    budget.charge_evaluations()
+                if check(*values):
+                    result |= partial
+                return
+            masks = self.value_masks[positions[len(values)]]
+            for val in range(1, self.n+1):
+                if val in values:
+                    continue
+                values.append(val)
+                rec(partial & masks[val])
+                values.pop()
+
+        rec(self.all_mask)
+        return result
+
+    def puzzle_mask(self, puzzle: Puzzle, budget=None):
+        """
+        mask of the solutions of the puzzle
+        """
+        mask = self.all_mask
+        for rule in puzzle.rules:
+            mask &= self.rule_mask(rule, budget=budget)
+            if not mask:
+                break
+        return mask
+
+    def assignment(self, ind):
+        """
+        the `ind`-th assignment (in lexicographic order) as a tuple of values
+        """
+        available = list(range(1, self.n+1))
+        values = []
+        for i in range(self.n, 0, -1):
+            block = factorial(i-1)
+            values.append(available.pop(ind // block))
+            ind %= block
+        return tuple(values)
+
+    def iter_assignments(self, mask):
+        """
+        lazily enumerate the assignments in `mask` (in lexicographic order)
+        """
+        while mask:
+            low = mask & -mask
+            yield self.assignment(low.bit_length() - 1)
+            mask ^= low
+
+
+# one table per puzzle size in this (worker) process, shared by all puzzles of that size
+_tables = {}
+
+
+def open_table(n):
+    """
+    permutation table for puzzles of size `n`, built once per process
+    """
+    if n not in _tables:
+        _tables[n] = PermutationTable(n)
+    return _tables[n]
+
+
+class TableSolver:
+    """
+    solves puzzles by intersecting rule masks over the shared permutation table of their size
+    """
+    def __init__(self, puzzle: Puzzle, table: PermutationTable = None):
+        self.puzzle = puzzle
+        self.table = table if table is not None else open_table(puzzle.n)
+
+    def iter_solutions(self, budget=None):
+        """
+        lazily enumerate solutions as tuples of values in the order of `puzzle.variables`
+        """
+        return self.table.iter_assignments(self.table.puzzle_mask(self.puzzle, budget=budget))
+
+    def count(self, budget=None, limit=None):
+        cnt = popcount(self.table.puzzle_mask(self.puzzle, budget=budget))
+        return cnt if limit is None else min(cnt, limit)
+
+
+def solve_puzzles(puzzles, budget=None):
+    """
+    solve a batch of puzzles (of any sizes up to `MAX_TABLE_N`) over the shared tables
+    returns a (solution count, first solution tuple or None) pair per puzzle
+    each distinct rule of the batch is evaluated once, no matter how many puzzles it appears in
+    """
+    results = []
+    for puzzle in puzzles:
+        table = open_table(puzzle.n)
+        mask = table.puzzle_mask(puzzle, budget=budget)
+        results.append((popcount(mask), next(table.iter_assignments(mask), None)))
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from run import iter_input
+    from solutions import count_solutions
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/input7x7.txt"
+    with open(path, "r") as fin:
+        puzzles = []
+        for puzzle_raw in iter_input(fin):
+            puzzle = Puzzle(puzzle_raw["n"])
+            puzzle.add_rules(rules_str=puzzle_raw["rules"])
+            puzzles.append(puzzle)
+    start = time.perf_counter()
+    solve_puzzles(puzzles)
+    batch_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for puzzle in puzzles:
+        count_solutions(puzzle)
+    single_time = time.perf_counter() - start
+    table = open_table(puzzles[0].n)
+    print("{cnt} puzzles: batch {batch:.3f}s ({computed}/{lookups} rule masks computed), one by one {single:.3f}s".format(
+        cnt=len(puzzles), batch=batch_time, computed=table.computed, lookups=table.lookups, single=single_time,
+    ))
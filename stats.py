@@ -0,0 +1,303 @@
+import math
+import statistics
+
+
+def percentile(values, p):
+    """
+    nearest-rank percentile of a non-empty list of values
+    """
+    values = sorted(values)
+    ind = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[ind]
+
+
+def summarize(timings):
+    """
+    summary statistics of a list of timings (seconds)
+    """
+    return {
+        "count": len(timings),
+        "total": sum(timings),
+        "median": statistics.median(timings),
+        "p90": percentile(timings, 90),
+        "p99": percentile(timings, 99),
+        "max": max(timings),
+    }
+
+
+class StrategyStats:
+    """
+    counters of a single strategy
+    """
+    __slots__ = ["calls", "time", "values_eliminated", "evaluations", "rules_derived", "rules_deduplicated"]
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.values_eliminated = 0
+        self.evaluations = 0
+        self.rules_derived = 0
+        self.rules_deduplicated = 0
+
+    def add(self, elapsed, values_eliminated=0, evaluations=0, rules_derived=0, rules_deduplicated=0):
+        self.calls += 1
+        self.time += elapsed
+        self.values_eliminated += values_eliminated
+        self.evaluations += evaluations
+        self.rules_derived += rules_derived
+        self.rules_deduplicated += rules_deduplicated
+
+    def merge(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SolverStats:
+    """
+    per-strategy and per-step counters and timers of the logical solver
+    cheap enough to be always on: a couple of counter updates and a clock read per strategy call
+    """
+    STRATEGIES = [
+        "rule",
+        "naked_subset",
+        "hidden_subset",
+        "express_variables",
+        "apply_variable_expressions",
+    ]
+    # reasons for a rule not to be added to the solver (see `LogicBasedSolver.add_new_rule`)
+    RULE_DROP_REASONS = ["duplicate", "subsumed", "trivial"]
+    # bounded stores of the solver that evict their least useful items (see `LogicBasedSolver.evict_rules`)
+    EVICTING_STORES = ["rules", "expressions"]
+
+    def __init__(self):
+        self.strategies = {strategy: StrategyStats() for strategy in self.STRATEGIES}
+        # one {strategy: StrategyStats} dict per solver step
+        self.steps = []
+        # rules (original and derived) offered to the solver and those dropped, by reason
+        self.rules_considered = 0
+        self.rules_dropped = {reason: 0 for reason in self.RULE_DROP_REASONS}
+        # evicted items by store, how many of them had been useful at all, and their total usefulness
+        # (values pruned by evicted rules, derived rules kept from evicted expressions) - the pruning power given up
+        self.evicted = {store: 0 for store in self.EVICTING_STORES}
+        self.evicted_useful = {store: 0 for store in self.EVICTING_STORES}
+        self.evicted_usefulness = {store: 0 for store in self.EVICTING_STORES}
+
+    def __str__(self):
+        return "<SolverStats: {steps} steps, dedup {dedup:.1%}, {strategies}>".format(
+            steps=len(self.steps),
+            dedup=self.dedup_rate(),
+            strategies=", ".join(
+                "{strategy}: {calls} calls / {time:.4f}s / -{values} values".format(
+                    strategy=strategy, calls=s.calls, time=s.time, values=s.values_eliminated,
+                )
+                for strategy, s in self.strategies.items() if s.calls
+            ),
+        )
+
+    def start_step(self):
+        self.steps.append({})
+
+    def record(self, strategy, elapsed, values_eliminated=0, evaluations=0, rules_derived=0, rules_deduplicated=0):
+        """
+        record a single call of `strategy`
+        """
+        self.strategies[strategy].add(elapsed, values_eliminated, evaluations, rules_derived, rules_deduplicated)
+        if self.steps:
+            step = self.steps[-1]
+            if strategy not in step:
+                step[strategy] = StrategyStats()
+            step[strategy].add(elapsed, values_eliminated, evaluations, rules_derived, rules_deduplicated)
+
+    def record_rule(self, drop_reason=None):
+        """
+        record a rule offered to the solver, `drop_reason` if it was not added
+        """
+        self.rules_considered += 1
+        if drop_reason is not None:
+            self.rules_dropped[drop_reason] += 1
+
+    def record_eviction(self, store, usefulness):
+        """
+        record an item evicted from `store` with its usefulness until then
+        """
+        self.evicted[store] += 1
+        self.evicted_useful[store] += usefulness > 0
+        self.evicted_usefulness[store] += usefulness
+
+    def dedup_rate(self):
+        """
+        fraction of the offered rules that were dropped
+        """
+        if not self.rules_considered:
+            return 0.0
+        return sum(self.rules_dropped.values()) / self.rules_considered
+
+    def merge(self, other):
+        """
+        add up the totals of another stats object (e.g., to aggregate over a batch of puzzles)
+        """
+        for strategy, s in other.strategies.items():
+            self.strategies[strategy].merge(s)
+        self.rules_considered += other.rules_considered
+        for reason, cnt in other.rules_dropped.items():
+            self.rules_dropped[reason] += cnt
+        for store in self.EVICTING_STORES:
+            self.evicted[store] += other.evicted[store]
+            self.evicted_useful[store] += other.evicted_useful[store]
+            self.evicted_usefulness[store] += other.evicted_usefulness[store]
+
+    def as_dict(self):
+        return {
+            "strategies": {strategy: s.as_dict() for strategy, s in self.strategies.items()},
+            "rules_considered": self.rules_considered,
+            "rules_dropped": dict(self.rules_dropped),
+            "evicted": dict(self.evicted),
+            "evicted_useful": dict(self.evicted_useful),
+            "evicted_usefulness": dict(self.evicted_usefulness),
+            "steps": [{strategy: s.as_dict() for strategy, s in step.items()} for step in self.steps],
+        }
+
+
+class PortfolioStats:
+    """
+    outcomes of portfolio races (see `portfolio.py`): wins and winning times of each engine by puzzle class
+    once a class has seen enough races, its best engine can be used on its own, without racing
+    """
+    def __init__(self):
+        # {puzzle class: {engine: wins}} and {puzzle class: {engine: total winning time}}
+        self.wins = {}
+        self.win_time = {}
+        # races without any definitive answer (all engines failed or timed out), by puzzle class
+        self.unanswered = {}
+
+    def __str__(self):
+        return "<PortfolioStats: {races} races, {classes}>".format(
+            races=sum(sum(wins.values()) for wins in self.wins.values()) + sum(self.unanswered.values()),
+            classes=", ".join(
+                "{puzzle_class}: {best}".format(puzzle_class=puzzle_class, best=self.best_engine(puzzle_class, 1))
+                for puzzle_class in sorted(self.wins.keys())
+            ),
+        )
+
+    def record(self, puzzle_class, engine, elapsed):
+        """
+        record a race of a puzzle of `puzzle_class`, won by `engine` in `elapsed` seconds (engine None if no one won)
+        """
+        if engine is None:
+            self.unanswered[puzzle_class] = self.unanswered.get(puzzle_class, 0) + 1
+            return
+        wins = self.wins.setdefault(puzzle_class, {})
+        win_time = self.win_time.setdefault(puzzle_class, {})
+        wins[engine] = wins.get(engine, 0) + 1
+        win_time[engine] = win_time.get(engine, 0.0) + elapsed
+
+    def best_engine(self, puzzle_class, min_races=5):
+        """
+        engine with the most wins on `puzzle_class` (ties: lower mean winning time),
+        None if the class has fewer than `min_races` won races
+        """
+        wins = self.wins.get(puzzle_class, {})
+        if sum(wins.values()) < min_races:
+            return None
+        return min(wins, key=lambda engine: (-wins[engine], self.win_time[puzzle_class][engine] / wins[engine]))
+
+    def merge(self, other):
+        for puzzle_class, wins in other.wins.items():
+            for engine, cnt in wins.items():
+                self.wins.setdefault(puzzle_class, {})
+                self.win_time.setdefault(puzzle_class, {})
+                self.wins[puzzle_class][engine] = self.wins[puzzle_class].get(engine, 0) + cnt
+                self.win_time[puzzle_class][engine] = (
+                    self.win_time[puzzle_class].get(engine, 0.0) + other.win_time[puzzle_class][engine]
+                )
+        for puzzle_class, cnt in other.unanswered.items():
+            self.unanswered[puzzle_class] = self.unanswered.get(puzzle_class, 0) + cnt
+
+    def as_dict(self):
+        return {"wins": self.wins, "win_time": self.win_time, "unanswered": self.unanswered}
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        stats.wins = {puzzle_class: dict(wins) for puzzle_class, wins in d.get("wins", {}).items()}
+        stats.win_time = {puzzle_class: dict(times) for puzzle_class, times in d.get("win_time", {}).items()}
+        stats.unanswered = dict(d.get("unanswered", {}))
+        return stats
+
+
+class GeneratorStats:
+    """
+    counters and timers of the generator's stages
+    can be merged to aggregate over a batch (e.g., per weight preset and n)
+    """
+    __slots__ = [
+        # built, abandoned (out of budget) and successful candidates
+        "candidates",
+        "candidates_abandoned",
+        "puzzles",
+        # random rule sampling
+        "rules_sampled",
+        "sampling_time",
+        # rule outcomes in `reduce_until_unique`
+        "rules_accepted",
+        "rules_rejected_not_ok",
+        "rules_rejected_no_solution",
+        "rules_rejected_no_reduction",
+        # solution counting
+        "solution_count_calls",
+        "solution_count_time",
+        # `drop_redundant_rules` (its time includes the solution counting it does, which is also recorded separately)
+        "drop_iterations",
+        "rules_dropped",
+        "drop_time",
+        "drop_solution_count_time",
+        # logic solvability checks
+        "logic_checks",
+        "logic_failures",
+        "logic_check_time",
+        # total time spent on generating
+        "total_time",
+    ]
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0.0 if name.endswith("_time") else 0)
+
+    def __str__(self):
+        return "<GeneratorStats: {puzzles} puzzles from {candidates} candidates, {stages}>".format(
+            puzzles=self.puzzles,
+            candidates=self.candidates,
+            stages=", ".join(
+                "{stage}: {time:.3f}s".format(stage=stage, time=t) for stage, t in self.stage_times().items()
+            ),
+        )
+
+    def stage_times(self):
+        """
+        time spent in each stage, the stages don't overlap:
+        solution counting while dropping rules is part of "drop_redundant", "solution_count" is the rest
+        """
+        return {
+            "sampling": self.sampling_time,
+            "solution_count": self.solution_count_time - self.drop_solution_count_time,
+            "drop_redundant": self.drop_time,
+            "logic_check": self.logic_check_time,
+        }
+
+    def merge(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        for name in cls.__slots__:
+            if name in d:
+                setattr(stats, name, d[name])
+        return stats
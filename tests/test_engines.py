@@ -0,0 +1,90 @@
+"""
+cross-check every solving engine against brute force on the bundled puzzles and their relaxed versions
+(the last one or two rules dropped, so that there are several solutions to agree on)
+solution sets, exact counts (`count_solutions`) and batch results of the table engine (`solve_puzzles`) are compared
+
+    python tests/test_engines.py
+"""
+import glob
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from puzzle import Puzzle  # noqa: E402
+from run import read_input  # noqa: E402
+from solutions import ENGINES, count_solutions, iter_solutions  # noqa: E402
+from solver_brute import BruteForceSolver  # noqa: E402
+from solver_table import MAX_TABLE_N, solve_puzzles  # noqa: E402
+
+
+# relaxed versions of each puzzle: rules dropped from the end
+RELAXED = 2
+
+
+def iter_puzzles():
+    """
+    the bundled puzzles and their relaxed versions, with a name for reporting
+    """
+    for path in sorted(glob.glob(os.path.join(ROOT, "data", "input*x*.txt"))):
+        for ind, puzzle_raw in enumerate(read_input(path)):
+            full = Puzzle(puzzle_raw["n"])
+            full.add_rules(rules_str=puzzle_raw["rules"])
+            for dropped in range(min(RELAXED, len(full.rules) - 1) + 1):
+                name = "{file}#{ind}-{dropped}".format(file=os.path.basename(path), ind=ind, dropped=dropped)
+                yield name, Puzzle.with_rules(full.n, full.rules[:len(full.rules) - dropped])
+
+
+def check_puzzle(puzzle: Puzzle):
+    """
+    mismatches of the engines with brute force on the puzzle, as (engine, found, expected) tuples
+    """
+    expected = sorted(BruteForceSolver(puzzle).iter_solutions())
+    mismatches = []
+    for engine in sorted(ENGINES.keys()):
+        found = sorted(iter_solutions(puzzle, engine=engine))
+        if found != expected:
+            mismatches.append((engine, len(found), len(expected)))
+    cnt = count_solutions(puzzle)
+    if cnt != len(expected):
+        mismatches.append(("count", cnt, len(expected)))
+    return mismatches, expected
+
+
+def cross_check(verbose=False):
+    """
+    returns the number of puzzles checked and the list of mismatches (name, engine, found, expected)
+    """
+    checked, mismatches = 0, []
+    batch, batch_expected = [], []
+    for name, puzzle in iter_puzzles():
+        puzzle_mismatches, expected = check_puzzle(puzzle)
+        mismatches.extend((name,) + mismatch for mismatch in puzzle_mismatches)
+        if puzzle.n <= MAX_TABLE_N:
+            batch.append((name, puzzle))
+            batch_expected.append((len(expected), expected[0] if expected else None))
+        checked += 1
+        if verbose and puzzle_mismatches:
+            print("MISMATCH", name, puzzle_mismatches)
+    # the whole collection as one batch over the shared tables
+    results = solve_puzzles([puzzle for _, puzzle in batch])
+    for (name, _), result, expected in zip(batch, results, batch_expected):
+        if result != expected:
+            mismatches.append((name, "table batch", result[0], expected[0]))
+            if verbose:
+                print("MISMATCH", name, "table batch", result, expected)
+    return checked, mismatches
+
+
+def test_engines_agree_with_brute_force():
+    _, mismatches = cross_check()
+    assert not mismatches, mismatches
+
+
+if __name__ == "__main__":
+    checked, mismatches = cross_check(verbose=True)
+    print("cross-checked {checked} puzzles with {engines}, {cnt} mismatches".format(
+        checked=checked, engines=", ".join(sorted(ENGINES.keys())), cnt=len(mismatches),
+    ))
+    sys.exit(1 if mismatches else 0)